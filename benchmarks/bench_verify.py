@@ -0,0 +1,116 @@
+"""
+    benchmarks of the verification hot path
+
+    run with:
+
+        pytest benchmarks [--keys=10000,100000,1000000] [--backends=memory,cache]
+
+    every benchmark runs for each backend & number of keys in the database.
+    Single requests are timed per call, the threaded & multi-process ones
+    time a batch of REQUESTS requests per worker, see extra_info for the
+    totals.  Results are saved to .benchmarks/, compare runs with
+    --benchmark-compare.
+"""
+import random
+import itertools
+import threading
+import multiprocessing
+
+import pytest
+
+WORKERS = 4
+REQUESTS = 1000
+# cold keys are chosen from this many keys, more than the limit cache holds
+COLD_KEYS = 10000
+
+
+def _verify():
+    from simplekeys.verifier import verify
+    return verify
+
+
+def _cold_keys(keys):
+    sample = random.Random(0).sample(keys, min(len(keys), COLD_KEYS))
+    return itertools.cycle(sample)
+
+
+def bench_hot_key(benchmark, backend, keys):
+    verify = _verify()
+    benchmark(verify, keys[0], 'default')
+
+
+def bench_cold_keys(benchmark, backend, keys):
+    verify = _verify()
+    cold = _cold_keys(keys)
+    benchmark(lambda: verify(next(cold), 'default'))
+
+
+def bench_verify_request(benchmark, backend, keys):
+    from django.test import RequestFactory
+    from simplekeys.verifier import verify_request
+    request = RequestFactory().get('/', HTTP_X_API_KEY=keys[0])
+    assert verify_request(request, 'default') is None
+    benchmark(verify_request, request, 'default')
+
+
+@pytest.mark.parametrize('pattern', ['hot', 'cold'])
+def bench_threads(benchmark, backend, keys, pattern):
+    verify = _verify()
+
+    def worker(worker_keys):
+        for key in itertools.islice(worker_keys, REQUESTS):
+            verify(key, 'default')
+
+    def run():
+        threads = [
+            threading.Thread(target=worker, args=(
+                itertools.repeat(keys[0]) if pattern == 'hot'
+                else _cold_keys(keys),
+            ))
+            for _ in range(WORKERS)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    benchmark.extra_info.update(workers=WORKERS, requests=WORKERS * REQUESTS)
+    benchmark.pedantic(run, rounds=5, warmup_rounds=1)
+
+
+def _process_worker(keys, pattern):
+    verify = _verify()
+    worker_keys = (itertools.repeat(keys[0]) if pattern == 'hot'
+                   else _cold_keys(keys))
+    for key in itertools.islice(worker_keys, REQUESTS):
+        verify(key, 'default')
+
+
+@pytest.mark.parametrize('pattern', ['hot', 'cold'])
+def bench_processes(benchmark, backend, keys, pattern):
+    """
+        only the shared_memory backend (and redis or cache backed by a real
+        server) share counts between processes, but every backend's cost per
+        request is measured
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('requires fork')
+    from django.db import connections
+    context = multiprocessing.get_context('fork')
+    # only pass workers the keys they can use
+    worker_keys = keys[:1] if pattern == 'hot' else keys[:COLD_KEYS]
+
+    def run():
+        # forked workers must open their own database connections
+        connections.close_all()
+        processes = [context.Process(target=_process_worker,
+                                     args=(worker_keys, pattern))
+                     for _ in range(WORKERS)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+            assert p.exitcode == 0
+
+    benchmark.extra_info.update(workers=WORKERS, requests=WORKERS * REQUESTS)
+    benchmark.pedantic(run, rounds=3, warmup_rounds=1)
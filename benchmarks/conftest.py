@@ -0,0 +1,133 @@
+"""
+    configures Django for the benchmarks against a throwaway sqlite database,
+    see bench_verify.py
+"""
+import os
+import sys
+import tempfile
+
+import django
+import pytest
+from django.conf import settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from example import settings as example_settings  # noqa: E402
+
+BACKENDS = ('memory', 'cache', 'redis', 'shared_memory')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('simplekeys')
+    group.addoption('--keys', default='10000',
+                    help='comma-separated numbers of keys in the database to '
+                         'benchmark against, e.g. 10000,100000,1000000')
+    group.addoption('--backends', default=','.join(BACKENDS),
+                    help='comma-separated backends to benchmark, from ' +
+                         ', '.join(BACKENDS))
+
+
+def pytest_configure(config):
+    if settings.configured:
+        return
+    conf = {name: getattr(example_settings, name)
+            for name in dir(example_settings) if name.isupper()}
+    conf['DEBUG'] = False
+    conf['DATABASES'] = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+        }
+    }
+    conf['CACHES'] = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10 ** 7},
+        }
+    }
+    # a real Memcached or Redis server can stand in for the defaults
+    if os.environ.get('SIMPLEKEYS_BENCH_MEMCACHED'):
+        conf['CACHES']['default'] = {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ['SIMPLEKEYS_BENCH_MEMCACHED'],
+        }
+    if os.environ.get('SIMPLEKEYS_BENCH_REDIS_URL'):
+        conf['SIMPLEKEYS_REDIS_URL'] = os.environ['SIMPLEKEYS_BENCH_REDIS_URL']
+    conf['SIMPLEKEYS_SHARED_MEMORY_PATH'] = os.path.join(
+        tempfile.mkdtemp(), 'simplekeys'
+    )
+    settings.configure(**conf)
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def pytest_generate_tests(metafunc):
+    if 'key_count' in metafunc.fixturenames:
+        counts = sorted(int(n) for n in
+                        metafunc.config.getoption('keys').split(','))
+        metafunc.parametrize('key_count', counts, scope='session',
+                             ids=['{}keys'.format(n) for n in counts])
+    if 'backend' in metafunc.fixturenames:
+        metafunc.parametrize(
+            'backend', metafunc.config.getoption('backends').split(','),
+            indirect=True
+        )
+
+
+def _make_backend(name):
+    from simplekeys import backends
+    if name == 'memory':
+        return backends.MemoryBackend()
+    elif name == 'cache':
+        return backends.CacheBackend()
+    elif name == 'shared_memory':
+        return backends.SharedMemoryBackend()
+    elif name == 'redis':
+        if os.environ.get('SIMPLEKEYS_BENCH_REDIS_URL'):
+            return backends.RedisBackend()
+        fakeredis = pytest.importorskip('fakeredis')
+        return backends.RedisBackend(client=fakeredis.FakeRedis())
+    raise ValueError('unknown backend {}'.format(name))
+
+
+@pytest.fixture
+def backend(request, monkeypatch):
+    """
+        the rate limit backend verify() uses for the benchmark
+    """
+    from simplekeys import verifier
+    backend = _make_backend(request.param)
+    monkeypatch.setattr(verifier, 'backend', backend)
+    yield backend
+    if hasattr(backend, 'close'):
+        backend.close()
+
+
+@pytest.fixture(scope='session')
+def keys(key_count):
+    """
+        ensure key_count active keys exist, returns their key strings
+
+        key counts are benchmarked in ascending order, so each count only
+        adds the keys the previous one was missing
+    """
+    from simplekeys.models import Tier, Zone, Key
+
+    tier, _ = Tier.objects.get_or_create(slug='bench', name='Bench')
+    zone, _ = Zone.objects.get_or_create(slug='default', name='Default')
+    # generous enough that benchmarks measure the checks, not rejections
+    tier.limits.get_or_create(zone=zone, defaults=dict(
+        quota_period='d', quota_requests=10 ** 9,
+        requests_per_second=10 ** 6, burst_size=10 ** 6,
+    ))
+
+    existing = Key.objects.count()
+    Key.objects.bulk_create(
+        (Key(key='key{}'.format(i), status='a', tier=tier,
+             email='key{}@example.com'.format(i), name='Key {}'.format(i))
+         for i in range(existing, key_count)),
+        batch_size=5000,
+    )
+    return ['key{}'.format(i) for i in range(key_count)]
@@ -14,12 +14,18 @@ setup(
     long_description=open('README.rst').read(),
     platforms=["any"],
     install_requires=[
-        "Django",
+        "Django>=4.1",
     ],
     extras_require={
+        'redis': [
+            'redis',
+        ],
         'dev': [
             'freezegun',
+            'fakeredis[lua]',
             'flake8',
+            'pytest',
+            'pytest-benchmark',
             'sphinx',
             'sphinx-rtd-theme',
         ]
@@ -33,8 +39,9 @@ setup(
         'Programming Language :: Python',
         'Environment :: Web Environment',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 )
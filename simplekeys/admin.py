@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Tier, Zone, Limit, Key
+from .models import Tier, Zone, Limit, Key, Usage
 
 
 @admin.register(Key)
@@ -29,3 +29,11 @@ class TierAdmin(admin.ModelAdmin):
     inlines = [
         LimitInline,
     ]
+
+
+@admin.register(Usage)
+class UsageAdmin(admin.ModelAdmin):
+    list_display = ('key', 'zone', 'date', 'requests')
+    list_filter = ('zone',)
+    search_fields = ('key',)
+    date_hierarchy = 'date'
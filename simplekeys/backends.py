@@ -1,33 +1,425 @@
-import time
+import os
+import base64
+import zlib
+import struct
+import hashlib
+import tempfile
 import itertools
 import datetime
-from collections import Counter
+import threading
+import contextlib
+from collections import Counter, OrderedDict, namedtuple
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from .models import Zone, Key
+from . import clock
+
+
+RATE_LIMIT_ALGORITHMS = ('token_bucket', 'gcra')
+QUOTA_WINDOWS = ('fixed', 'sliding')
+
+# tokens, timestamp of a bucket stored in the compact cache format
+BUCKET_STATE = struct.Struct('<dd')
+
+# quota_period -> (sub-windows, seconds per sub-window) of sliding quotas
+SLIDING_WINDOWS = {
+    'd': (24, 60 * 60),
+    'm': (30, 24 * 60 * 60),
+}
+
+# pseudo-zone a key's tier-wide bucket & quota are stored under, zone slugs
+# can't contain '*'
+TIER_ZONE = '*'
+
+
+def refill(tokens, last_time, now, limit):
+    """
+        returns the number of tokens in a bucket holding tokens as of
+        last_time once it has been refilled up to now
+    """
+    if last_time is None:
+        # if this is the first time, fill the bucket
+        return limit.burst_size
+    # increment bucket, careful not to overfill
+    return min(tokens + limit.requests_per_second * (now - last_time),
+               limit.burst_size)
+
+
+def gcra(tat, now, limit, cost=1):
+    """
+        generic cell rate algorithm, equivalent to a token bucket but only
+        storing the bucket's theoretical arrival time (tat)
+
+        tat is kept in integer microseconds so that repeatedly adding the
+        emission interval doesn't accumulate float error
+
+        returns new_tat, tokens
+            new_tat is the tat to store, or None if there weren't cost tokens
+            tokens is the number of tokens the equivalent bucket holds after
+            the request
+    """
+    now = int(now * 1000000)
+    interval = gcra_interval(limit)
+    if tat is None or tat < now:
+        tat = now
+    tokens = limit.burst_size - (tat - now) / interval
+    if tokens < cost:
+        return None, tokens
+    return tat + interval * cost, tokens - cost
+
+
+def usage_dates(days):
+    """
+        the last days dates (including today) as quota ranges, newest first
+    """
+    today = datetime.date.today()
+    return [(today - datetime.timedelta(days=d)).strftime('%Y%m%d')
+            for d in range(days)]
+
+
+def chunked(iterable, size):
+    """
+        yield lists of up to size items from iterable
+    """
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+class QuotaWindow(namedtuple('QuotaWindow', 'period slot limit',
+                             defaults=(None,))):
+    """
+        a sliding quota's current sub-window, used in place of a quota range
+
+        the quota is counted in a ring of SLIDING_WINDOWS[period] sub-window
+        counters stored as a single value per key & zone, slot is the number
+        of the current sub-window since the epoch.  If limit is set amounts
+        are only counted while the window's total stays within it, so that
+        rejected requests don't hold the quota down.  Formats as the suffix
+        the ring is stored under, which is the same for every slot.
+    """
+
+    @classmethod
+    def current(cls, period, limit=None):
+        return cls(period, int(clock.time() // SLIDING_WINDOWS[period][1]),
+                   limit)
+
+    @property
+    def slots(self):
+        return SLIDING_WINDOWS[self.period][0]
+
+    @property
+    def seconds(self):
+        return SLIDING_WINDOWS[self.period][1]
+
+    @property
+    def length(self):
+        """ seconds the whole window spans, how long a ring must be kept """
+        return self.slots * self.seconds
+
+    def __str__(self):
+        return 'w' + self.period
+
+
+class WindowTotal(int):
+    """
+        a sliding quota's total as backends return it, carrying the ring it
+        was counted in (see window_add) so that when the quota resets can
+        be worked out without reading it again, see window_reset
+
+        arithmetic on it gives a plain int, without a ring
+    """
+
+    def __new__(cls, total, ring=None):
+        value = super(WindowTotal, cls).__new__(cls, total)
+        value.ring = ring
+        return value
+
+
+def window_slide(ring, window):
+    """
+        returns ring as a list with the sub-windows that have slid out of
+        window cleared, see window_add
+    """
+    slots = window.slots
+    if ring is None or window.slot - ring[0] >= slots:
+        return [window.slot] + [0] * slots
+    ring = list(ring)
+    for slot in range(ring[0] + 1, window.slot + 1):
+        ring[slot % slots + 1] = 0
+    ring[0] = max(ring[0], window.slot)
+    return ring
+
+
+def windows_add(rings, windows, amount):
+    """
+        window_add amount to each of rings, counting it in all of them or
+        in none if any window's total would go over its limit
+
+        returns new rings, the total of each window's counters (as a
+        WindowTotal), plus amount if it went over a limit so it wasn't
+        counted
+    """
+    rings = [window_slide(ring, window)
+             for ring, window in zip(rings, windows)]
+    totals = [sum(ring[1:]) for ring in rings]
+    fits = all(window.limit is None or total + amount <= window.limit
+               for window, total in zip(windows, totals))
+    for i, (ring, window) in enumerate(zip(rings, windows)):
+        if not fits:
+            totals[i] += amount
+        elif ring[0] - window.slot < window.slots:
+            # amounts for a slot that has already slid out are dropped
+            ring[window.slot % window.slots + 1] += amount
+            totals[i] += amount
+    rings = [tuple(ring) for ring in rings]
+    return rings, [WindowTotal(total, ring)
+                   for total, ring in zip(totals, rings)]
+
+
+def window_add(ring, window, amount):
+    """
+        count amount in window's sub-window of ring, a tuple of the latest
+        slot counted followed by a counter for each sub-window (or None)
+
+        sub-windows that have slid out of the window are cleared first, and
+        amounts for a slot that has already slid out are dropped.  Nothing
+        is counted if it would take the total over window's limit.
+
+        returns new ring, the total of the window's counters (plus amount
+        if it wasn't counted for going over the limit)
+    """
+    rings, totals = windows_add([ring], [window], amount)
+    return rings[0], totals[0]
+
+
+def window_reset(ring, window, amount=0):
+    """
+        returns the seconds until enough of ring's counts have slid out of
+        window for amount more to fit within its limit, and at least until
+        the oldest sub-window with any counts has slid out
+
+        without a ring (None) this is the longest it could be, once the
+        current sub-window has slid out
+    """
+    ring = window_slide(ring, window)
+    slots = window.slots
+    excess = 1
+    if window.limit is not None:
+        excess = max(sum(ring[1:]) + amount - window.limit, 1)
+    for slot in range(ring[0] - slots + 1, ring[0] + 1):
+        excess -= ring[slot % slots + 1]
+        if excess <= 0:
+            break
+    # otherwise slot is the latest, once everything counted has slid out
+    return (slot + slots) * window.seconds - clock.time()
+
+
+def decode_bucket(value):
+    """
+        returns tokens, timestamp from a stored bucket, packed or not
+    """
+    if value is None:
+        return 0, None
+    if isinstance(value, bytes):
+        return BUCKET_STATE.unpack(value)
+    return value
+
+
+def decode_ring(value):
+    """
+        returns a sliding quota ring as a tuple, from a packed ring or not
+    """
+    if isinstance(value, bytes):
+        return struct.unpack('<q{}I'.format((len(value) - 8) // 4), value)
+    return value
+
+
+def gcra_interval(limit):
+    """ microseconds between requests at limit's sustained rate """
+    return max(int(round(1000000 / limit.requests_per_second)), 1)
 
 
 class AbstractBackend(object):
-    def get_tokens_and_timestamp(self, kz):
+    def __init__(self):
+        self.algorithm = getattr(settings, 'SIMPLEKEYS_RATE_LIMIT_ALGORITHM',
+                                 'token_bucket')
+        if self.algorithm not in RATE_LIMIT_ALGORITHMS:
+            raise ImproperlyConfigured(
+                'SIMPLEKEYS_RATE_LIMIT_ALGORITHM must be one of {}'.format(
+                    ', '.join(RATE_LIMIT_ALGORITHMS))
+            )
+        self.quota_window = getattr(settings, 'SIMPLEKEYS_QUOTA_WINDOW',
+                                    'fixed')
+        if self.quota_window not in QUOTA_WINDOWS:
+            raise ImproperlyConfigured(
+                'SIMPLEKEYS_QUOTA_WINDOW must be one of {}'.format(
+                    ', '.join(QUOTA_WINDOWS))
+            )
+
+    def get_tokens_and_timestamp(self, key, zone):
         """
-            returns token_count, timestamp for kz
+            returns token_count, timestamp for key & zone
 
             if not found return (0, None)
         """
         raise NotImplementedError()
 
-    def set_token_count(self, kz, tokens):
+    def set_token_count(self, key, zone, tokens):
+        """
+            set counter for key & zone & timestamp to current time
+        """
+        raise NotImplementedError()
+
+    def get_tat(self, key, zone):
+        """
+            returns theoretical arrival time for key & zone (gcra only)
+
+            if not found return None
+        """
+        raise NotImplementedError()
+
+    def set_tat(self, key, zone, tat):
         """
-            set counter for kz & timestamp to current time
+            set theoretical arrival time for key & zone (gcra only)
         """
         raise NotImplementedError()
 
-    def get_and_inc_quota_value(self, key, zone, quota_range):
+    def get_and_inc_quota_value(self, key, zone, quota_range, amount=1):
         """
-            increment & get quota value
+            increment quota value by amount & get new value
             (value will increase regardless of validity)
+
+            quota_range may be a QuotaWindow, whose value is the total of
+            its sliding window as a WindowTotal, amount isn't counted if it
+            would take that over the window's limit (see window_add)
         """
         raise NotImplementedError()
 
+    def inc_quota_values(self, counts):
+        """
+            get_and_inc_quota_value for each of a list of (key, zone,
+            quota_range, amount), returns a list of the new values
+
+            by default counts are incremented one by one, backends that can
+            batch round trips to their storage should override it
+        """
+        return [self.get_and_inc_quota_value(*count) for count in counts]
+
+    def check_and_consume(self, key, zone, limit, quota_range, cost=1,
+                          quota_cost=None, tier_limit=None,
+                          tier_quota_range=None):
+        """
+            refill key & zone's token bucket according to limit and try to
+            take cost tokens from it, if that succeeds increment the quota
+            value for quota_range by quota_cost (defaults to cost)
+
+            a quota_cost of 0 leaves the quota untouched, returning its
+            current value
+
+            when using gcra the bucket is a theoretical arrival time, but
+            tokens are still reported as if it were a token bucket
+
+            returns tokens, quota_value
+                tokens is the number of tokens left in the bucket
+                quota_value is the incremented quota value, or None if
+                there weren't enough tokens available (quota is left
+                untouched).  For a sliding quota it's a WindowTotal, so
+                the verifier needn't read the ring again for its reset
+
+            if tier_limit is given the key's tier-wide bucket (stored under
+            TIER_ZONE) must also have cost tokens, and its quota for
+            tier_quota_range is incremented too.  Either both buckets are
+            consumed or neither is, and tokens, quota_value, tier_tokens,
+            tier_quota_value is returned.  Sliding quotas are likewise
+            counted in both windows or neither, see windows_add.
+
+            by default this is built upon the methods above, backends that
+            can do this in a single operation should override it
+        """
+        if quota_cost is None:
+            quota_cost = cost
+        buckets = [(zone, limit, quota_range)]
+        if tier_limit is not None:
+            buckets.append((TIER_ZONE, tier_limit, tier_quota_range))
+
+        # (bucket state to store or None if short of tokens, tokens)
+        taken = []
+        now = clock.time()
+        for bucket_zone, bucket_limit, _ in buckets:
+            if self.algorithm == 'gcra':
+                taken.append(gcra(self.get_tat(key, bucket_zone), now,
+                                  bucket_limit, cost))
+                continue
+            tokens, last_time = self.get_tokens_and_timestamp(key,
+                                                              bucket_zone)
+            # now try to decrement count
+            tokens = refill(tokens, last_time, now, bucket_limit)
+            if tokens < cost:
+                taken.append((None, tokens))
+            else:
+                taken.append((tokens - cost, tokens - cost))
+
+        if any(state is None for state, _ in taken):
+            # nothing is consumed, report the tokens each bucket holds
+            return sum(((tokens if state is None else tokens + cost, None)
+                        for state, tokens in taken), ())
+
+        over = None
+        if len(buckets) > 1 and isinstance(quota_range, QuotaWindow):
+            # a sliding quota only counts requests that fit in every window
+            totals = [self.get_and_inc_quota_value(key, bucket_zone,
+                                                   bucket_range, 0)
+                      for bucket_zone, _, bucket_range in buckets]
+            if any(bucket_range.limit is not None and
+                   total + quota_cost > bucket_range.limit
+                   for (_, _, bucket_range), total in zip(buckets, totals)):
+                over = [WindowTotal(total + quota_cost,
+                                    getattr(total, 'ring', None))
+                        for total in totals]
+
+        result = ()
+        for i, ((bucket_zone, _, bucket_range), (state, tokens)) in enumerate(
+                zip(buckets, taken)):
+            if self.algorithm == 'gcra':
+                self.set_tat(key, bucket_zone, state)
+            else:
+                self.set_token_count(key, bucket_zone, tokens)
+            result += (tokens, over[i] if over is not None else
+                       self.get_and_inc_quota_value(key, bucket_zone,
+                                                    bucket_range, quota_cost))
+        return result
+
+    def check_and_consume_many(self, requests):
+        """
+            check_and_consume for each of a list of (key, zone, limit,
+            quota_range, cost, quota_cost, tier_limit, tier_quota_range)
+            requests, in order
+
+            returns a list of what check_and_consume returned for each
+
+            by default requests are checked one by one, backends that can
+            batch round trips to their storage should override it
+        """
+        return [self.check_and_consume(*request) for request in requests]
+
+    async def acheck_and_consume(self, key, zone, limit, quota_range,
+                                 cost=1, quota_cost=None, tier_limit=None,
+                                 tier_quota_range=None):
+        """
+            async version of check_and_consume
+
+            by default check_and_consume is run in a thread, backends that
+            can talk to their storage asynchronously should override it
+        """
+        return await sync_to_async(self.check_and_consume)(
+            key, zone, limit, quota_range, cost, quota_cost, tier_limit,
+            tier_quota_range
+        )
+
     def get_usage(self, keys=None, days=7):
         """
             get usage in a nested dictionary
@@ -43,67 +435,1184 @@ class AbstractBackend(object):
             such that result['apikey']['20170501']['default'] is equal to the
             number of requests made by 'apikey' to 'default' zone endpoints on
             May 1, 2017.
+
+            this holds every key in memory at once, use iter_usage for large
+            reports
+        """
+        dates = usage_dates(days)
+        if not keys:
+            keys = Key.objects.all().values_list('key', flat=True)
+
+        result = {k: {d: Counter() for d in dates} for k in keys}
+        for key, zone, date, requests in self.iter_usage(keys, days=days):
+            result[key][date][zone] = requests
+        return result
+
+    def iter_usage(self, keys=None, zones=None, days=7, chunk_size=1000):
+        """
+            yields key, zone, date, requests for each recorded count
+
+            keys (default: all keys) are looked up chunk_size at a time so
+            that memory use is bounded however many keys there are, zones
+            (default: all zones) limits the zones reported on
+        """
+        dates = usage_dates(days)
+        if not zones:
+            zones = list(Zone.objects.all().values_list('slug', flat=True))
+        if not keys:
+            keys = Key.objects.all().values_list('key', flat=True).iterator(
+                chunk_size=chunk_size
+            )
+        for chunk in chunked(keys, chunk_size):
+            yield from self.get_usage_chunk(chunk, zones, dates)
+
+    def get_usage_chunk(self, keys, zones, dates):
+        """
+            returns key, zone, date, requests for each recorded count for
+            the given keys, zones & dates (as quota ranges)
         """
         raise NotImplementedError()
 
 
+class _MemoryShard(object):
+    """
+        one lock stripe of MemoryBackend's data
+    """
+
+    def __init__(self, max_buckets, usage_days):
+        self.lock = threading.RLock()
+        self.max_buckets = max_buckets
+        self.usage_days = usage_days
+        # (key, zone) -> (tokens, timestamp) or tat, least recently used first
+        self.buckets = OrderedDict()
+        # key -> quota_range -> zone -> count
+        self.quota = {}
+        # len(quota_range) -> most recent quota_range seen
+        self.latest_ranges = {}
+        # (key, zone, period) -> sliding quota ring
+        self.windows = {}
+        # period -> most recent sliding quota slot seen
+        self.latest_slots = {}
+
+    def get_bucket(self, kz, default):
+        value = self.buckets.get(kz)
+        if value is None:
+            return default
+        self.buckets.move_to_end(kz)
+        return value
+
+    def set_bucket(self, kz, value):
+        self.buckets[kz] = value
+        self.buckets.move_to_end(kz)
+        if len(self.buckets) > self.max_buckets:
+            # evict the bucket that has been idle longest, if it comes back
+            # it will start out full
+            self.buckets.popitem(last=False)
+
+    def inc_quota(self, key, zone, quota_range, amount):
+        if isinstance(quota_range, QuotaWindow):
+            return self.inc_window(key, zone, quota_range, amount)
+        # daily & monthly ranges have different lengths, once a newer range
+        # of a given length is seen the older ones have ended
+        latest = self.latest_ranges.get(len(quota_range))
+        if latest is None or quota_range > latest:
+            self.latest_ranges[len(quota_range)] = quota_range
+            if latest is not None:
+                self.purge_quota(len(quota_range),
+                                 self.oldest_kept(quota_range))
+        zones = self.quota.setdefault(key, {}).setdefault(quota_range, {})
+        value = zones.get(zone, 0) + amount
+        zones[zone] = value
+        return value
+
+    def inc_window(self, key, zone, window, amount):
+        latest = self.latest_slots.get(window.period)
+        if latest is None or window.slot > latest:
+            self.latest_slots[window.period] = window.slot
+            if latest is not None:
+                # drop rings that have slid out of their window entirely
+                for kzp in [kzp for kzp, ring in self.windows.items()
+                            if kzp[2] == window.period and
+                            window.slot - ring[0] >= window.slots]:
+                    del self.windows[kzp]
+        kzp = (key, zone, window.period)
+        self.windows[kzp], value = window_add(self.windows.get(kzp), window,
+                                              amount)
+        return value
+
+    def oldest_kept(self, current_range):
+        """
+            daily counts are kept for usage_days for get_usage, others only
+            for the current period
+        """
+        if len(current_range) != 8:
+            return current_range
+        day = datetime.datetime.strptime(current_range, '%Y%m%d')
+        return (day - datetime.timedelta(days=self.usage_days - 1)).strftime(
+            '%Y%m%d'
+        )
+
+    def purge_quota(self, range_length, oldest_range):
+        for key in list(self.quota):
+            periods = self.quota[key]
+            for quota_range in [qr for qr in periods
+                                if len(qr) == range_length and
+                                qr < oldest_range]:
+                del periods[quota_range]
+            if not periods:
+                del self.quota[key]
+
+    def usage_rows(self, key, zones, dates):
+        periods = self.quota.get(key, {})
+        return [(key, zone, date, periods[date][zone])
+                for zone in zones for date in dates
+                if zone in periods.get(date, ())]
+
+
 class MemoryBackend(AbstractBackend):
+    """
+        keeps buckets & quotas in this process's memory
+
+        data is split into SIMPLEKEYS_MEMORY_SHARDS shards by key, each with
+        its own lock, and at most SIMPLEKEYS_MEMORY_MAX_BUCKETS buckets are
+        tracked with the longest idle evicted first.  Daily quota counters
+        are kept for SIMPLEKEYS_MEMORY_USAGE_DAYS days for get_usage, monthly
+        ones are dropped once their month has ended.
+    """
+
     def __init__(self):
+        super(MemoryBackend, self).__init__()
+        self.num_shards = getattr(settings, 'SIMPLEKEYS_MEMORY_SHARDS', 16)
+        self.max_buckets = getattr(settings, 'SIMPLEKEYS_MEMORY_MAX_BUCKETS',
+                                   100000)
+        self.usage_days = getattr(settings, 'SIMPLEKEYS_MEMORY_USAGE_DAYS', 7)
         self.reset()
 
     def reset(self):
-        self._counter = {}
-        self._last_replenished = {}
-        self._quota = Counter()
+        per_shard = max(-(-self.max_buckets // self.num_shards), 1)
+        self._shards = [_MemoryShard(per_shard, self.usage_days)
+                        for _ in range(self.num_shards)]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % self.num_shards]
 
     def get_tokens_and_timestamp(self, key, zone):
-        kz = (key, zone)
-        return self._counter.get(kz, 0), self._last_replenished.get(kz)
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.get_bucket((key, zone), (0, None))
 
     def set_token_count(self, key, zone, tokens):
-        kz = (key, zone)
-        self._last_replenished[kz] = time.time()
-        self._counter[kz] = tokens
+        shard = self._shard(key)
+        with shard.lock:
+            shard.set_bucket((key, zone), (tokens, clock.time()))
+
+    def get_tat(self, key, zone):
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.get_bucket((key, zone), None)
+
+    def set_tat(self, key, zone, tat):
+        shard = self._shard(key)
+        with shard.lock:
+            shard.set_bucket((key, zone), tat)
+
+    def get_and_inc_quota_value(self, key, zone, quota_range, amount=1):
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.inc_quota(key, zone, quota_range, amount)
+
+    def check_and_consume(self, key, zone, limit, quota_range, cost=1,
+                          quota_cost=None, tier_limit=None,
+                          tier_quota_range=None):
+        # hold the shard's lock across the whole read-modify-write, the
+        # tier-wide bucket has the same key so is in the same shard
+        shard = self._shard(key)
+        with shard.lock:
+            return super(MemoryBackend, self).check_and_consume(
+                key, zone, limit, quota_range, cost, quota_cost, tier_limit,
+                tier_quota_range
+            )
+
+    def bucket_count(self):
+        return sum(len(shard.buckets) for shard in self._shards)
+
+    def get_usage_chunk(self, keys, zones, dates):
+        rows = []
+        for key in keys:
+            shard = self._shard(key)
+            with shard.lock:
+                rows.extend(shard.usage_rows(key, zones, dates))
+        return rows
 
-    def get_and_inc_quota_value(self, key, zone, quota_range):
-        quota_key = '{}-{}-{}'.format(key, zone, quota_range)
-        self._quota[quota_key] += 1
-        return self._quota[quota_key]
+    async def acheck_and_consume(self, key, zone, limit, quota_range,
+                                 cost=1, quota_cost=None, tier_limit=None,
+                                 tier_quota_range=None):
+        # nothing to wait on, no need for a thread
+        return self.check_and_consume(key, zone, limit, quota_range, cost,
+                                      quota_cost, tier_limit,
+                                      tier_quota_range)
 
 
 class CacheBackend(AbstractBackend):
+    """
+        stores buckets & quotas in a Django cache
+
+        with SIMPLEKEYS_CACHE_FORMAT = 'compact' buckets & sliding quota
+        rings are stored as packed structs rather than pickled tuples, and
+        with SIMPLEKEYS_CACHE_HASH_KEYS cache keys are a short digest of
+        key & zone.  Either format is read, and while
+        SIMPLEKEYS_CACHE_LEGACY_KEYS is set values still under their
+        unhashed keys are read too, so settings can be changed on a live
+        cache.
+    """
+
     def __init__(self):
+        super(CacheBackend, self).__init__()
         from django.core.cache import caches
         self.cache = caches[getattr(settings, 'SIMPLEKEYS_CACHE', 'default')]
         # 25 hour default, just longer than a day so that day limits are OK
         self.timeout = getattr(settings, 'SIMPLEKEYS_CACHE_TIMEOUT', 25*60*60)
+        self.compact = getattr(settings, 'SIMPLEKEYS_CACHE_FORMAT',
+                               'pickle') == 'compact'
+        self.hash_keys = getattr(settings, 'SIMPLEKEYS_CACHE_HASH_KEYS',
+                                 False)
+        self.legacy_keys = self.hash_keys and getattr(
+            settings, 'SIMPLEKEYS_CACHE_LEGACY_KEYS', True
+        )
+
+    def _key(self, plain_key):
+        """
+            the cache key plain_key (key~zone, key~zone~tat or
+            key~zone~quota_range) is stored under
+        """
+        if not self.hash_keys:
+            return plain_key
+        digest = hashlib.blake2b(plain_key.encode(), digest_size=12).digest()
+        return base64.urlsafe_b64encode(digest).decode()
+
+    def _read_many(self, plain_keys):
+        """
+            get_many by plain key, returns {plain key: value}
+        """
+        if not self.hash_keys:
+            return self.cache.get_many(plain_keys)
+        cache_keys = {self._key(plain_key): plain_key
+                      for plain_key in plain_keys}
+        return self._from_cache_keys(
+            cache_keys, self.cache.get_many(self._with_legacy(cache_keys))
+        )
+
+    async def _aread_many(self, plain_keys):
+        """
+            async version of _read_many
+        """
+        if not self.hash_keys:
+            return await self.cache.aget_many(plain_keys)
+        cache_keys = {self._key(plain_key): plain_key
+                      for plain_key in plain_keys}
+        return self._from_cache_keys(
+            cache_keys,
+            await self.cache.aget_many(self._with_legacy(cache_keys))
+        )
+
+    def _with_legacy(self, cache_keys):
+        if self.legacy_keys:
+            return list(cache_keys) + list(cache_keys.values())
+        return list(cache_keys)
+
+    def _from_cache_keys(self, cache_keys, values):
+        result = {}
+        for cache_key, plain_key in cache_keys.items():
+            if cache_key in values:
+                result[plain_key] = values[cache_key]
+            elif plain_key in values:
+                result[plain_key] = values[plain_key]
+        return result
+
+    def _read(self, plain_key, default=None):
+        return self._read_many([plain_key]).get(plain_key, default)
+
+    def _write_many(self, updates, timeout=None):
+        """
+            set_many by plain key, for timeout (default: self.timeout)
+        """
+        if self.hash_keys:
+            updates = {self._key(plain_key): value
+                       for plain_key, value in updates.items()}
+        self.cache.set_many(updates, timeout or self.timeout)
+
+    async def _awrite_many(self, updates, timeout=None):
+        if self.hash_keys:
+            updates = {self._key(plain_key): value
+                       for plain_key, value in updates.items()}
+        await self.cache.aset_many(updates, timeout or self.timeout)
+
+    def _timeout(self, quota_ranges):
+        """
+            timeout for writes that include quota_ranges' counters, sliding
+            quota rings must outlast their window
+        """
+        return max([self.timeout] + [quota_range.length
+                                     for quota_range in quota_ranges
+                                     if isinstance(quota_range, QuotaWindow)])
+
+    def _encode_bucket(self, bucket):
+        return BUCKET_STATE.pack(*bucket) if self.compact else bucket
+
+    def _encode_ring(self, ring):
+        if not self.compact:
+            return ring
+        return struct.pack('<q{}I'.format(len(ring) - 1), *ring)
 
     def get_tokens_and_timestamp(self, key, zone):
-        kz = '{}~{}'.format(key, zone)
-        return self.cache.get_or_set(kz, (0, None), self.timeout)
+        return decode_bucket(self._read('{}~{}'.format(key, zone)))
 
     def set_token_count(self, key, zone, tokens):
-        kz = '{}~{}'.format(key, zone)
-        self.cache.set(kz, (tokens, time.time()), self.timeout)
+        self._write_many({'{}~{}'.format(key, zone):
+                          self._encode_bucket((tokens, clock.time()))})
 
-    def get_and_inc_quota_value(self, key, zone, quota_range):
+    def get_tat(self, key, zone):
+        return self._read('{}~{}~tat'.format(key, zone))
+
+    def set_tat(self, key, zone, tat):
+        self._write_many({'{}~{}~tat'.format(key, zone): tat})
+
+    def get_and_inc_quota_value(self, key, zone, quota_range, amount=1):
         quota_key = '{}~{}~{}'.format(key, zone, quota_range)
-        self.cache.get_or_set(quota_key, 0, timeout=self.timeout)
-        return self.cache.incr(quota_key)
+        if isinstance(quota_range, QuotaWindow):
+            # the ring is read-modify-write, like the buckets
+            ring, value = window_add(decode_ring(self._read(quota_key)),
+                                     quota_range, amount)
+            if amount:
+                self._write_many({quota_key: self._encode_ring(ring)},
+                                 self._timeout([quota_range]))
+            return value
+        cache_key = self._key(quota_key)
+        if self.legacy_keys:
+            # carry on from a count still under its unhashed key
+            self.cache.get_or_set(cache_key,
+                                  lambda: self.cache.get(quota_key, 0),
+                                  timeout=self.timeout)
+        else:
+            self.cache.get_or_set(cache_key, 0, timeout=self.timeout)
+        return self.cache.incr(cache_key, amount)
 
-    def get_usage(self, keys=None, days=7):
-        today = datetime.date.today()
-        dates = [(today - datetime.timedelta(days=d)).strftime('%Y%m%d')
-                 for d in range(days)]
-        zones = Zone.objects.all().values_list('slug', flat=True)
-        if not keys:
-            keys = Key.objects.all().values_list('key', flat=True)
-        all_keys = ['{}~{}~{}'.format(key, zone, date) for (key, zone, date) in
-                    itertools.product(keys, zones, dates)]
+    def inc_quota_values(self, counts):
+        """
+            finds which counters exist with one get_many, then adds the
+            missing ones & increments each with incr, which is atomic in the
+            cache so concurrent flushes of a hot key don't lose counts
 
-        result = {k: {d: Counter() for d in dates} for k in keys}
-        for cache_key, cache_val in self.cache.get_many(all_keys).items():
-            key, zone, date = cache_key.split('~')
-            result[key][date][zone] = cache_val
+            sliding rings (and legacy keys) go through
+            get_and_inc_quota_value one by one
+        """
+        cache_keys = [
+            None if self.legacy_keys or isinstance(quota_range, QuotaWindow)
+            else self._key('{}~{}~{}'.format(key, zone, quota_range))
+            for key, zone, quota_range, _ in counts
+        ]
+        existing = set(self.cache.get_many(
+            [cache_key for cache_key in cache_keys if cache_key]
+        ))
+        totals = []
+        for cache_key, count in zip(cache_keys, counts):
+            if cache_key is not None:
+                if cache_key not in existing:
+                    self.cache.add(cache_key, 0, timeout=self.timeout)
+                    existing.add(cache_key)
+                try:
+                    totals.append(self.cache.incr(cache_key, count[3]))
+                    continue
+                except ValueError:
+                    # evicted since, start it again
+                    pass
+            totals.append(self.get_and_inc_quota_value(*count))
+        return totals
+
+    def _consume_keys(self, key, zone, limit, quota_range, tier_limit=None,
+                      tier_quota_range=None):
+        """
+            returns (bucket key, quota key, limit, quota range) for the
+            zone's bucket, and the tier-wide one if there's a tier_limit
+        """
+        buckets = [(zone, limit, quota_range)]
+        if tier_limit is not None:
+            buckets.append((TIER_ZONE, tier_limit, tier_quota_range))
+        suffix = '~tat' if self.algorithm == 'gcra' else ''
+        return [('{}~{}{}'.format(key, bucket_zone, suffix),
+                 '{}~{}~{}'.format(key, bucket_zone, bucket_range),
+                 bucket_limit, bucket_range)
+                for bucket_zone, bucket_limit, bucket_range in buckets]
+
+    def _consume(self, buckets, values, cost, quota_cost):
+        """
+            returns the result of check_and_consume, values to write back
+        """
+        if quota_cost is None:
+            quota_cost = cost
+        now = clock.time()
+        taken = []
+        for kz, _, limit, _ in buckets:
+            if self.algorithm == 'gcra':
+                bucket, tokens = gcra(values.get(kz), now, limit, cost)
+            else:
+                tokens, last_time = decode_bucket(values.get(kz))
+                tokens = refill(tokens, last_time, now, limit)
+                if tokens < cost:
+                    bucket = None
+                else:
+                    tokens -= cost
+                    bucket = self._encode_bucket((tokens, now))
+            taken.append((bucket, tokens))
+
+        if any(bucket is None for bucket, _ in taken):
+            return sum(((tokens if bucket is None else tokens + cost, None)
+                        for bucket, tokens in taken), ()), None
+
+        quota_keys = [quota_key for _, quota_key, _, _ in buckets]
+        if isinstance(buckets[0][3], QuotaWindow):
+            rings, quotas = windows_add(
+                [decode_ring(values.get(quota_key))
+                 for quota_key in quota_keys],
+                [quota_range for _, _, _, quota_range in buckets], quota_cost
+            )
+            stored = [self._encode_ring(ring) for ring in rings]
+        else:
+            quotas = stored = [values.get(quota_key, 0) + quota_cost
+                               for quota_key in quota_keys]
 
+        result = ()
+        updates = {}
+        for (kz, quota_key, _, _), (bucket, tokens), quota, value in zip(
+                buckets, taken, quotas, stored):
+            updates[kz] = bucket
+            if quota_cost:
+                updates[quota_key] = value
+            result += (tokens, quota)
+        return result, updates
+
+    def check_and_consume(self, key, zone, limit, quota_range, cost=1,
+                          quota_cost=None, tier_limit=None,
+                          tier_quota_range=None):
+        """
+            reads the bucket & quota counter (and the tier-wide ones) in one
+            get_many and writes them back in one set_many
+
+            like the bucket, the quota counter is read-modify-write here, so
+            concurrent requests may occasionally undercount the quota
+        """
+        buckets = self._consume_keys(key, zone, limit, quota_range,
+                                     tier_limit, tier_quota_range)
+        values = self._read_many([cache_key for bucket in buckets
+                                  for cache_key in bucket[:2]])
+        result, updates = self._consume(buckets, values, cost, quota_cost)
+        if updates:
+            self._write_many(updates, self._timeout(
+                [bucket[3] for bucket in buckets]
+            ))
+        return result
+
+    def check_and_consume_many(self, requests):
+        """
+            reads every bucket & quota counter in one get_many and writes
+            them back in one set_many
+        """
+        batch = []
+        for request in requests:
+            key, zone, limit, quota_range, cost, quota_cost, *tier = request
+            batch.append((self._consume_keys(key, zone, limit, quota_range,
+                                             *tier), cost, quota_cost))
+        values = self._read_many(list({cache_key for buckets, _, _ in batch
+                                       for bucket in buckets
+                                       for cache_key in bucket[:2]}))
+        results = []
+        updates = {}
+        for buckets, cost, quota_cost in batch:
+            result, update = self._consume(buckets, values, cost, quota_cost)
+            if update:
+                # later requests for the same key see this one's update
+                values.update(update)
+                updates.update(update)
+            results.append(result)
+        if updates:
+            # one set_many for the batch, all kept as long as the longest
+            self._write_many(updates, self._timeout(
+                [bucket[3] for buckets, _, _ in batch for bucket in buckets]
+            ))
+        return results
+
+    async def acheck_and_consume(self, key, zone, limit, quota_range,
+                                 cost=1, quota_cost=None, tier_limit=None,
+                                 tier_quota_range=None):
+        buckets = self._consume_keys(key, zone, limit, quota_range,
+                                     tier_limit, tier_quota_range)
+        values = await self._aread_many([cache_key for bucket in buckets
+                                         for cache_key in bucket[:2]])
+        result, updates = self._consume(buckets, values, cost, quota_cost)
+        if updates:
+            await self._awrite_many(updates, self._timeout(
+                [bucket[3] for bucket in buckets]
+            ))
         return result
+
+    def get_usage_chunk(self, keys, zones, dates):
+        kzd = {'{}~{}~{}'.format(*item): item
+               for item in itertools.product(keys, zones, dates)}
+        values = self._read_many(list(kzd))
+        return [item + (values[cache_key],)
+                for cache_key, item in kzd.items() if cache_key in values]
+
+
+# counts quota_cost against the quota KEYS[2i] of each of n buckets,
+# returning their values
+# ARGV[6i + 1] to ARGV[6i + 4] are the slot, number of sub-windows, limit
+# (-1 for none) & length in seconds of a sliding quota, whose ring is a hash
+# of slot -> count kept for at least that length, or 0, 0, -1, 0 for a
+# counter.  Like windows_add, quota_cost is only counted
+# in the sliding quotas if it fits within all of them, and their values are
+# the total followed by the ring as window_add has it (latest slot, then a
+# count per sub-window).
+REDIS_QUOTA_FUNCTION = """
+local function window_total(quota_key, slot, slots)
+    local ring = redis.call('HGETALL', quota_key)
+    local latest = slot
+    for j = 1, #ring, 2 do
+        latest = math.max(latest, tonumber(ring[j]))
+    end
+    local total = 0
+    local value = {0, latest}
+    for k = 1, slots do
+        value[k + 2] = 0
+    end
+    for j = 1, #ring, 2 do
+        local ring_slot = tonumber(ring[j])
+        if ring_slot > latest - slots then
+            total = total + tonumber(ring[j + 1])
+            value[ring_slot % slots + 3] = tonumber(ring[j + 1])
+        else
+            redis.call('HDEL', quota_key, ring[j])
+        end
+    end
+    return total, latest, value
+end
+
+local function count_quotas(n, timeout, quota_cost)
+    local quotas = {}
+    local latest = {}
+    local rings = {}
+    local fits = true
+    for i = 1, n do
+        local slots = tonumber(ARGV[6 * i + 2])
+        local limit = tonumber(ARGV[6 * i + 3])
+        if slots > 0 then
+            quotas[i], latest[i], rings[i] = window_total(
+                KEYS[2 * i], tonumber(ARGV[6 * i + 1]), slots
+            )
+            if limit >= 0 and quotas[i] + quota_cost > limit then
+                fits = false
+            end
+        end
+    end
+    for i = 1, n do
+        local quota_key = KEYS[2 * i]
+        local slot = tonumber(ARGV[6 * i + 1])
+        local slots = tonumber(ARGV[6 * i + 2])
+        if slots == 0 then
+            if quota_cost == 0 then
+                quotas[i] = tonumber(redis.call('GET', quota_key)) or 0
+            else
+                quotas[i] = redis.call('INCRBY', quota_key, quota_cost)
+                if quotas[i] == quota_cost then
+                    redis.call('EXPIRE', quota_key, timeout)
+                end
+            end
+        elseif not fits then
+            quotas[i] = quotas[i] + quota_cost
+        elseif quota_cost > 0 and slot > latest[i] - slots then
+            redis.call('HINCRBY', quota_key, slot, quota_cost)
+            redis.call('EXPIRE', quota_key,
+                       math.max(timeout, tonumber(ARGV[6 * i + 4])))
+            quotas[i] = quotas[i] + quota_cost
+            rings[i][slot % slots + 3] = rings[i][slot % slots + 3] +
+                quota_cost
+        end
+        if slots > 0 then
+            rings[i][1] = quotas[i]
+            quotas[i] = rings[i]
+        end
+    end
+    return quotas
+end
+"""
+
+# count ARGV[3] against the quota KEYS[2] alone, ARGV as below
+REDIS_COUNT_SCRIPT = """
+return count_quotas(1, tonumber(ARGV[1]), tonumber(ARGV[3]))[1]
+"""
+
+# refill each bucket KEYS[2i - 1] and, only if every bucket has cost
+# tokens, consume them & count each quota KEYS[2i] (the zone's bucket
+# and, for tiers with a tier-wide limit, the tier's)
+# ARGV: timeout, cost, quota_cost, now, then requests_per_second,
+#       burst_size and the quota's slot, sub-windows, limit & length for
+#       each bucket
+#
+# unless now is given (by a virtual clock) TIME is read on the server so
+# that buckets aren't skewed by differing clocks across application servers
+REDIS_CONSUME_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local timeout = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local quota_cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+if now == 0 then
+    local t = redis.call('TIME')
+    now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+end
+
+local tokens = {}
+local allowed = true
+for i = 1, #KEYS / 2 do
+    local rate = tonumber(ARGV[6 * i - 1])
+    local burst = tonumber(ARGV[6 * i])
+    local bucket = redis.call('HMGET', KEYS[2 * i - 1], 'tokens', 'ts')
+    tokens[i] = burst
+    if bucket[2] then
+        tokens[i] = math.min(
+            tonumber(bucket[1]) + rate * (now - tonumber(bucket[2])), burst
+        )
+    end
+    if tokens[i] < cost then
+        allowed = false
+    end
+end
+
+local result = {}
+if not allowed then
+    for i = 1, #KEYS / 2 do
+        result[2 * i - 1] = tostring(tokens[i])
+        result[2 * i] = false
+    end
+    return result
+end
+for i = 1, #KEYS / 2 do
+    tokens[i] = tokens[i] - cost
+    redis.call('HSET', KEYS[2 * i - 1], 'tokens', tostring(tokens[i]),
+               'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[2 * i - 1], timeout)
+end
+local quotas = count_quotas(#KEYS / 2, timeout, quota_cost)
+for i = 1, #KEYS / 2 do
+    result[2 * i - 1] = tostring(tokens[i])
+    result[2 * i] = quotas[i]
+end
+return result
+"""
+
+# gcra version of the above, KEYS[2i - 1] hold theoretical arrival times
+# ARGV: timeout, cost, quota_cost, now (microseconds), then emission
+#       interval (microseconds), burst_size and the quota's slot,
+#       sub-windows, limit & length for each bucket
+REDIS_GCRA_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local timeout = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local quota_cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+if now == 0 then
+    local t = redis.call('TIME')
+    now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+end
+
+local tats = {}
+local tokens = {}
+local allowed = true
+for i = 1, #KEYS / 2 do
+    local interval = tonumber(ARGV[6 * i - 1])
+    local burst = tonumber(ARGV[6 * i])
+    local tat = tonumber(redis.call('GET', KEYS[2 * i - 1])) or now
+    if tat < now then
+        tat = now
+    end
+    tats[i] = tat + interval * cost
+    tokens[i] = burst - (tat - now) / interval
+    if tokens[i] < cost then
+        allowed = false
+    end
+end
+
+local result = {}
+if not allowed then
+    for i = 1, #KEYS / 2 do
+        result[2 * i - 1] = tostring(tokens[i])
+        result[2 * i] = false
+    end
+    return result
+end
+for i = 1, #KEYS / 2 do
+    -- once tat has passed the bucket is full, which is the same as no tat
+    redis.call('SET', KEYS[2 * i - 1], tats[i], 'EX',
+               math.ceil((tats[i] - now) / 1000000) + 1)
+end
+local quotas = count_quotas(#KEYS / 2, timeout, quota_cost)
+for i = 1, #KEYS / 2 do
+    result[2 * i - 1] = tostring(tokens[i] - cost)
+    result[2 * i] = quotas[i]
+end
+return result
+"""
+
+
+class RedisBackend(AbstractBackend):
+    """
+        stores buckets & quotas directly in Redis, requires redis-py
+
+        check_and_consume runs as a single server-side script, making it
+        atomic and a single round trip
+    """
+
+    def __init__(self, client=None, async_client=None):
+        super(RedisBackend, self).__init__()
+        self.url = getattr(settings, 'SIMPLEKEYS_REDIS_URL',
+                           'redis://localhost:6379/0')
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(self.url)
+        self.redis = client
+        self._async_redis = async_client
+        self.prefix = getattr(settings, 'SIMPLEKEYS_REDIS_PREFIX',
+                              'simplekeys:')
+        self.timeout = getattr(settings, 'SIMPLEKEYS_CACHE_TIMEOUT', 25*60*60)
+        self._script = REDIS_QUOTA_FUNCTION + (
+            REDIS_GCRA_SCRIPT if self.algorithm == 'gcra'
+            else REDIS_CONSUME_SCRIPT
+        )
+        self._consume = self.redis.register_script(self._script)
+        self._count = self.redis.register_script(REDIS_QUOTA_FUNCTION +
+                                                 REDIS_COUNT_SCRIPT)
+        self._aconsume = None
+
+    @property
+    def async_redis(self):
+        """
+            redis.asyncio client, created on first use
+        """
+        if self._async_redis is None:
+            import redis.asyncio
+            self._async_redis = redis.asyncio.Redis.from_url(self.url)
+        return self._async_redis
+
+    def _bucket_key(self, key, zone):
+        # hash tag keeps all of a key's buckets & quotas in the same cluster
+        # slot, so the zone & tier-wide ones can be updated by one script
+        return '{}{{{}}}~{}'.format(self.prefix, key, zone)
+
+    def _quota_key(self, key, zone, quota_range):
+        return '{}{{{}}}~{}~{}'.format(self.prefix, key, zone, quota_range)
+
+    def get_tokens_and_timestamp(self, key, zone):
+        tokens, timestamp = self.redis.hmget(self._bucket_key(key, zone),
+                                             'tokens', 'ts')
+        if timestamp is None:
+            return 0, None
+        return float(tokens), float(timestamp)
+
+    def set_token_count(self, key, zone, tokens):
+        bucket_key = self._bucket_key(key, zone)
+        pipe = self.redis.pipeline()
+        pipe.hset(bucket_key, mapping={'tokens': tokens, 'ts': clock.time()})
+        pipe.expire(bucket_key, self.timeout)
+        pipe.execute()
+
+    def get_tat(self, key, zone):
+        tat = self.redis.get(self._bucket_key(key, zone) + '~tat')
+        return None if tat is None else int(tat)
+
+    def set_tat(self, key, zone, tat):
+        self.redis.set(self._bucket_key(key, zone) + '~tat', tat,
+                       ex=max(int(tat / 1000000 - clock.time()) + 2, 1))
+
+    def get_and_inc_quota_value(self, key, zone, quota_range, amount=1):
+        quota_key = self._quota_key(key, zone, quota_range)
+        if isinstance(quota_range, QuotaWindow):
+            # the ring is checked against its limit, so needs a script
+            return self._quota(self._count(
+                keys=[self._bucket_key(key, zone), quota_key],
+                args=[self.timeout, 0, amount, 0, 0, 0] +
+                self._window_args(quota_range)
+            ))
+        value = self.redis.incrby(quota_key, amount)
+        if value == amount:
+            self.redis.expire(quota_key, self.timeout)
+        return value
+
+    def inc_quota_values(self, counts):
+        """
+            counts every value in one pipelined round trip
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for key, zone, quota_range, amount in counts:
+            self._count(keys=[self._bucket_key(key, zone),
+                              self._quota_key(key, zone, quota_range)],
+                        args=[self.timeout, 0, amount, 0, 0, 0] +
+                        self._window_args(quota_range),
+                        client=pipe)
+        return [self._quota(value) for value in pipe.execute()]
+
+    @staticmethod
+    def _window_args(quota_range):
+        if not isinstance(quota_range, QuotaWindow):
+            return [0, 0, -1, 0]
+        limit = quota_range.limit
+        return [quota_range.slot, quota_range.slots,
+                -1 if limit is None else limit, quota_range.length]
+
+    def _consume_args(self, key, zone, limit, quota_range, cost, quota_cost,
+                      tier_limit=None, tier_quota_range=None):
+        if quota_cost is None:
+            quota_cost = cost
+        buckets = [(zone, limit, quota_range)]
+        if tier_limit is not None:
+            buckets.append((TIER_ZONE, tier_limit, tier_quota_range))
+        keys = []
+        now = 0
+        if clock.virtual is not None:
+            now = clock.time()
+            if self.algorithm == 'gcra':
+                now = int(now * 1000000)
+        args = [self.timeout, cost, quota_cost, now]
+        for bucket_zone, bucket_limit, bucket_range in buckets:
+            bucket_key = self._bucket_key(key, bucket_zone)
+            if self.algorithm == 'gcra':
+                bucket_key += '~tat'
+                rate = gcra_interval(bucket_limit)
+            else:
+                rate = bucket_limit.requests_per_second
+            keys += [bucket_key,
+                     self._quota_key(key, bucket_zone, bucket_range)]
+            args += [rate, bucket_limit.burst_size]
+            args += self._window_args(bucket_range)
+        return {'keys': keys, 'args': args}
+
+    @staticmethod
+    def _quota(value):
+        # a sliding quota's total comes back followed by its ring
+        if isinstance(value, list):
+            return WindowTotal(value[0], tuple(value[1:]))
+        return value
+
+    @classmethod
+    def _result(cls, values):
+        # tokens come back as strings to keep their fractional part
+        return tuple(float(value) if i % 2 == 0 else cls._quota(value)
+                     for i, value in enumerate(values))
+
+    def check_and_consume(self, key, zone, limit, quota_range, cost=1,
+                          quota_cost=None, tier_limit=None,
+                          tier_quota_range=None):
+        return self._result(self._consume(
+            **self._consume_args(key, zone, limit, quota_range, cost,
+                                 quota_cost, tier_limit, tier_quota_range)
+        ))
+
+    def check_and_consume_many(self, requests):
+        """
+            runs the script for every request in one pipelined round trip,
+            each is still atomic on its own
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for request in requests:
+            self._consume(client=pipe, **self._consume_args(*request))
+        return [self._result(values) for values in pipe.execute()]
+
+    async def acheck_and_consume(self, key, zone, limit, quota_range,
+                                 cost=1, quota_cost=None, tier_limit=None,
+                                 tier_quota_range=None):
+        if self._aconsume is None:
+            self._aconsume = self.async_redis.register_script(self._script)
+        return self._result(await self._aconsume(
+            **self._consume_args(key, zone, limit, quota_range, cost,
+                                 quota_cost, tier_limit, tier_quota_range)
+        ))
+
+    def get_usage_chunk(self, keys, zones, dates):
+        """
+            one MGET per key, all pipelined in a single round trip: a key's
+            quotas share a hash tag, so each MGET stays in one cluster slot
+        """
+        if not keys or not zones or not dates:
+            return []
+        kzd = [list(itertools.product([key], zones, dates)) for key in keys]
+        pipe = self.redis.pipeline(transaction=False)
+        for items in kzd:
+            pipe.mget([self._quota_key(*item) for item in items])
+        return [item + (int(value),)
+                for items, values in zip(kzd, pipe.execute())
+                for item, value in zip(items, values) if value is not None]
+
+
+class SharedMemoryBackend(AbstractBackend):
+    """
+        keeps buckets & quotas in a memory-mapped file, shared by every
+        process on the host that uses the same SIMPLEKEYS_SHARED_MEMORY_PATH
+
+        the file is a fixed-size open-addressing hash table of one slot per
+        key & zone, split into blocks of BLOCK_SLOTS slots.  A key & zone
+        always probes within a single block, and each block is guarded by a
+        thread lock & an fcntl record lock so processes & threads can
+        update it safely.  When a block is full the least recently used
+        slot in it is reused.
+
+        only the current quota period is stored for each key & zone, so
+        get_usage isn't available, and slots have no room for sliding quota
+        windows.  Requires a POSIX system.
+    """
+
+    MAGIC = b'SIMPLEKEYS-SHM-1'
+    HEADER = struct.Struct('<16sQ')
+    HEADER_SIZE = 64
+    # fingerprint, tokens, timestamp, tat, quota_range, quota_value,
+    # last_used
+    SLOT = struct.Struct('<Qddqqqd8x')
+    BLOCK_SLOTS = 64
+
+    def __init__(self, path=None, slots=None):
+        import fcntl
+        import mmap
+        super(SharedMemoryBackend, self).__init__()
+        if self.quota_window != 'fixed':
+            raise ImproperlyConfigured(
+                'SharedMemoryBackend only supports fixed quota windows'
+            )
+        self._fcntl = fcntl
+        if path is None:
+            path = getattr(settings, 'SIMPLEKEYS_SHARED_MEMORY_PATH',
+                           '/dev/shm/simplekeys'
+                           if os.path.isdir('/dev/shm') else
+                           os.path.join(tempfile.gettempdir(), 'simplekeys'))
+        if slots is None:
+            slots = getattr(settings, 'SIMPLEKEYS_SHARED_MEMORY_SLOTS',
+                            64*1024)
+        self.path = path
+        self.num_blocks = max(-(-slots // self.BLOCK_SLOTS), 1)
+        self.num_slots = self.num_blocks * self.BLOCK_SLOTS
+        self.size = self.HEADER_SIZE + self.num_slots * self.SLOT.size
+
+        # keep this file open for the life of the backend, closing any
+        # descriptor for it would drop this process's record locks
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.HEADER_SIZE, 0)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, self.HEADER.pack(self.MAGIC,
+                                                     self.num_slots), 0)
+            magic, num_slots = self.HEADER.unpack(
+                os.pread(self._fd, self.HEADER.size, 0)
+            )
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.HEADER_SIZE, 0)
+        if magic != self.MAGIC or num_slots != self.num_slots:
+            raise ImproperlyConfigured(
+                '{} is not a simplekeys table with {} slots'.format(
+                    path, self.num_slots)
+            )
+
+        self._mm = mmap.mmap(self._fd, self.size)
+        self._locks = [threading.Lock() for _ in range(self.num_blocks)]
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+    def reset(self):
+        for block in range(self.num_blocks):
+            with self._locked(block):
+                start = self._slot_offset(block * self.BLOCK_SLOTS)
+                length = self.BLOCK_SLOTS * self.SLOT.size
+                self._mm[start:start + length] = bytes(length)
+
+    def _slot_offset(self, index):
+        return self.HEADER_SIZE + index * self.SLOT.size
+
+    @contextlib.contextmanager
+    def _locked(self, block):
+        start = self._slot_offset(block * self.BLOCK_SLOTS)
+        length = self.BLOCK_SLOTS * self.SLOT.size
+        with self._locks[block]:
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, length,
+                                  start)
+
+    def _fingerprint(self, key, zone):
+        digest = hashlib.blake2b('{}~{}'.format(key, zone).encode(),
+                                 digest_size=8).digest()
+        # 0 marks an empty slot
+        return int.from_bytes(digest, 'little') or 1
+
+    def _block(self, fingerprint):
+        return fingerprint % self.num_blocks
+
+    def _find(self, fingerprint):
+        """
+            returns offset, slot values for fingerprint, claiming an empty or
+            least recently used slot if it isn't present
+
+            must be called with the fingerprint's block locked
+        """
+        block = self._block(fingerprint)
+        first = block * self.BLOCK_SLOTS
+        start = (fingerprint // self.num_blocks) % self.BLOCK_SLOTS
+        oldest_offset = oldest_used = None
+        for i in range(self.BLOCK_SLOTS):
+            offset = self._slot_offset(first +
+                                       (start + i) % self.BLOCK_SLOTS)
+            slot = self.SLOT.unpack_from(self._mm, offset)
+            if slot[0] == fingerprint:
+                return offset, slot
+            if slot[0] == 0:
+                return offset, (fingerprint, 0, 0, 0, 0, 0, 0)
+            if oldest_used is None or slot[6] < oldest_used:
+                oldest_offset, oldest_used = offset, slot[6]
+        return oldest_offset, (fingerprint, 0, 0, 0, 0, 0, 0)
+
+    def _update(self, key, zone, func):
+        """
+            calls func(slot) with the key & zone's slot values locked,
+            writing back the slot it returns (if any)
+
+            returns whatever func returned as its second value
+        """
+        fingerprint = self._fingerprint(key, zone)
+        with self._locked(self._block(fingerprint)):
+            offset, slot = self._find(fingerprint)
+            slot, result = func(list(slot))
+            if slot is not None:
+                slot[6] = clock.time()
+                self.SLOT.pack_into(self._mm, offset, *slot)
+            return result
+
+    def _update_all(self, kzs, func):
+        """
+            like _update, but for several keys & zones locked together,
+            func is passed & returns a list of slots
+
+            blocks are locked in order so concurrent callers can't deadlock
+        """
+        fingerprints = [self._fingerprint(key, zone) for key, zone in kzs]
+        with contextlib.ExitStack() as stack:
+            for block in sorted({self._block(fp) for fp in fingerprints}):
+                stack.enter_context(self._locked(block))
+            found = []
+            for fingerprint in fingerprints:
+                offset, slot = self._find(fingerprint)
+                # claim the slot now as most recently used, so another
+                # fingerprint in the same block can't be given it too
+                slot = list(slot)
+                slot[6] = clock.time()
+                self.SLOT.pack_into(self._mm, offset, *slot)
+                found.append((offset, slot))
+            slots, result = func([slot for _, slot in found])
+            if slots is not None:
+                for (offset, _), slot in zip(found, slots):
+                    self.SLOT.pack_into(self._mm, offset, *slot)
+            return result
+
+    @staticmethod
+    def _quota_range_id(quota_range):
+        if quota_range.isdigit():
+            return int(quota_range)
+        return zlib.crc32(quota_range.encode())
+
+    def _inc_quota(self, slot, quota_range, amount):
+        quota_range = self._quota_range_id(quota_range)
+        if slot[4] != quota_range:
+            # only the current period is kept
+            slot[4], slot[5] = quota_range, 0
+        slot[5] += amount
+        return slot[5]
+
+    def get_tokens_and_timestamp(self, key, zone):
+        return self._update(key, zone, lambda slot: (
+            None, (slot[1], slot[2]) if slot[2] else (0, None)
+        ))
+
+    def set_token_count(self, key, zone, tokens):
+        def func(slot):
+            slot[1], slot[2] = tokens, clock.time()
+            return slot, None
+        self._update(key, zone, func)
+
+    def get_tat(self, key, zone):
+        return self._update(key, zone, lambda slot: (None, slot[3] or None))
+
+    def set_tat(self, key, zone, tat):
+        def func(slot):
+            slot[3] = tat
+            return slot, None
+        self._update(key, zone, func)
+
+    def get_and_inc_quota_value(self, key, zone, quota_range, amount=1):
+        def func(slot):
+            return slot, self._inc_quota(slot, quota_range, amount)
+        return self._update(key, zone, func)
+
+    def _take(self, slot, limit, now, cost):
+        """
+            try to take cost tokens from slot's bucket, updating it in place
+
+            returns taken, tokens like the result of check_and_consume
+        """
+        if self.algorithm == 'gcra':
+            tat, tokens = gcra(slot[3] or None, now, limit, cost)
+            if tat is None:
+                return False, tokens
+            slot[3] = tat
+            return True, tokens
+        tokens = refill(slot[1], slot[2] or None, now, limit)
+        if tokens < cost:
+            return False, tokens
+        tokens -= cost
+        slot[1], slot[2] = tokens, now
+        return True, tokens
+
+    def check_and_consume(self, key, zone, limit, quota_range, cost=1,
+                          quota_cost=None, tier_limit=None,
+                          tier_quota_range=None):
+        if quota_cost is None:
+            quota_cost = cost
+
+        if tier_limit is None:
+            def func(slot):
+                taken, tokens = self._take(slot, limit, clock.time(), cost)
+                if not taken:
+                    return None, (tokens, None)
+                return slot, (tokens,
+                              self._inc_quota(slot, quota_range, quota_cost))
+            return self._update(key, zone, func)
+
+        def func_all(slots):
+            now = clock.time()
+            taken = [self._take(slot, bucket_limit, now, cost)
+                     for slot, bucket_limit in zip(slots, (limit, tier_limit))]
+            if not all(ok for ok, _ in taken):
+                return None, sum(((tokens + cost if ok else tokens, None)
+                                  for ok, tokens in taken), ())
+            return slots, (
+                taken[0][1], self._inc_quota(slots[0], quota_range,
+                                             quota_cost),
+                taken[1][1], self._inc_quota(slots[1], tier_quota_range,
+                                             quota_cost),
+            )
+        return self._update_all([(key, zone), (key, TIER_ZONE)], func_all)
+
+    async def acheck_and_consume(self, key, zone, limit, quota_range,
+                                 cost=1, quota_cost=None, tier_limit=None,
+                                 tier_quota_range=None):
+        # no I/O to wait on, the locks are only ever held briefly
+        return self.check_and_consume(key, zone, limit, quota_range, cost,
+                                      quota_cost, tier_limit,
+                                      tier_quota_range)
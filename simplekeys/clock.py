@@ -0,0 +1,60 @@
+"""
+    the clock buckets, quotas & leases are measured against
+
+    normally the system clock, but a VirtualClock can be swapped in with
+    use_clock, e.g. to replay recorded traffic faster than real time.  Call
+    clock.time() & clock.utcnow() rather than importing them, they are
+    replaced while a virtual clock is in use.
+"""
+import time as _time
+import datetime
+import contextlib
+
+
+class VirtualClock(object):
+    """
+        a clock that only moves when it is told to
+    """
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def utcnow(self):
+        return datetime.datetime.fromtimestamp(
+            self.now, datetime.timezone.utc
+        ).replace(tzinfo=None)
+
+    def set(self, now):
+        self.now = now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def _utcnow():
+    return datetime.datetime.utcnow()
+
+
+# the VirtualClock in use, or None for the system clock
+virtual = None
+time = _time.time
+utcnow = _utcnow
+
+
+@contextlib.contextmanager
+def use_clock(clock):
+    """
+        read clock instead of the system clock until the block exits
+
+        this applies to the whole process, not just the current thread
+    """
+    global virtual, time, utcnow
+    previous = virtual, time, utcnow
+    virtual, time, utcnow = clock, clock.time, clock.utcnow
+    try:
+        yield clock
+    finally:
+        virtual, time, utcnow = previous
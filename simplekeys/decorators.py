@@ -1,17 +1,36 @@
+import asyncio
 from django.conf import settings
 from functools import wraps
-from .verifier import verify_request
+from .verifier import verify_request, averify_request, add_rate_limit_headers
 
 
-def key_required(zone=None):
+def key_required(zone=None, cost=1):
     if not zone:
         zone = getattr(settings, 'SIMPLEKEYS_DEFAULT_ZONE', 'default')
 
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def newasyncfunc(request, *args, **kwargs):
+                resp = await averify_request(request, zone, cost)
+                if resp:
+                    return resp
+                return add_rate_limit_headers(
+                    await func(request, *args, **kwargs),
+                    getattr(request, 'simplekeys_result', None)
+                )
+
+            return newasyncfunc
+
         @wraps(func)
         def newfunc(request, *args, **kwargs):
-            resp = verify_request(request, zone)
-            return resp or func(request, *args, **kwargs)
+            resp = verify_request(request, zone, cost)
+            if resp:
+                return resp
+            return add_rate_limit_headers(
+                func(request, *args, **kwargs),
+                getattr(request, 'simplekeys_result', None)
+            )
 
         return newfunc
 
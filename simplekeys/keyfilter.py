@@ -0,0 +1,247 @@
+import math
+import time
+import hashlib
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+
+from .models import Key
+
+
+class BloomFilter(object):
+    """
+        fixed-size Bloom filter over strings
+
+        membership tests can return false positives at roughly error_rate
+        once capacity items are added, but never false negatives
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.num_bits = max(int(-capacity * math.log(error_rate) /
+                                (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity *
+                                        math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class KeyFilter(object):
+    """
+        in-memory filter of active keys, used by the verifier to reject
+        unknown keys without a database query
+
+        built from the Key table on first use, active keys saved afterwards
+        are added as they are saved.  Bloom filters can't remove items, so
+        the filter is rebuilt every SIMPLEKEYS_KEY_FILTER_REBUILD seconds to
+        drop deleted & suspended keys.
+
+        keys activated in other processes bump a generation in the
+        SIMPLEKEYS_KEY_FILTER_CACHE cache, checked every
+        SIMPLEKEYS_KEY_FILTER_CHECK_INTERVAL seconds.  Once it has moved the
+        filter is rebuilt, and until then its negatives aren't trusted.
+    """
+
+    GENERATION = 'simplekeys:keyfilter:generation'
+
+    def __init__(self, enabled=None, error_rate=None, rebuild_interval=None,
+                 cache_alias=None, check_interval=None):
+        if enabled is None:
+            enabled = getattr(settings, 'SIMPLEKEYS_KEY_FILTER', False)
+        if error_rate is None:
+            error_rate = getattr(settings, 'SIMPLEKEYS_KEY_FILTER_ERROR_RATE',
+                                 0.01)
+        if rebuild_interval is None:
+            rebuild_interval = getattr(settings,
+                                       'SIMPLEKEYS_KEY_FILTER_REBUILD',
+                                       60*60)
+        if cache_alias is None:
+            cache_alias = getattr(settings, 'SIMPLEKEYS_KEY_FILTER_CACHE',
+                                  getattr(settings, 'SIMPLEKEYS_CACHE',
+                                          'default'))
+        if check_interval is None:
+            check_interval = getattr(settings,
+                                     'SIMPLEKEYS_KEY_FILTER_CHECK_INTERVAL', 1)
+        self.enabled = enabled
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.cache_alias = cache_alias
+        self.check_interval = check_interval
+        self._cache = None
+        # generation the filter was built at & the latest one seen
+        self._built_generation = None
+        self._generation = None
+        self._next_check = 0
+        self._bloom = None
+        self._expires = 0
+        self._pending = None
+        self._build_lock = threading.Lock()
+        self._add_lock = threading.Lock()
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from django.core.cache import caches
+            self._cache = caches[self.cache_alias]
+        return self._cache
+
+    def _read_generation(self):
+        generation = self.cache.get(self.GENERATION)
+        if generation is None:
+            # start from the time rather than 0, so an evicted counter never
+            # repeats a value a filter was built at
+            self.cache.add(self.GENERATION, int(time.time() * 1000), None)
+            generation = self.cache.get(self.GENERATION)
+        return generation
+
+    def _stale(self):
+        """
+            True if a key may have been activated since the filter was built
+        """
+        now = time.time()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._generation = self._read_generation()
+        return self._generation != self._built_generation
+
+    def key_activated(self):
+        """
+            bump the generation, so other processes rebuild their filters to
+            pick up a key activated (and added) here
+        """
+        try:
+            generation = self.cache.incr(self.GENERATION)
+        except ValueError:
+            generation = self._read_generation()
+        with self._add_lock:
+            if self._built_generation == generation - 1:
+                # nothing else changed since this filter was built
+                self._built_generation = self._generation = generation
+
+    def rebuild(self):
+        """
+            (re)build the filter from the active keys in the database
+        """
+        # read before the query, keys activated during it bump it again
+        generation = self._read_generation()
+        with self._add_lock:
+            # keys saved while we're querying are collected here
+            self._pending = []
+        try:
+            keys = Key.objects.filter(status='a').values_list('key',
+                                                              flat=True)
+            count = keys.count()
+            # leave room for keys added between rebuilds
+            bloom = BloomFilter(max(count * 2, 1024), self.error_rate)
+            for key in keys.iterator():
+                bloom.add(key)
+        except BaseException:
+            with self._add_lock:
+                self._pending = None
+            raise
+        # swap in the new filter together with draining the pending keys, so
+        # a key saved in between can't go into the discarded filter
+        with self._add_lock:
+            for key in self._pending:
+                bloom.add(key)
+            self._pending = None
+            self._bloom = bloom
+            self._built_generation = self._generation = generation
+        self._expires = time.time() + self.rebuild_interval
+
+    def add(self, key):
+        # new Key instances hold the UUID their key defaults to
+        key = str(key)
+        with self._add_lock:
+            if self._pending is not None:
+                self._pending.append(key)
+            bloom = self._bloom
+            if bloom is not None:
+                bloom.add(key)
+        if bloom is not None and bloom.count > bloom.capacity:
+            # false positive rate is degrading, rebuild at next check
+            self._expires = 0
+
+    def might_contain(self, key):
+        """
+            False if key is definitely not an active key, True otherwise
+        """
+        if not self.enabled:
+            return True
+        if not key:
+            return False
+        if self._needs_rebuild():
+            # first build blocks, later rebuilds happen in whichever thread
+            # gets the lock while other threads use the previous filter
+            if self._build_lock.acquire(blocking=self._bloom is None):
+                try:
+                    if self._needs_rebuild():
+                        self.rebuild()
+                finally:
+                    self._build_lock.release()
+        if key in self._bloom:
+            return True
+        # a key activated elsewhere may not be in a filter awaiting rebuild
+        return self._stale()
+
+    def _needs_rebuild(self):
+        return (self._bloom is None or time.time() > self._expires or
+                self._stale())
+
+    async def amight_contain(self, key):
+        """
+            async version of might_contain, (re)builds happen in a thread
+        """
+        if self.enabled and self._needs_rebuild():
+            return await sync_to_async(self.might_contain)(key)
+        return self.might_contain(key)
+
+
+key_filter = KeyFilter()
+
+
+def _key_loaded(sender, instance, **kwargs):
+    # the key & status as loaded, so a save can tell if it activated the key
+    # (deferred fields read as None, so saving counts as activating)
+    instance._key_filter_state = (instance.__dict__.get('key'),
+                                  instance.__dict__.get('status'))
+
+
+def _key_saved(sender, instance, created, **kwargs):
+    state = (instance.key, instance.status)
+    activated = created or getattr(instance, '_key_filter_state',
+                                   None) != state
+    instance._key_filter_state = state
+    if instance.status == 'a':
+        key_filter.add(instance.key)
+        if key_filter.enabled and activated:
+            # other processes can only find the key once it's committed,
+            # saves that leave an active key as it was don't make them
+            # rebuild their filters
+            transaction.on_commit(key_filter.key_activated)
+
+
+post_init.connect(_key_loaded, sender=Key,
+                  dispatch_uid='simplekeys_keyfilter_loaded')
+post_save.connect(_key_saved, sender=Key, dispatch_uid='simplekeys_keyfilter')
@@ -0,0 +1,68 @@
+import threading
+from django.conf import settings
+
+from . import clock
+
+
+class LeaseTable(object):
+    """
+        process-local batches of tokens & quota units taken from the backend
+
+        when a Limit has a lease_size above 1 the verifier takes lease_size
+        tokens (and quota units) from the backend in one call and spends
+        them from here, only returning to the backend once the lease is
+        spent, expires (after SIMPLEKEYS_LEASE_TIMEOUT seconds) or the quota
+        period changes
+    """
+
+    def __init__(self, timeout=None):
+        if timeout is None:
+            timeout = getattr(settings, 'SIMPLEKEYS_LEASE_TIMEOUT', 1)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # (key, zone) -> [quota_range, expires, tokens left, next quota value]
+        self._leases = {}
+
+    def clear(self):
+        with self._lock:
+            self._leases.clear()
+
+    def spend(self, key, zone, quota_range, cost=1):
+        """
+            take cost tokens from the lease for key & zone
+
+            returns tokens, quota_value like check_and_consume does, or None
+            if there isn't a current lease with enough tokens
+        """
+        with self._lock:
+            lease = self._leases.get((key, zone))
+            if (lease is None or lease[0] != quota_range or
+                    lease[1] < clock.time() or lease[2] < cost):
+                return None
+            lease[2] -= cost
+            lease[3] += cost
+            return lease[2], lease[3] - 1
+
+    def grant(self, key, zone, quota_range, size, tokens, quota_value,
+              cost=1):
+        """
+            record a lease of size tokens that was just taken from the
+            backend, cost of which are spent by the current request
+
+            tokens & quota_value are as returned by the backend, returns
+            tokens, quota_value for the current request
+        """
+        now = clock.time()
+        first_quota_value = quota_value - size + cost
+        with self._lock:
+            if len(self._leases) > 10000:
+                # don't let expired leases for idle keys pile up
+                for kz in [kz for kz, lease in self._leases.items()
+                           if lease[1] < now]:
+                    del self._leases[kz]
+            self._leases[(key, zone)] = [quota_range, now + self.timeout,
+                                         size - cost, first_quota_value + 1]
+        return tokens + size - cost, first_quota_value
+
+
+leases = LeaseTable()
@@ -0,0 +1,347 @@
+import time
+import threading
+from collections import OrderedDict
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+
+from .models import Tier, Zone, Limit, Key
+
+
+class LimitCache(object):
+    """
+        bounded process-local cache of (key, zone) -> Limit
+
+        entries expire after SIMPLEKEYS_LIMIT_CACHE_TIMEOUT seconds, and once
+        SIMPLEKEYS_LIMIT_CACHE_SIZE entries are held the least recently used
+        entry is evicted.  A size of 0 disables the cache entirely, which is
+        the default unless there's a shared cache.
+
+        saving or deleting a Key, Tier, Limit or Zone invalidates affected
+        entries in this process, other processes will pick the change up
+        once their entries expire.  With a shared cache, changes bump its
+        generation and every process clears its entries within
+        SIMPLEKEYS_LIMIT_CACHE_CHECK_INTERVAL seconds of seeing that.
+    """
+
+    def __init__(self, size=None, timeout=None, shared=None,
+                 check_interval=None):
+        if size is None:
+            # without a shared cache other processes' changes (e.g. a
+            # suspended key) would go unnoticed until entries expire
+            default = 1000 if shared is not None and shared.enabled else 0
+            size = getattr(settings, 'SIMPLEKEYS_LIMIT_CACHE_SIZE', default)
+        if timeout is None:
+            timeout = getattr(settings, 'SIMPLEKEYS_LIMIT_CACHE_TIMEOUT', 60)
+        if check_interval is None:
+            check_interval = getattr(
+                settings, 'SIMPLEKEYS_LIMIT_CACHE_CHECK_INTERVAL', 1
+            )
+        self.size = size
+        self.timeout = timeout
+        self.shared = shared
+        self.check_interval = check_interval
+        self._generation = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # (key, zone) -> (expires, key_id, limit)
+            self._entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key, zone):
+        """
+            returns cached Limit for key & zone, or None on a miss
+        """
+        kz = (key, zone)
+        if self.shared is not None and self.shared.enabled:
+            self._check_generation()
+        with self._lock:
+            entry = self._entries.get(kz)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._entries.move_to_end(kz)
+                    self.hits += 1
+                    return entry[2]
+                del self._entries[kz]
+            self.misses += 1
+        return None
+
+    def _check_generation(self):
+        now = time.time()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        generation = self.shared.generation()
+        if generation != self._generation:
+            self._generation = generation
+            self.invalidate()
+
+    def set(self, key, zone, key_id, limit):
+        if not self.size:
+            return
+        with self._lock:
+            self._entries[(key, zone)] = (time.time() + self.timeout,
+                                          key_id, limit)
+            self._entries.move_to_end((key, zone))
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def evict_key(self, key_id):
+        """
+            drop all entries resolved through the Key with the given pk
+        """
+        with self._lock:
+            for kz in [kz for kz, entry in self._entries.items()
+                       if entry[1] == key_id]:
+                del self._entries[kz]
+
+    def invalidate(self):
+        """
+            drop all entries, keeping hit/miss counters
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def make_record(key_id, limits):
+    """
+        returns the record of a key with the given pk, out of all of its
+        tier's limits (annotated with zone_slug)
+
+        a record is key_id, {zone slug: Limit}, the tier-wide Limit or None,
+        with each Limit's tier_limit set
+    """
+    tier_limit = None
+    zone_limits = {}
+    for limit in limits:
+        if limit.zone_slug is None:
+            tier_limit = limit
+        else:
+            zone_limits[limit.zone_slug] = limit
+    for limit in zone_limits.values():
+        limit.tier_limit = tier_limit
+    return key_id, zone_limits, tier_limit
+
+
+def tier_limits(tier_id):
+    """
+        queryset of all of a tier's limits, as make_record expects them
+    """
+    return Limit.objects.select_related('tier').filter(
+        tier_id=tier_id
+    ).annotate(zone_slug=F('zone__slug'))
+
+
+class SharedLimitCache(object):
+    """
+        per-key records of resolved limits (see make_record) in the Django
+        cache named by SIMPLEKEYS_LIMIT_CACHE_SHARED, shared by every process
+
+        sits behind each process's LimitCache: a miss there checks here
+        before the database.  Records carry the versions they were built
+        at: a global one bumped by saving or deleting a Tier, Zone or Limit,
+        and a per-key one bumped by saving or deleting the Key, which also
+        writes its record through.  A record whose versions aren't current
+        is ignored.  Records filled on a miss carry the versions read before
+        the database was queried, so a fill racing a change can't pass off
+        what it read as current.  Every change also bumps a generation that
+        LimitCache polls, so each process drops its own entries too.
+    """
+
+    GENERATION = 'simplekeys:limits:generation'
+    VERSION = 'simplekeys:limits:version'
+
+    def __init__(self, alias=None, timeout=None):
+        if alias is None:
+            alias = getattr(settings, 'SIMPLEKEYS_LIMIT_CACHE_SHARED', None)
+        if timeout is None:
+            timeout = getattr(settings,
+                              'SIMPLEKEYS_LIMIT_CACHE_SHARED_TIMEOUT', 300)
+        self.alias = alias
+        self.timeout = timeout
+        self._cache = None
+
+    @property
+    def enabled(self):
+        return self.alias is not None
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from django.core.cache import caches
+            self._cache = caches[self.alias]
+        return self._cache
+
+    def _record_key(self, key):
+        return 'simplekeys:limits:key:{}'.format(key)
+
+    def _version_key(self, key):
+        return 'simplekeys:limits:key-version:{}'.format(key)
+
+    def _counter(self, name, value, timeout=None):
+        # a counter that was evicted restarts from the time rather than 0,
+        # so it never repeats a value records were stored with
+        if value is None:
+            self.cache.add(name, int(time.time() * 1000), timeout)
+            value = self.cache.get(name)
+        return value
+
+    def _bump(self, name, timeout=None):
+        try:
+            self.cache.incr(name)
+        except ValueError:
+            self._counter(name, None, timeout)
+
+    def generation(self):
+        return self._counter(self.GENERATION, self.cache.get(self.GENERATION))
+
+    def lookup(self, key):
+        """
+            returns key's record, or None if there isn't a current one, and
+            the versions to fill it with (see fill) after a miss
+
+            lookups only read, so unknown keys leave nothing in the cache
+        """
+        names = [self._record_key(key), self.VERSION, self._version_key(key)]
+        values = self.cache.get_many(names)
+        versions = (values.get(names[1]), values.get(names[2]))
+        return self._current(values.get(names[0]), versions), versions
+
+    async def alookup(self, key):
+        names = [self._record_key(key), self.VERSION, self._version_key(key)]
+        values = await self.cache.aget_many(names)
+        versions = (values.get(names[1]), values.get(names[2]))
+        return self._current(values.get(names[0]), versions), versions
+
+    def get(self, key):
+        """
+            returns key's record, or None if there isn't a current one
+        """
+        return self.lookup(key)[0]
+
+    async def aget(self, key):
+        return (await self.alookup(key))[0]
+
+    def get_many(self, keys):
+        """
+            returns {key: record} for the keys with a current record
+        """
+        names = {key: (self._record_key(key), self._version_key(key))
+                 for key in keys}
+        values = self.cache.get_many(
+            [name for pair in names.values() for name in pair] +
+            [self.VERSION]
+        )
+        version = values.get(self.VERSION)
+        records = {}
+        for key, (record_key, version_key) in names.items():
+            record = self._current(values.get(record_key),
+                                   (version, values.get(version_key)))
+            if record is not None:
+                records[key] = record
+        return records
+
+    def _current(self, stored, versions):
+        if stored is None or None in versions or stored[0] != versions:
+            return None
+        return stored[1]
+
+    def _missing_versions(self, key, versions):
+        """
+            (index, name, timeout) of each of versions lookup found missing
+        """
+        # per-key versions needn't outlive the records they're checked for
+        names = [(self.VERSION, None), (self._version_key(key), self.timeout)]
+        return [(i,) + names[i] for i, version in enumerate(versions)
+                if version is None]
+
+    def fill(self, key, record, versions):
+        """
+            store key's record, built from the database after lookup
+            returned versions
+
+            versions that were missing are started now, and the record is
+            only stored if nothing else (e.g. a change bumping them) started
+            them first, as it may have been read before that change
+        """
+        versions = list(versions)
+        for i, name, timeout in self._missing_versions(key, versions):
+            versions[i] = int(time.time() * 1000)
+            if not self.cache.add(name, versions[i], timeout):
+                return
+        self.cache.set(self._record_key(key), (tuple(versions), record),
+                       self.timeout)
+
+    async def afill(self, key, record, versions):
+        versions = list(versions)
+        for i, name, timeout in self._missing_versions(key, versions):
+            versions[i] = int(time.time() * 1000)
+            if not await self.cache.aadd(name, versions[i], timeout):
+                return
+        await self.cache.aset(self._record_key(key),
+                              (tuple(versions), record), self.timeout)
+
+    def key_changed(self, kobj, deleted=False):
+        """
+            write kobj's record through, dropping it if kobj isn't active
+        """
+        self._bump(self._version_key(kobj.key), self.timeout)
+        if deleted or kobj.status != 'a':
+            self.cache.delete(self._record_key(kobj.key))
+        else:
+            record = make_record(kobj.pk, tier_limits(kobj.tier_id))
+            self.fill(kobj.key, record, self.lookup(kobj.key)[1])
+        self._bump(self.GENERATION)
+
+    def limits_changed(self):
+        self._bump(self.VERSION)
+        self._bump(self.GENERATION)
+
+
+shared_limit_cache = SharedLimitCache()
+limit_cache = LimitCache(shared=shared_limit_cache)
+
+
+# the shared cache is only told about changes once they're committed:
+# before then other processes would read the old rows from the database &
+# fill them under versions that look current, and a rollback would leave a
+# written-through record behind
+
+
+def _key_changed(sender, instance, signal, **kwargs):
+    limit_cache.evict_key(instance.pk)
+    if shared_limit_cache.enabled:
+        transaction.on_commit(partial(shared_limit_cache.key_changed,
+                                      instance,
+                                      deleted=signal is post_delete))
+
+
+def _limits_changed(sender, instance, **kwargs):
+    limit_cache.invalidate()
+    if shared_limit_cache.enabled:
+        transaction.on_commit(shared_limit_cache.limits_changed)
+
+
+for signal in (post_save, post_delete):
+    signal.connect(_key_changed, sender=Key,
+                   dispatch_uid='simplekeys_limitcache_key')
+    for model in (Tier, Zone, Limit):
+        signal.connect(_limits_changed, sender=model,
+                       dispatch_uid='simplekeys_limitcache_' +
+                       model.__name__.lower())
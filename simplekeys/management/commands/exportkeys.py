@@ -1,26 +1,82 @@
+import io
 import csv
+import gzip
 from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
 from ...models import Key
 
 
 class Command(BaseCommand):
     help = 'Export API user information.'
 
+    fields = ('key', 'status', 'tier', 'email', 'name', 'organization', 'usage', 'website',
+              'created_at', 'updated_at')
+
     def add_arguments(self, parser):
         parser.add_argument('--since', dest='since', default=False,
                             help='only dump users since a given date')
+        parser.add_argument('--format', dest='format', default='csv',
+                            choices=('csv', 'jsonl'), help='output format')
+        parser.add_argument('--output', dest='output', default=None,
+                            help='write to this file instead of stdout, '
+                                 'gzipped if it ends in .gz')
+        parser.add_argument('--batch-size', dest='batch_size', default=1000,
+                            help='number of keys to fetch per query')
+
+    def iter_keys(self, since, batch_size):
+        """
+            yield each key as a dict, ordered by created_at
+
+            keys are fetched batch_size at a time, each batch starting after
+            the (created_at, id) of the last, so no query has to skip over
+            earlier rows and the whole table is never held in memory
+        """
+        qs = Key.objects.all()
+        if since:
+            qs = qs.filter(created_at__gte=since)
+        # tier name is joined in rather than queried for each key
+        fields = [f for f in self.fields if f != 'tier']
+        qs = qs.order_by('created_at', 'id').values(
+            'id', *fields, tier_name=F('tier__name')
+        )
+
+        batch = list(qs[:batch_size])
+        while batch:
+            for row in batch:
+                yield row
+            last = batch[-1]
+            batch = list(qs.filter(
+                Q(created_at__gt=last['created_at']) |
+                Q(created_at=last['created_at'], id__gt=last['id'])
+            )[:batch_size])
 
     def handle(self, *args, **options):
-        fields = ('key', 'status', 'tier', 'email', 'name', 'organization', 'usage', 'website',
-                  'created_at', 'updated_at')
+        if options['output']:
+            if options['output'].endswith('.gz'):
+                out = gzip.open(options['output'], 'wt', newline='')
+            else:
+                out = io.open(options['output'], 'w', newline='')
+        else:
+            out = self.stdout
 
-        dw = csv.DictWriter(self.stdout, fields)
-        dw.writeheader()
+        try:
+            self.export(out, options)
+        finally:
+            if out is not self.stdout:
+                out.close()
 
-        qs = Key.objects.all()
+    def export(self, out, options):
+        if options['format'] == 'csv':
+            dw = csv.DictWriter(out, self.fields)
+            dw.writeheader()
+            write = dw.writerow
+        else:
+            encoder = DjangoJSONEncoder()
 
-        if options['since']:
-            qs = qs.filter(created_at__gte=options['since'])
+            def write(row):
+                out.write(encoder.encode(row) + '\n')
 
-        for key in qs.order_by('created_at'):
-            dw.writerow({f: getattr(key, f) for f in fields})
+        for row in self.iter_keys(options['since'], int(options['batch_size'])):
+            row['tier'] = row.pop('tier_name')
+            write({f: row[f] for f in self.fields})
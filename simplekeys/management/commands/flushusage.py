@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from ...usage import flush_usage
+
+
+class Command(BaseCommand):
+    help = 'Copy usage counters from the rate limit backend into the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', dest='days', default=2, help='days of usage to copy')
+        parser.add_argument('--batch-size', dest='batch_size', default=1000,
+                            help='rows per database write')
+
+    def handle(self, *args, **options):
+
+        backend = getattr(settings, 'SIMPLEKEYS_RATE_LIMIT_BACKEND',
+                          'simplekeys.backends.CacheBackend')
+        backend = import_string(backend)()
+
+        rows = flush_usage(backend, days=int(options['days']),
+                           batch_size=int(options['batch_size']))
+        self.stdout.write('{} usage rows written'.format(rows))
@@ -0,0 +1,107 @@
+import io
+import csv
+import sys
+import gzip
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from ...replay import replay, OUTCOMES
+
+
+class Command(BaseCommand):
+    help = ('Replay a trace of requests through verify() with a virtual clock '
+            'and compare its decisions to an exact reference limiter.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace',
+                            help='CSV of timestamp,key,zone[,cost] rows in '
+                                 'timestamp order, - for stdin, gzipped if '
+                                 'it ends in .gz.  Timestamps are Unix '
+                                 'seconds or ISO 8601 (UTC).')
+        parser.add_argument('--backend', dest='backend', default=None,
+                            help='rate limit backend to replay against '
+                                 '(default: SIMPLEKEYS_RATE_LIMIT_BACKEND), '
+                                 'its counts for the trace\'s keys are used '
+                                 'and updated')
+        parser.add_argument('--start', dest='start', default=None,
+                            help='time to start the clock at (default: the '
+                                 'first timestamp)')
+
+    def handle(self, *args, **options):
+        backend = None
+        if options['backend']:
+            backend = import_string(options['backend'])()
+        start = None
+        if options['start']:
+            start = self.parse_time(options['start'])
+
+        if options['trace'] == '-':
+            trace = sys.stdin
+        elif options['trace'].endswith('.gz'):
+            trace = gzip.open(options['trace'], 'rt', newline='')
+        else:
+            trace = io.open(options['trace'], newline='')
+
+        try:
+            report = replay(self.iter_requests(trace), backend, start)
+        finally:
+            if trace is not sys.stdin:
+                trace.close()
+        self.write_report(report, options['backend'] or getattr(
+            settings, 'SIMPLEKEYS_RATE_LIMIT_BACKEND',
+            'simplekeys.backends.CacheBackend'
+        ))
+
+    def parse_time(self, value):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise CommandError('bad timestamp {!r}'.format(value))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return parsed.timestamp()
+
+    def iter_requests(self, trace):
+        """
+            yield timestamp, key, zone, cost for each row of trace, skipping
+            a header row
+        """
+        for line, row in enumerate(csv.reader(trace), 1):
+            if not row:
+                continue
+            if line == 1 and row[0] == 'timestamp':
+                continue
+            if len(row) not in (3, 4):
+                raise CommandError('line {}: expected timestamp,key,zone'
+                                   '[,cost]'.format(line))
+            cost = int(row[3]) if len(row) == 4 else 1
+            yield self.parse_time(row[0]), row[1], row[2], cost
+
+    def write_report(self, report, backend):
+        write = self.stdout.write
+        speedup = (report.trace_seconds / report.elapsed
+                   if report.elapsed else 0)
+        write('replayed {} requests against {}'.format(report.requests,
+                                                       backend))
+        write('{:.1f}s of trace in {:.2f}s, {:.0f} req/s, {:.1f}x real '
+              'time'.format(report.trace_seconds, report.elapsed,
+                            report.throughput, speedup))
+        write('')
+        write('{:<10}{:>12}{:>12}'.format('outcome', 'replayed', 'reference'))
+        for outcome in OUTCOMES:
+            write('{:<10}{:>12}{:>12}'.format(outcome,
+                                              report.outcomes[outcome],
+                                              report.reference[outcome]))
+        write('')
+        write('diverged: {} ({:.3%})'.format(
+            report.diverged,
+            report.diverged / report.requests if report.requests else 0
+        ))
+        write('  allowed, reference rejected: {}'.format(report.over))
+        write('  rejected, reference allowed: {}'.format(report.under))
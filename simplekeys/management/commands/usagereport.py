@@ -3,23 +3,39 @@ from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils.module_loading import import_string
 
+from ...usage import iter_usage
+
 
 class Command(BaseCommand):
     help = 'Export API usage report.'
 
     def add_arguments(self, parser):
         parser.add_argument('--days', dest='days', default=7, help='days of usage to export')
+        parser.add_argument('--source', dest='source', default='backend',
+                            choices=('backend', 'db'),
+                            help='read usage from the rate limit backend or the '
+                                 'database (see flushusage)')
+        parser.add_argument('--chunk-size', dest='chunk_size', default=1000,
+                            help='number of keys to look up at once')
+        parser.add_argument('--zone', dest='zones', action='append',
+                            help='only report on this zone (may be repeated)')
+        parser.add_argument('--key', dest='keys', action='append',
+                            help='only report on this key (may be repeated)')
 
     def handle(self, *args, **options):
 
-        backend = getattr(settings, 'SIMPLEKEYS_RATE_LIMIT_BACKEND',
-                          'simplekeys.backends.CacheBackend')
-        backend = import_string(backend)()
+        if options['source'] == 'db':
+            usage = iter_usage
+        else:
+            backend = getattr(settings, 'SIMPLEKEYS_RATE_LIMIT_BACKEND',
+                              'simplekeys.backends.CacheBackend')
+            usage = import_string(backend)().iter_usage
 
         dw = csv.writer(self.stdout)
         dw.writerow(('key', 'zone', 'date', 'requests'))
 
-        for key, date_zone_num in backend.get_usage(days=int(options['days'])).items():
-            for date, zone_num in date_zone_num.items():
-                for zone, requests in zone_num.items():
-                    dw.writerow((key, zone, date, requests))
+        # rows are written as each chunk of keys is looked up
+        for row in usage(keys=options['keys'], zones=options['zones'],
+                         days=int(options['days']),
+                         chunk_size=int(options['chunk_size'])):
+            dw.writerow(row)
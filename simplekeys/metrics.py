@@ -0,0 +1,151 @@
+import bisect
+import threading
+from django.conf import settings
+from django.dispatch import Signal
+
+
+# upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+           0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# sent after each verification while metrics are enabled, with arguments
+# zone, tier (slug, '' if the key was invalid), outcome ('ok', 'invalid',
+# 'rate', 'quota' or 'error') & timings (stage -> seconds)
+verification_finished = Signal()
+
+
+class _ThreadMetrics(object):
+    def __init__(self):
+        # (zone, tier, outcome) -> count
+        self.outcomes = {}
+        # stage -> [count per bucket (last is +Inf), ..., total seconds]
+        self.latency = {}
+
+
+class Metrics(object):
+    """
+        in-process verification outcome counters & stage latency histograms
+
+        each thread records into its own counters, so recording never takes
+        a lock, and the counters of all threads are summed when they are
+        read.  Counts are per process, like any other in-process metric.
+    """
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = getattr(settings, 'SIMPLEKEYS_METRICS', False)
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _thread_metrics(self):
+        try:
+            return self._local.metrics
+        except AttributeError:
+            metrics = self._local.metrics = _ThreadMetrics()
+            with self._lock:
+                self._threads.append(metrics)
+            return metrics
+
+    def record(self, zone, tier, outcome, timings):
+        """
+            count a verification's outcome & add its stage timings
+        """
+        metrics = self._thread_metrics()
+        counter = (zone, tier, outcome)
+        metrics.outcomes[counter] = metrics.outcomes.get(counter, 0) + 1
+        for stage, seconds in timings.items():
+            histogram = metrics.latency.get(stage)
+            if histogram is None:
+                histogram = metrics.latency[stage] = [0] * (len(BUCKETS) + 2)
+            histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+        if verification_finished.receivers:
+            verification_finished.send(sender=self.__class__, zone=zone,
+                                       tier=tier, outcome=outcome,
+                                       timings=timings)
+
+    def reset(self):
+        with self._lock:
+            self._threads = []
+            self._local = threading.local()
+
+    def snapshot(self):
+        """
+            returns outcomes, latency summed across threads
+
+            outcomes is {(zone, tier, outcome): count}, latency is
+            {stage: (cumulative count per bucket, total seconds)}, with a
+            final +Inf bucket holding the total count
+        """
+        with self._lock:
+            threads = list(self._threads)
+
+        outcomes = {}
+        latency = {}
+        for metrics in threads:
+            # copying is atomic, the owning thread may be writing
+            for counter, count in metrics.outcomes.copy().items():
+                outcomes[counter] = outcomes.get(counter, 0) + count
+            for stage, histogram in metrics.latency.copy().items():
+                total = latency.setdefault(stage, [0] * (len(BUCKETS) + 2))
+                for i, value in enumerate(histogram[:]):
+                    total[i] += value
+
+        for stage, histogram in latency.items():
+            cumulative = []
+            count = 0
+            for value in histogram[:-1]:
+                count += value
+                cumulative.append(count)
+            latency[stage] = (cumulative, histogram[-1])
+        return outcomes, latency
+
+    def prometheus(self):
+        """
+            the current metrics in the Prometheus text exposition format
+        """
+        outcomes, latency = self.snapshot()
+        lines = [
+            '# HELP simplekeys_verifications_total Verifications by zone, '
+            'tier & outcome.',
+            '# TYPE simplekeys_verifications_total counter',
+        ]
+        for (zone, tier, outcome), count in sorted(outcomes.items()):
+            lines.append('simplekeys_verifications_total{{{}}} {}'.format(
+                _labels(zone=zone, tier=tier, outcome=outcome), count
+            ))
+
+        lines += [
+            '# HELP simplekeys_verify_stage_seconds Time spent in each '
+            'stage of verification.',
+            '# TYPE simplekeys_verify_stage_seconds histogram',
+        ]
+        bounds = [repr(b) for b in BUCKETS] + ['+Inf']
+        for stage, (cumulative, seconds) in sorted(latency.items()):
+            for bound, count in zip(bounds, cumulative):
+                lines.append(
+                    'simplekeys_verify_stage_seconds_bucket{{{}}} {}'.format(
+                        _labels(stage=stage, le=bound), count
+                    )
+                )
+            lines.append('simplekeys_verify_stage_seconds_sum{{{}}} {!r}'.format(
+                _labels(stage=stage), seconds
+            ))
+            lines.append('simplekeys_verify_stage_seconds_count{{{}}} {}'.format(
+                _labels(stage=stage), cumulative[-1]
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+
+
+metrics = Metrics()
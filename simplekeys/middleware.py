@@ -1,15 +1,16 @@
-import re
-from .verifier import verify_request
-try:
-    from django.utils.deprecation import MiddlewareMixin
-except ImportError:
-    MiddlewareMixin = object
+from django.utils.deprecation import MiddlewareMixin
+from .verifier import verify_request, averify_request, add_rate_limit_headers
+from .zones import ZoneRouter
 
 
 class SimpleKeysMiddleware(MiddlewareMixin):
+    # under ASGI requests are verified on the event loop via averify_request
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response=None):
         self._zones = None
-        self.get_response = get_response
+        super(SimpleKeysMiddleware, self).__init__(get_response)
 
     @property
     def zones(self):
@@ -17,17 +18,36 @@ class SimpleKeysMiddleware(MiddlewareMixin):
             from django.conf import settings
             zones = getattr(settings, 'SIMPLEKEYS_ZONE_PATHS',
                             [('.*', 'default')])
-
-            self._zones = [
-                ((re.compile(path) if isinstance(path, str) else path), zone)
-                for (path, zone) in zones
-            ]
+            self._zones = ZoneRouter(
+                zones, getattr(settings, 'SIMPLEKEYS_ZONE_CACHE_SIZE', 1024)
+            )
         return self._zones
 
+    def get_zone(self, path):
+        return self.zones.get_zone(path)
+
+    def get_route(self, path):
+        return self.zones.get_route(path)
+
     def process_request(self, request):
-        for path, zone in self.zones:
-            if path.match(request.path):
-                return verify_request(request, zone)
+        route = self.get_route(request.path)
+        if route is not None:
+            return verify_request(request, *route)
 
-        # no paths matched, pass-through
+        # pass-through
         return None
+
+    def process_response(self, request, response):
+        return add_rate_limit_headers(
+            response, getattr(request, 'simplekeys_result', None)
+        )
+
+    async def __acall__(self, request):
+        # MiddlewareMixin would run process_request in a thread
+        route = self.get_route(request.path)
+        if route is not None:
+            response = await averify_request(request, *route)
+            if response is not None:
+                return response
+        response = await self.get_response(request)
+        return self.process_response(request, response)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simplekeys', '0003_auto_20181030_0030'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='limit',
+            name='lease_size',
+            field=models.PositiveIntegerField(default=1, help_text='tokens each process takes from the backend at once, values above 1 trade precision for fewer backend calls'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simplekeys', '0004_limit_lease_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Usage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40)),
+                ('zone', models.SlugField(db_index=False)),
+                ('date', models.DateField()),
+                ('requests', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='simplekeys__date_f439ef_idx')],
+                'unique_together': {('key', 'zone', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simplekeys', '0005_usage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='key',
+            index=models.Index(fields=['created_at', 'id'], name='simplekeys__created_4eb761_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simplekeys', '0006_key_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='limit',
+            name='zone',
+            field=models.ForeignKey(blank=True, help_text="leave blank for a limit on all of the tier's zones together, enforced in addition to each zone's limit", null=True, on_delete=django.db.models.deletion.CASCADE, related_name='limits', to='simplekeys.zone'),
+        ),
+        migrations.AddConstraint(
+            model_name='limit',
+            constraint=models.UniqueConstraint(condition=models.Q(('zone__isnull', True)), fields=('tier',), name='simplekeys_limit_one_tier_limit'),
+        ),
+    ]
@@ -33,16 +33,32 @@ class Zone(models.Model):
 
 class Limit(models.Model):
     tier = models.ForeignKey(Tier, related_name='limits', on_delete=models.CASCADE)
-    zone = models.ForeignKey(Zone, related_name='limits', on_delete=models.CASCADE)
+    zone = models.ForeignKey(
+        Zone, related_name='limits', on_delete=models.CASCADE,
+        null=True, blank=True,
+        help_text='leave blank for a limit on all of the tier\'s zones '
+                  'together, enforced in addition to each zone\'s limit'
+    )
     quota_period = models.CharField(max_length=1, choices=QUOTA_PERIODS)
     quota_requests = models.PositiveIntegerField()
     requests_per_second = models.PositiveIntegerField()
     burst_size = models.PositiveIntegerField()
+    lease_size = models.PositiveIntegerField(
+        default=1,
+        help_text='tokens each process takes from the backend at once, '
+                  'values above 1 trade precision for fewer backend calls'
+    )
 
     class Meta:
         unique_together = (
             ('tier', 'zone'),
         )
+        constraints = [
+            # unique_together doesn't stop repeated NULL zones
+            models.UniqueConstraint(fields=['tier'],
+                                    condition=models.Q(zone__isnull=True),
+                                    name='simplekeys_limit_one_tier_limit'),
+        ]
 
 
 class Key(models.Model):
@@ -59,5 +75,30 @@ class Key(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # exportkeys pages through keys in this order
+            models.Index(fields=['created_at', 'id']),
+        ]
+
     def __str__(self):
         return '{} ({})'.format(self.email, self.key)
+
+
+class Usage(models.Model):
+    key = models.CharField(max_length=40)
+    zone = models.SlugField(max_length=50, db_index=False)
+    date = models.DateField()
+    requests = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (
+            ('key', 'zone', 'date'),
+        )
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return '{} {} {}: {}'.format(self.key, self.zone, self.date,
+                                     self.requests)
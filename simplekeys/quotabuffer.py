@@ -0,0 +1,160 @@
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import clock
+
+
+class QuotaBuffer(object):
+    """
+        process-local write-behind buffer for quota counters
+
+        when enabled the verifier takes tokens from the backend as usual
+        but counts quota here, flushing the counts to the backend in one
+        batch every SIMPLEKEYS_QUOTA_FLUSH_INTERVAL seconds or
+        SIMPLEKEYS_QUOTA_FLUSH_REQUESTS requests, whichever comes first
+
+        between flushes quotas are enforced against an estimate: the total
+        the backend reported at the last flush plus this process's unflushed
+        count.  The first request for a key, zone & period in a process is
+        counted straight through to learn the backend's current total.
+    """
+
+    def __init__(self, enabled=None, flush_interval=None,
+                 flush_requests=None):
+        if enabled is None:
+            enabled = getattr(settings, 'SIMPLEKEYS_QUOTA_BUFFER', False)
+        if flush_interval is None:
+            flush_interval = getattr(settings,
+                                     'SIMPLEKEYS_QUOTA_FLUSH_INTERVAL', 10)
+        if flush_requests is None:
+            flush_requests = getattr(settings,
+                                     'SIMPLEKEYS_QUOTA_FLUSH_REQUESTS', 100)
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.flush_requests = flush_requests
+        self._lock = threading.Lock()
+        # only one flush at a time, so counts are never sent twice
+        self._flush_lock = threading.Lock()
+        # (key, zone, quota_range) -> [backend total, unflushed, touched]
+        self._counts = {}
+        self._requests = 0
+        self._next_flush = clock.time() + flush_interval
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._requests = 0
+
+    def pending(self):
+        """
+            returns the number of counted requests not yet flushed
+        """
+        with self._lock:
+            return sum(entry[1] for entry in self._counts.values())
+
+    def _record(self, kzr, amount):
+        """
+            returns estimate, flush_due
+
+            estimate is None if this process hasn't seen the backend's
+            total for kzr yet, in which case nothing is recorded
+        """
+        with self._lock:
+            entry = self._counts.get(kzr)
+            if entry is None:
+                return None, False
+            limit = getattr(kzr[2], 'limit', None)
+            if limit is not None and entry[0] + entry[1] + amount > limit:
+                # sliding quotas don't count rejected requests
+                return entry[0] + entry[1] + amount, False
+            entry[1] += amount
+            entry[2] = True
+            self._requests += 1
+            due = (self._requests >= self.flush_requests or
+                   clock.time() >= self._next_flush)
+            return entry[0] + entry[1], due
+
+    def _seen(self, kzr, total):
+        with self._lock:
+            entry = self._counts.setdefault(kzr, [0, 0, True])
+            entry[0] = max(entry[0], total)
+            return entry[0] + entry[1]
+
+    def add(self, backend, key, zone, quota_range, amount=1):
+        """
+            count amount against key & zone's quota for quota_range,
+            flushing to backend if due
+
+            returns the estimated quota value
+        """
+        kzr = (key, zone, quota_range)
+        estimate, due = self._record(kzr, amount)
+        if estimate is None:
+            return self._seen(kzr, backend.get_and_inc_quota_value(
+                key, zone, quota_range, amount
+            ))
+        if due:
+            # requests don't wait on another thread's flush
+            self.flush(backend, blocking=False)
+        return estimate
+
+    async def aadd(self, backend, key, zone, quota_range, amount=1):
+        """
+            async version of add, backend writes happen in a thread
+        """
+        kzr = (key, zone, quota_range)
+        estimate, due = self._record(kzr, amount)
+        if estimate is None:
+            total = await sync_to_async(backend.get_and_inc_quota_value)(
+                key, zone, quota_range, amount
+            )
+            return self._seen(kzr, total)
+        if due:
+            await sync_to_async(self.flush)(backend, blocking=False)
+        return estimate
+
+    def flush(self, backend, blocking=True):
+        """
+            write all unflushed counts to backend in one batch
+
+            unless blocking, returns at once if another thread is already
+            flushing
+        """
+        if not self._flush_lock.acquire(blocking=blocking):
+            return
+        try:
+            with self._lock:
+                self._requests = 0
+                self._next_flush = clock.time() + self.flush_interval
+                batch = []
+                for kzr, entry in list(self._counts.items()):
+                    if entry[1]:
+                        batch.append((kzr, entry[1]))
+                    elif not entry[2]:
+                        # idle since the last flush, e.g. a past period
+                        del self._counts[kzr]
+                    entry[2] = False
+            if not batch:
+                return
+
+            counts = []
+            for (key, zone, quota_range), amount in batch:
+                if getattr(quota_range, 'limit', None) is not None:
+                    # these were allowed, count them whatever the total
+                    quota_range = quota_range._replace(limit=None)
+                counts.append((key, zone, quota_range, amount))
+            totals = backend.inc_quota_values(counts)
+            # counts stay part of the estimate until they are written, if
+            # the backend fails they are retried next flush
+            with self._lock:
+                for (kzr, amount), total in zip(batch, totals):
+                    entry = self._counts.get(kzr)
+                    if entry is not None:
+                        entry[0] = max(entry[0], total)
+                        entry[1] -= amount
+        finally:
+            self._flush_lock.release()
+
+
+quota_buffer = QuotaBuffer()
@@ -0,0 +1,178 @@
+import time
+from collections import Counter
+
+from . import clock, verifier
+from .backends import TIER_ZONE, QuotaWindow, refill, windows_add
+from .limitcache import LimitCache
+from .verifier import (verify, get_quota_range, VerificationError,
+                       RateLimitError, QuotaError)
+
+OUTCOMES = ('ok', 'rate', 'quota', 'invalid')
+
+# (key, zone) pairs whose limits are kept for the length of a replay
+LIMIT_CACHE_SIZE = 100000
+
+
+class ReferenceLimiter(object):
+    """
+        exact token buckets & quotas for the requests of a replay
+
+        every request is checked against the limits verify resolved for it,
+        with no leases, buffering, shared storage or rounding, so that any
+        difference from verify's decisions is down to the backend &
+        settings being replayed
+    """
+
+    def __init__(self):
+        # (key, zone) -> tokens, timestamp
+        self.buckets = {}
+        # (key, zone, quota range) -> count or sliding window ring
+        self.quotas = {}
+
+    def check(self, key, zone, limit, cost, now):
+        """
+            returns the outcome of a request, 'ok', 'rate' or 'quota'
+        """
+        buckets = [(zone, limit)]
+        tier_limit = getattr(limit, 'tier_limit', None)
+        if tier_limit is not None:
+            buckets.append((TIER_ZONE, tier_limit))
+
+        tokens = [refill(*self.buckets.get((key, bucket_zone), (0, None)),
+                         now, bucket_limit)
+                  for bucket_zone, bucket_limit in buckets]
+        if any(bucket_tokens < cost for bucket_tokens in tokens):
+            return 'rate'
+
+        ranges = []
+        for (bucket_zone, bucket_limit), bucket_tokens in zip(buckets, tokens):
+            self.buckets[(key, bucket_zone)] = (bucket_tokens - cost, now)
+            quota_range = get_quota_range(bucket_limit)
+            ranges.append(((key, bucket_zone, str(quota_range)), quota_range))
+
+        if isinstance(ranges[0][1], QuotaWindow):
+            rings, values = windows_add(
+                [self.quotas.get(kzr) for kzr, _ in ranges],
+                [window for _, window in ranges], cost
+            )
+            for (kzr, _), ring in zip(ranges, rings):
+                self.quotas[kzr] = ring
+        else:
+            values = []
+            for kzr, _ in ranges:
+                self.quotas[kzr] = self.quotas.get(kzr, 0) + cost
+                values.append(self.quotas[kzr])
+
+        if any(value > bucket_limit.quota_requests
+               for (_, bucket_limit), value in zip(buckets, values)):
+            return 'quota'
+        return 'ok'
+
+
+def _outcome(error):
+    if error is None:
+        return 'ok'
+    elif isinstance(error, RateLimitError):
+        return 'rate'
+    elif isinstance(error, QuotaError):
+        return 'quota'
+    return 'invalid'
+
+
+class ReplayReport(object):
+    """
+        decision counts of a replay & of the reference limiter, and how
+        many requests they decided differently
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.outcomes = Counter()
+        self.reference = Counter()
+        # allowed by verify but not the reference & vice versa
+        self.over = 0
+        self.under = 0
+        self.first_time = None
+        self.last_time = None
+        self.elapsed = 0.0
+
+    def add(self, outcome, reference):
+        self.requests += 1
+        self.outcomes[outcome] += 1
+        self.reference[reference] += 1
+        if outcome == 'ok' and reference != 'ok':
+            self.over += 1
+        elif outcome != 'ok' and reference == 'ok':
+            self.under += 1
+
+    @property
+    def diverged(self):
+        return self.over + self.under
+
+    @property
+    def trace_seconds(self):
+        if self.first_time is None:
+            return 0.0
+        return self.last_time - self.first_time
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+
+def replay(requests, backend=None, start=None):
+    """
+        verify each (timestamp, key, zone, cost) of requests with a virtual
+        clock set to its timestamp, returns a ReplayReport
+
+        requests should be in timestamp order, the clock never moves
+        backwards.  backend (default: verify's) is used in place of verify's
+        for the replay, and start is where the clock starts (default: the
+        first timestamp).
+
+        limits don't change during a replay, so each (key, zone)'s limit is
+        resolved once and kept in a limit cache of the replay's own
+    """
+    report = ReplayReport()
+    reference = ReferenceLimiter()
+    virtual = clock.VirtualClock(start or 0.0)
+    previous_backend = verifier.backend
+    previous_limit_cache = verifier.limit_cache
+    if backend is not None:
+        verifier.backend = backend
+    verifier.limit_cache = LimitCache(size=LIMIT_CACHE_SIZE,
+                                      timeout=float('inf'))
+
+    try:
+        with clock.use_clock(virtual):
+            began = time.perf_counter()
+            for timestamp, key, zone, cost in requests:
+                if report.first_time is None:
+                    report.first_time = timestamp
+                    if start is None:
+                        virtual.set(timestamp)
+                virtual.set(max(timestamp, virtual.now))
+                report.last_time = virtual.now
+                report.add(*_check(reference, key, zone, cost, virtual.now))
+            report.elapsed = time.perf_counter() - began
+    finally:
+        verifier.backend = previous_backend
+        verifier.limit_cache = previous_limit_cache
+    return report
+
+
+def _check(reference, key, zone, cost, now):
+    """
+        returns the outcomes of verify & the reference limiter for a request
+    """
+    try:
+        result = verify(key, zone, cost)
+        error = None
+    except (VerificationError, RateLimitError, QuotaError) as e:
+        result = getattr(e, 'result', None)
+        error = e
+    if result is None or result.limit is None:
+        # not a valid key, there's nothing to limit
+        return 'invalid', 'invalid'
+    return _outcome(error), reference.check(key, zone, result.limit, cost,
+                                            now)
@@ -1,8 +1,24 @@
-from django.test import TestCase
+import os
+import time
+import datetime
+import tempfile
+import threading
+import unittest
+import multiprocessing
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
 from freezegun import freeze_time
 
-from ..models import Zone, Key, Tier
-from ..backends import MemoryBackend, CacheBackend
+from ..models import Zone, Key, Tier, Limit
+from ..backends import (MemoryBackend, CacheBackend, RedisBackend,
+                        SharedMemoryBackend, QuotaWindow, window_add,
+                        window_reset)
+
+try:
+    import fakeredis
+except ImportError:     # pragma: no cover
+    fakeredis = None
 
 
 class MemoryBackendTestCase(TestCase):
@@ -53,15 +69,237 @@ class MemoryBackendTestCase(TestCase):
             b.get_and_inc_quota_value('key', 'zone2', '20170411'), 1
         )
 
+    def test_check_and_consume(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        with freeze_time() as frozen_dt:
+            self.assertEquals(
+                b.check_and_consume('key', 'zone', limit, '20170411'), (1, 1)
+            )
+            self.assertEquals(
+                b.check_and_consume('key', 'zone', limit, '20170411'), (0, 2)
+            )
+            # bucket is empty, quota isn't touched
+            tokens, quota = b.check_and_consume('key', 'zone', limit,
+                                                '20170411')
+            self.assertLess(tokens, 1)
+            self.assertIsNone(quota)
 
-class CacheBackendTestCase(MemoryBackendTestCase):
-    """ do the same tests as MemoryBackendTestCase but w/ CacheBackend """
+            frozen_dt.tick(delta=datetime.timedelta(seconds=1))
+            self.assertEquals(
+                b.check_and_consume('key', 'zone', limit, '20170411'), (0, 3)
+            )
 
-    def get_backend(self):
-        # ensure we have a fresh cache backend each time
-        c = CacheBackend()
-        c.cache.clear()
-        return c
+    def test_check_and_consume_many(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        results = b.check_and_consume_many([
+            ('key', 'zone', limit, '20170411', 1, None),
+            ('key2', 'zone', limit, '20170411', 2, None),
+            ('key', 'zone', limit, '20170411', 1, None),
+            # requests are consumed in order, this one sees both above
+            ('key', 'zone', limit, '20170411', 1, None),
+        ])
+        self.assertEquals([quota for tokens, quota in results],
+                          [1, 2, 2, None])
+        self.assertAlmostEqual(results[1][0], 0, delta=0.1)
+        self.assertAlmostEqual(results[2][0], 0, delta=0.1)
+        self.assertEquals(b.check_and_consume_many([]), [])
+
+    async def test_acheck_and_consume(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        tokens, quota = await b.acheck_and_consume('key', 'zone', limit,
+                                                   '20170411')
+        self.assertEquals(quota, 1)
+        tokens, quota = b.check_and_consume('key', 'zone', limit, '20170411')
+        self.assertEquals(quota, 2)
+        tokens, quota = await b.acheck_and_consume('key', 'zone', limit,
+                                                   '20170411')
+        self.assertLess(tokens, 1)
+        self.assertIsNone(quota)
+
+    def test_check_and_consume_cost(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=5)
+        tokens, quota = b.check_and_consume('key', 'zone', limit, '20170411',
+                                            cost=3)
+        self.assertAlmostEqual(tokens, 2, delta=0.1)
+        self.assertEquals(quota, 3)
+        # not enough for another 3
+        tokens, quota = b.check_and_consume('key', 'zone', limit, '20170411',
+                                            cost=3)
+        self.assertIsNone(quota)
+        tokens, quota = b.check_and_consume('key', 'zone', limit, '20170411',
+                                            cost=2)
+        self.assertAlmostEqual(tokens, 0, delta=0.1)
+        self.assertEquals(quota, 5)
+        self.assertEquals(
+            b.get_and_inc_quota_value('key', 'zone', '20170411', 10), 15
+        )
+
+    def test_check_and_consume_without_quota(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=5)
+        b.get_and_inc_quota_value('key', 'zone', '20170411', 7)
+        tokens, quota = b.check_and_consume('key', 'zone', limit, '20170411',
+                                            cost=2, quota_cost=0)
+        self.assertAlmostEqual(tokens, 3, delta=0.1)
+        # current value is reported, but not incremented
+        self.assertEquals(quota, 7)
+        self.assertEquals(
+            b.get_and_inc_quota_value('key', 'zone', '20170411', 1), 8
+        )
+
+    def test_check_and_consume_tier(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=5)
+        tier_limit = Limit(requests_per_second=1, burst_size=3)
+        # not frozen, redis uses server time
+        tokens, quota, tier_tokens, tier_quota = b.check_and_consume(
+            'key', 'zone', limit, '20170411', cost=2,
+            tier_limit=tier_limit, tier_quota_range='201704'
+        )
+        self.assertAlmostEqual(tokens, 3, delta=0.1)
+        self.assertAlmostEqual(tier_tokens, 1, delta=0.1)
+        self.assertEquals((quota, tier_quota), (2, 2))
+        # both buckets are shared by the key's zones
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone2', limit, '20170411', tier_limit=tier_limit,
+            tier_quota_range='201704'
+        )[1::2], (1, 3))
+
+        # the tier bucket is empty, neither bucket is consumed
+        tokens, quota, tier_tokens, tier_quota = b.check_and_consume(
+            'key', 'zone', limit, '20170411', tier_limit=tier_limit,
+            tier_quota_range='201704'
+        )
+        self.assertIsNone(quota)
+        self.assertIsNone(tier_quota)
+        self.assertAlmostEqual(tokens, 3, delta=0.1)
+        self.assertLess(tier_tokens, 1)
+        tokens, quota = b.check_and_consume('key', 'zone', limit,
+                                            '20170411', cost=3)
+        self.assertAlmostEqual(tokens, 0, delta=0.1)
+        self.assertEquals(quota, 5)
+
+    def test_check_and_consume_many_tier(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        tier_limit = Limit(requests_per_second=1, burst_size=3)
+        results = b.check_and_consume_many([
+            ('key', 'zone', limit, '20170411', 1, None, tier_limit,
+             '201704'),
+            ('key', 'zone2', limit, '20170411', 2, None, tier_limit,
+             '201704'),
+            # the zone has a token left, but the tier doesn't
+            ('key', 'zone', limit, '20170411', 1, None, tier_limit,
+             '201704'),
+            ('key', 'zone', limit, '20170411', 1, None),
+        ])
+        self.assertEquals([result[1::2] for result in results],
+                          [(1, 1), (2, 3), (None, None), (2,)])
+
+    def test_sliding_quota(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=100)
+        # slots are hours for a daily quota
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone', limit, QuotaWindow('d', 1000), cost=3
+        )[1], 3)
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone', limit, QuotaWindow('d', 1010), cost=2
+        )[1], 5)
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone', limit, QuotaWindow('d', 1023), quota_cost=0
+        )[1], 5)
+        # a day on, the first requests have slid out of the window
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone', limit, QuotaWindow('d', 1024)
+        )[1], 3)
+        self.assertEquals(b.get_and_inc_quota_value(
+            'key', 'zone', QuotaWindow('d', 1034), 4
+        ), 5)
+        # late counts are kept while their slot is in the window
+        self.assertEquals(b.get_and_inc_quota_value(
+            'key', 'zone', QuotaWindow('d', 1030)
+        ), 6)
+        self.assertEquals(b.get_and_inc_quota_value(
+            'key', 'zone', QuotaWindow('d', 1000), 5
+        ), 6)
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone2', limit, QuotaWindow('d', 1034)
+        )[1], 1)
+        # after a whole window without requests nothing is left
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone', limit, QuotaWindow('d', 2000), quota_cost=0
+        )[1], 0)
+
+    def test_sliding_quota_limit(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=100)
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone', limit, QuotaWindow('d', 1000, 3), cost=3
+        )[1], 3)
+        # requests over the limit are reported but not counted
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone', limit, QuotaWindow('d', 1001, 3)
+        )[1], 4)
+        self.assertEquals(b.get_and_inc_quota_value(
+            'key', 'zone', QuotaWindow('d', 1002, 3)
+        ), 4)
+        self.assertEquals(b.get_and_inc_quota_value(
+            'key', 'zone', QuotaWindow('d', 1002), 0
+        ), 3)
+        # so once the first requests slide out there's room again
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone', limit, QuotaWindow('d', 1024, 3)
+        )[1], 1)
+
+        # a request over the tier-wide limit isn't counted in the zone
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone2', limit, QuotaWindow('d', 1024, 5), 2, None,
+            limit, QuotaWindow('d', 1024, 1)
+        )[1::2], (2, 2))
+        self.assertEquals(b.check_and_consume(
+            'key', 'zone2', limit, QuotaWindow('d', 1024, 5), quota_cost=0
+        )[1], 0)
+
+    def test_quota_value_ring(self):
+        b = self.get_backend()
+        window = QuotaWindow('d', 1000)
+        b.get_and_inc_quota_value('key', 'zone', window, 3)
+        value = b.get_and_inc_quota_value('key', 'zone',
+                                          window._replace(slot=1001), 2)
+        self.assertEquals(value, 5)
+        ring = value.ring
+        self.assertEquals(ring[0], 1001)
+        self.assertEquals(ring[1000 % 24 + 1], 3)
+        self.assertEquals(ring[1001 % 24 + 1], 2)
+        self.assertEquals(sum(ring[1:]), 5)
+        self.assertEquals(b.inc_quota_values([
+            ('key', 'zone', window._replace(slot=1001), 1),
+        ])[0].ring[1001 % 24 + 1], 3)
+
+    def test_inc_quota_values(self):
+        b = self.get_backend()
+        b.get_and_inc_quota_value('key', 'zone', '20170411', 2)
+        self.assertEquals(b.inc_quota_values([
+            ('key', 'zone', '20170411', 3),
+            ('key', 'zone2', '20170411', 1),
+            ('key', 'zone', '20170411', 1),
+        ]), [5, 1, 6])
+        self.assertEquals(
+            b.get_and_inc_quota_value('key', 'zone', '20170411', 0), 6
+        )
+
+    def test_tat_set_and_retrieve(self):
+        b = self.get_backend()
+        self.assertIsNone(b.get_tat('key', 'zone'))
+        tat = int((time.time() + 10) * 1000000)
+        b.set_tat('key', 'zone', tat)
+        self.assertEquals(b.get_tat('key', 'zone'), tat)
+        self.assertIsNone(b.get_tat('key', 'zone2'))
 
     def test_get_usage(self):
         Zone.objects.create(slug='default', name='Default')
@@ -101,3 +339,504 @@ class CacheBackendTestCase(MemoryBackendTestCase):
             usage = b.get_usage(keys=['key1'], days=2)
             assert len(usage) == 1
             assert len(usage['key1']) == 2
+
+    def test_iter_usage(self):
+        Zone.objects.create(slug='default', name='Default')
+        Zone.objects.create(slug='special', name='Special')
+        tier = Tier.objects.create(slug='default')
+        for i in range(5):
+            Key.objects.create(key='key{}'.format(i), tier=tier,
+                               email='key{}@example.com'.format(i))
+        b = self.get_backend()
+        for i in range(5):
+            b.get_and_inc_quota_value('key{}'.format(i), 'default',
+                                      '20170501', i + 1)
+        b.get_and_inc_quota_value('key1', 'special', '20170502')
+
+        with freeze_time('2017-05-02'):
+            with mock.patch.object(b, 'get_usage_chunk',
+                                   wraps=b.get_usage_chunk) as get_chunk:
+                rows = list(b.iter_usage(chunk_size=2))
+            # keys are looked up 2 at a time
+            self.assertEquals(get_chunk.call_count, 3)
+            self.assertEquals(sorted(rows), [
+                ('key0', 'default', '20170501', 1),
+                ('key1', 'default', '20170501', 2),
+                ('key1', 'special', '20170502', 1),
+                ('key2', 'default', '20170501', 3),
+                ('key3', 'default', '20170501', 4),
+                ('key4', 'default', '20170501', 5),
+            ])
+
+            rows = list(b.iter_usage(keys=['key1'], zones=['special']))
+            self.assertEquals(rows, [('key1', 'special', '20170502', 1)])
+
+
+class MemoryBackendStorageTestCase(TestCase):
+
+    @override_settings(SIMPLEKEYS_MEMORY_SHARDS=1,
+                       SIMPLEKEYS_MEMORY_MAX_BUCKETS=2)
+    def test_idle_buckets_evicted(self):
+        b = MemoryBackend()
+        b.set_token_count('a', 'zone', 1)
+        b.set_token_count('b', 'zone', 2)
+        # use a so that b is the idle one
+        b.get_tokens_and_timestamp('a', 'zone')
+        b.set_token_count('c', 'zone', 3)
+        self.assertEquals(b.bucket_count(), 2)
+        self.assertEquals(b.get_tokens_and_timestamp('a', 'zone')[0], 1)
+        self.assertEquals(b.get_tokens_and_timestamp('b', 'zone'), (0, None))
+        self.assertEquals(b.get_tokens_and_timestamp('c', 'zone')[0], 3)
+
+    @override_settings(SIMPLEKEYS_MEMORY_USAGE_DAYS=2)
+    def test_ended_quota_periods_purged(self):
+        b = MemoryBackend()
+        b.get_and_inc_quota_value('key', 'zone', '20170410')
+        b.get_and_inc_quota_value('key', 'zone', '20170411')
+        b.get_and_inc_quota_value('key', 'zone', '201703')
+        b.get_and_inc_quota_value('key', 'zone', '201704')
+        b.get_and_inc_quota_value('key', 'zone', '20170412')
+        quotas = {}
+        for shard in b._shards:
+            quotas.update(shard.quota)
+        # days are kept for get_usage, months only until they end
+        self.assertEquals(quotas, {'key': {'20170411': {'zone': 1},
+                                           '201704': {'zone': 1},
+                                           '20170412': {'zone': 1}}})
+
+    def test_concurrent_consume(self):
+        b = MemoryBackend()
+        limit = Limit(requests_per_second=1, burst_size=100)
+        allowed = []
+
+        def worker():
+            for _ in range(50):
+                tokens, quota = b.check_and_consume('key', 'zone', limit,
+                                                    '20170411')
+                if quota is not None:
+                    allowed.append(quota)
+
+        with freeze_time():
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        # exactly the burst gets through, each with a distinct quota value
+        self.assertEquals(sorted(allowed), list(range(1, 101)))
+
+
+class SharedMemoryBackendTestCase(MemoryBackendTestCase):
+    """ same tests again, against a memory-mapped table """
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'simplekeys')
+
+    def get_backend(self, slots=1024):
+        b = SharedMemoryBackend(path=self.path, slots=slots)
+        self.addCleanup(b.close)
+        return b
+
+    def test_shared_between_instances(self):
+        limit = Limit(requests_per_second=1, burst_size=2)
+        b1 = self.get_backend()
+        b2 = self.get_backend()
+        with freeze_time():
+            self.assertEquals(
+                b1.check_and_consume('key', 'zone', limit, '20170411'), (1, 1)
+            )
+            self.assertEquals(
+                b2.check_and_consume('key', 'zone', limit, '20170411'), (0, 2)
+            )
+            self.assertIsNone(
+                b1.check_and_consume('key', 'zone', limit, '20170411')[1]
+            )
+
+    def test_get_usage(self):
+        # only the current period is kept
+        self.assertRaises(NotImplementedError, self.get_backend().get_usage,
+                          keys=['key'])
+
+    def test_iter_usage(self):
+        b = self.get_backend()
+        self.assertRaises(NotImplementedError, list,
+                          b.iter_usage(keys=['key'], zones=['zone']))
+
+    @override_settings(SIMPLEKEYS_QUOTA_WINDOW='sliding')
+    def test_sliding_quota(self):
+        self.assertRaises(ImproperlyConfigured, self.get_backend)
+
+    # covered by test_sliding_quota
+    test_sliding_quota_limit = None
+    test_quota_value_ring = None
+
+    def test_size_mismatch(self):
+        self.get_backend(slots=1024)
+        self.assertRaises(ImproperlyConfigured, self.get_backend, slots=2048)
+
+    def test_full_block_reuses_oldest(self):
+        # a single block of 64 slots
+        b = self.get_backend(slots=64)
+        with freeze_time() as frozen_dt:
+            for i in range(65):
+                b.set_token_count('key{}'.format(i), 'zone', i)
+                frozen_dt.tick()
+            self.assertEquals(b.get_tokens_and_timestamp('key0', 'zone'),
+                              (0, None))
+            self.assertEquals(b.get_tokens_and_timestamp('key1', 'zone')[0],
+                              1)
+            self.assertEquals(b.get_tokens_and_timestamp('key64', 'zone')[0],
+                              64)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(),
+                         'requires fork')
+    def test_shared_between_processes(self):
+        self.get_backend()
+        ctx = multiprocessing.get_context('fork')
+        results = ctx.Queue()
+
+        def worker():
+            b = SharedMemoryBackend(path=self.path, slots=1024)
+            limit = Limit(requests_per_second=1, burst_size=100)
+            allowed = 0
+            for _ in range(50):
+                if b.check_and_consume('key', 'zone', limit,
+                                       '20170411')[1] is not None:
+                    allowed += 1
+            results.put(allowed)
+
+        procs = [ctx.Process(target=worker) for _ in range(4)]
+        for p in procs:
+            p.start()
+        allowed = sum(results.get(timeout=30) for _ in procs)
+        for p in procs:
+            p.join()
+
+        # the burst is shared, allowing for a token to refill during the test
+        self.assertGreaterEqual(allowed, 100)
+        self.assertLessEqual(allowed, 102)
+
+
+class CacheBackendTestCase(MemoryBackendTestCase):
+    """ do the same tests as MemoryBackendTestCase but w/ CacheBackend """
+
+    def get_backend(self):
+        # ensure we have a fresh cache backend each time
+        c = CacheBackend()
+        c.cache.clear()
+        return c
+
+    def test_check_and_consume_round_trips(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        b.get_and_inc_quota_value('key', 'zone', '20170411')
+        with mock.patch.object(b, 'cache', wraps=b.cache) as cache:
+            self.assertEquals(
+                b.check_and_consume('key', 'zone', limit, '20170411'), (1, 2)
+            )
+            self.assertEquals(cache.method_calls, [
+                mock.call.get_many(['key~zone', 'key~zone~20170411']),
+                mock.call.set_many({'key~zone': mock.ANY,
+                                    'key~zone~20170411': 2}, b.timeout),
+            ])
+
+    def test_check_and_consume_many_round_trips(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        with mock.patch.object(b, 'cache', wraps=b.cache) as cache:
+            b.check_and_consume_many([
+                ('key{}'.format(i), 'zone', limit, '20170411', 1, None)
+                for i in range(10)
+            ])
+            self.assertEquals([call[0] for call in cache.method_calls],
+                              ['get_many', 'set_many'])
+
+    def test_inc_quota_values_round_trips(self):
+        b = self.get_backend()
+        # no fallback to counts under unhashed keys
+        b.legacy_keys = False
+        b.get_and_inc_quota_value('key0', 'zone', '20170411')
+        with mock.patch.object(b, 'cache', wraps=b.cache) as cache:
+            self.assertEquals(b.inc_quota_values([
+                ('key{}'.format(i), 'zone', '20170411', 2) for i in range(3)
+            ]), [3, 2, 2])
+            # only missing counters are added
+            self.assertEquals([call[0] for call in cache.method_calls],
+                              ['get_many', 'incr', 'add', 'incr', 'add',
+                               'incr'])
+
+    def test_interleaved_flushes(self):
+        b = self.get_backend()
+        other = self.get_backend()
+        b.get_and_inc_quota_value('key', 'zone', '20170411', 1)
+        get_many = b.cache.get_many
+        flushes = [[('key', 'zone', '20170411', 5),
+                    ('key', 'zone2', '20170411', 5)]]
+
+        def flushed_elsewhere(keys):
+            # another process flushes the same counters after this one has
+            # looked them up
+            values = get_many(keys)
+            if flushes:
+                other.inc_quota_values(flushes.pop())
+            return values
+
+        with mock.patch.object(b.cache, 'get_many', flushed_elsewhere):
+            b.inc_quota_values([('key', 'zone', '20170411', 2),
+                                ('key', 'zone2', '20170411', 2)])
+        self.assertEquals(
+            b.get_and_inc_quota_value('key', 'zone', '20170411', 0), 8
+        )
+        self.assertEquals(
+            b.get_and_inc_quota_value('key', 'zone2', '20170411', 0), 7
+        )
+
+    def test_sliding_ring_timeout(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        window = QuotaWindow('m', 1000)
+        with mock.patch.object(b, 'cache', wraps=b.cache) as cache:
+            b.check_and_consume('key', 'zone', limit, window)
+            b.get_and_inc_quota_value('key', 'zone2', window)
+        # a monthly ring outlives the default timeout
+        self.assertEquals(
+            [c[1][1] for c in cache.method_calls if c[0] == 'set_many'],
+            [30 * 24 * 60 * 60] * 2
+        )
+
+
+@override_settings(SIMPLEKEYS_CACHE_FORMAT='compact',
+                   SIMPLEKEYS_CACHE_HASH_KEYS=True)
+class CompactCacheBackendTestCase(CacheBackendTestCase):
+    """ same tests, with packed values under hashed keys """
+
+    def test_check_and_consume_round_trips(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        b.get_and_inc_quota_value('key', 'zone', '20170411')
+        with mock.patch.object(b, 'cache', wraps=b.cache) as cache:
+            self.assertEquals(
+                b.check_and_consume('key', 'zone', limit, '20170411'), (1, 2)
+            )
+            bucket_key = b._key('key~zone')
+            quota_key = b._key('key~zone~20170411')
+            # unhashed keys are read too
+            self.assertEquals(cache.method_calls, [
+                mock.call.get_many([bucket_key, quota_key, 'key~zone',
+                                    'key~zone~20170411']),
+                mock.call.set_many({bucket_key: mock.ANY, quota_key: 2},
+                                   b.timeout),
+            ])
+        self.assertEquals(len(bucket_key), 16)
+        # tokens & timestamp as two doubles
+        self.assertEquals(len(b.cache.get(bucket_key)), 16)
+
+    def test_sliding_ring_packed(self):
+        b = self.get_backend()
+        b.get_and_inc_quota_value('key', 'zone', QuotaWindow('d', 1000), 3)
+        ring = b.cache.get(b._key('key~zone~wd'))
+        self.assertEquals(len(ring), 8 + 24 * 4)
+
+    def test_reads_earlier_entries(self):
+        with override_settings(SIMPLEKEYS_CACHE_FORMAT='pickle',
+                               SIMPLEKEYS_CACHE_HASH_KEYS=False):
+            old = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=5)
+        old.check_and_consume('key', 'zone', limit, '20170411', cost=2)
+        old.get_and_inc_quota_value('key', 'zone2', '20170411', 4)
+
+        b = CacheBackend()
+        tokens, quota = b.check_and_consume('key', 'zone', limit, '20170411')
+        self.assertAlmostEqual(tokens, 2, delta=0.1)
+        self.assertEquals(quota, 3)
+        self.assertEquals(
+            b.get_and_inc_quota_value('key', 'zone2', '20170411'), 5
+        )
+        # the hashed entries are read from now on
+        self.assertEquals(
+            b.check_and_consume('key', 'zone', limit, '20170411')[1], 4
+        )
+        self.assertEquals(
+            b.get_usage_chunk(['key'], ['zone', 'zone2'], ['20170411']),
+            [('key', 'zone', '20170411', 4), ('key', 'zone2', '20170411', 5)]
+        )
+
+    @override_settings(SIMPLEKEYS_CACHE_LEGACY_KEYS=False)
+    def test_without_legacy_keys(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        with mock.patch.object(b, 'cache', wraps=b.cache) as cache:
+            b.check_and_consume('key', 'zone', limit, '20170411')
+            self.assertEquals(cache.get_many.call_args, mock.call(
+                [b._key('key~zone'), b._key('key~zone~20170411')]
+            ))
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis not installed')
+class RedisBackendTestCase(CacheBackendTestCase):
+    """ same tests again, against a fake redis server """
+
+    def get_backend(self):
+        server = fakeredis.FakeServer()
+        return RedisBackend(
+            client=fakeredis.FakeRedis(server=server),
+            async_client=fakeredis.FakeAsyncRedis(server=server),
+        )
+
+    def test_check_and_consume(self):
+        # the script uses server time, which can't be frozen
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        self.assertEquals(
+            b.check_and_consume('key', 'zone', limit, '20170411')[1], 1
+        )
+        self.assertEquals(
+            b.check_and_consume('key', 'zone', limit, '20170411')[1], 2
+        )
+        tokens, quota = b.check_and_consume('key', 'zone', limit, '20170411')
+        self.assertLess(tokens, 1)
+        self.assertIsNone(quota)
+        self.assertEquals(
+            b.get_and_inc_quota_value('key', 'zone', '20170411'), 3
+        )
+
+    def test_sliding_ring_timeout(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        window = QuotaWindow('m', 1000)
+        b.check_and_consume('key', 'zone', limit, window)
+        b.get_and_inc_quota_value('key', 'zone2', window)
+        for zone in ('zone', 'zone2'):
+            self.assertEquals(b.redis.ttl(b._quota_key('key', zone, window)),
+                              30 * 24 * 60 * 60)
+
+    def test_check_and_consume_round_trips(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        # make sure script is loaded before counting
+        b.check_and_consume('key', 'zone', limit, '20170411')
+        with mock.patch.object(b.redis, 'execute_command',
+                               wraps=b.redis.execute_command) as execute:
+            b.check_and_consume('key', 'zone', limit, '20170411')
+            self.assertEquals(execute.call_count, 1)
+
+    def test_check_and_consume_many_round_trips(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        b.check_and_consume('key', 'zone', limit, '20170411')
+        with mock.patch.object(b.redis, 'execute_command',
+                               wraps=b.redis.execute_command) as execute:
+            results = b.check_and_consume_many([
+                ('key{}'.format(i), 'zone', limit, '20170411', 1, None)
+                for i in range(10)
+            ])
+            # the whole batch is sent by the pipeline, not the client
+            self.assertEquals(execute.call_count, 0)
+        self.assertEquals([quota for tokens, quota in results], [1] * 10)
+
+    # every count is its own atomic script
+    test_interleaved_flushes = None
+
+    def test_inc_quota_values_round_trips(self):
+        b = self.get_backend()
+        b.get_and_inc_quota_value('key', 'zone', QuotaWindow('d', 1000))
+        with mock.patch.object(b.redis, 'execute_command',
+                               wraps=b.redis.execute_command) as execute:
+            self.assertEquals(b.inc_quota_values([
+                ('key{}'.format(i), 'zone', '20170411', 2) for i in range(10)
+            ] + [('key', 'zone', QuotaWindow('d', 1000), 3)]), [2] * 10 + [4])
+            self.assertEquals(execute.call_count, 0)
+
+    def test_usage_chunk_per_slot(self):
+        b = self.get_backend()
+        for key in ('key1', 'key2'):
+            b.get_and_inc_quota_value(key, 'zone', '20170411')
+        pipeline = b.redis.pipeline
+        mgets = []
+
+        def spy(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            pipe.mget = mock.Mock(wraps=pipe.mget)
+            mgets.append(pipe.mget)
+            return pipe
+
+        with mock.patch.object(b.redis, 'pipeline', spy):
+            self.assertEquals(b.get_usage_chunk(
+                ['key1', 'key2'], ['zone', 'zone2'], ['20170411', '20170410']
+            ), [('key1', 'zone', '20170411', 1),
+                ('key2', 'zone', '20170411', 1)])
+        # no MGET spans keys with different hash tags, for Redis Cluster
+        (mget,) = mgets
+        self.assertEquals(
+            [{name.split('}')[0] for name in call.args[0]}
+             for call in mget.call_args_list],
+            [{b.prefix + '{key1'}, {b.prefix + '{key2'}]
+        )
+
+
+gcra = override_settings(SIMPLEKEYS_RATE_LIMIT_ALGORITHM='gcra')
+
+
+@gcra
+class MemoryBackendGCRATestCase(MemoryBackendTestCase):
+    """ gcra should give the same results as the token bucket """
+
+
+@gcra
+class CacheBackendGCRATestCase(CacheBackendTestCase):
+
+    def test_check_and_consume_round_trips(self):
+        b = self.get_backend()
+        limit = Limit(requests_per_second=1, burst_size=2)
+        with mock.patch.object(b, 'cache', wraps=b.cache) as cache:
+            b.check_and_consume('key', 'zone', limit, '20170411')
+            self.assertEquals(cache.method_calls, [
+                mock.call.get_many(['key~zone~tat', 'key~zone~20170411']),
+                mock.call.set_many({'key~zone~tat': mock.ANY,
+                                    'key~zone~20170411': 1}, b.timeout),
+            ])
+
+
+@gcra
+class RedisBackendGCRATestCase(RedisBackendTestCase):
+    pass
+
+
+class WindowResetTestCase(TestCase):
+
+    def test_window_reset(self):
+        with freeze_time('2017-04-17 10:30:00'):
+            window = QuotaWindow.current('d', 5)
+            # 2 at 19:00 yesterday, 2 at 05:00 & 1 now
+            ring, _ = window_add(None, window._replace(slot=window.slot - 15),
+                                 2)
+            ring, _ = window_add(ring, window._replace(slot=window.slot - 5),
+                                 2)
+            ring, _ = window_add(ring, window, 1)
+            # the first 2 slide out at 19:00
+            self.assertEquals(window_reset(ring, window), 8.5 * 60 * 60)
+            self.assertEquals(window_reset(ring, window, 2), 8.5 * 60 * 60)
+            # 3 more need the next 2 to slide out too
+            self.assertEquals(window_reset(ring, window, 3), 18.5 * 60 * 60)
+            # never enough room, wait for everything to slide out
+            self.assertEquals(window_reset(ring, window, 10), 23.5 * 60 * 60)
+            self.assertEquals(window_reset(None, window), 23.5 * 60 * 60)
+
+
+class AlgorithmSettingTestCase(TestCase):
+
+    @override_settings(SIMPLEKEYS_RATE_LIMIT_ALGORITHM='leaky')
+    def test_bad_algorithm(self):
+        self.assertRaises(ImproperlyConfigured, MemoryBackend)
+
+    @override_settings(SIMPLEKEYS_QUOTA_WINDOW='rolling')
+    def test_bad_quota_window(self):
+        self.assertRaises(ImproperlyConfigured, MemoryBackend)
+
+
+@gcra
+class SharedMemoryBackendGCRATestCase(SharedMemoryBackendTestCase):
+    pass
@@ -1,4 +1,8 @@
+import os
 import csv
+import gzip
+import json
+import tempfile
 from django.test import TestCase
 from django.test.utils import captured_stdout
 from django.core.management import call_command
@@ -41,3 +45,35 @@ class ExportKeysTestCase(TestCase):
             stdout.seek(0)
             data = list(csv.DictReader(stdout))
             self.assertEquals(len(data), 3)
+
+    def test_tier_not_queried_per_key(self):
+        # one query for the first batch, one to find there are no more
+        with self.assertNumQueries(2):
+            with captured_stdout():
+                call_command('exportkeys')
+
+    def test_batches(self):
+        with captured_stdout() as stdout:
+            call_command('exportkeys', '--batch-size=1')
+            stdout.seek(0)
+            data = list(csv.DictReader(stdout))
+            self.assertEquals([row['key'] for row in data],
+                              ['one', 'two', 'three', 'four'])
+
+    def test_jsonl(self):
+        with captured_stdout() as stdout:
+            call_command('exportkeys', '--format=jsonl')
+            stdout.seek(0)
+            data = [json.loads(line) for line in stdout]
+            self.assertEquals(len(data), 4)
+            self.assertEquals(data[1]['key'], 'two')
+            self.assertEquals(data[1]['tier'], 'Gold')
+
+    def test_gzip_output(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'keys.csv.gz')
+            call_command('exportkeys', '--output=' + path)
+            with gzip.open(path, 'rt', newline='') as f:
+                data = list(csv.DictReader(f))
+            self.assertEquals(len(data), 4)
+            self.assertEquals(data[3]['email'], 'four@example.com')
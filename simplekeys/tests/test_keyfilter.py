@@ -0,0 +1,187 @@
+import datetime
+from unittest import mock
+from django.test import TestCase
+from freezegun import freeze_time
+
+from ..models import Tier, Zone, Key
+from ..keyfilter import BloomFilter, KeyFilter
+from .. import verifier, keyfilter
+
+
+class BloomFilterTestCase(TestCase):
+
+    def test_no_false_negatives(self):
+        bf = BloomFilter(1000)
+        keys = ['key{}'.format(i) for i in range(1000)]
+        for key in keys:
+            bf.add(key)
+        for key in keys:
+            self.assertIn(key, bf)
+
+    def test_false_positive_rate(self):
+        bf = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bf.add('key{}'.format(i))
+        false_positives = sum('other{}'.format(i) in bf for i in range(10000))
+        # expect ~100, leave plenty of slack
+        self.assertLess(false_positives, 300)
+
+
+class KeyFilterTestCase(TestCase):
+
+    def setUp(self):
+        self.tier = Tier.objects.create(slug='bronze', name='Bronze')
+        Key.objects.create(key='active', status='a', tier=self.tier,
+                           email='active@example.com')
+        Key.objects.create(key='suspended', status='s', tier=self.tier,
+                           email='suspended@example.com')
+
+    def test_disabled(self):
+        kf = KeyFilter(enabled=False)
+        self.assertTrue(kf.might_contain('anything'))
+
+    def test_built_from_active_keys(self):
+        kf = KeyFilter(enabled=True)
+        self.assertTrue(kf.might_contain('active'))
+        self.assertFalse(kf.might_contain('suspended'))
+        self.assertFalse(kf.might_contain('garbage'))
+        self.assertFalse(kf.might_contain(None))
+
+    def test_lookup_without_queries(self):
+        kf = KeyFilter(enabled=True)
+        kf.rebuild()
+        with self.assertNumQueries(0):
+            self.assertFalse(kf.might_contain('garbage'))
+
+    def test_add(self):
+        kf = KeyFilter(enabled=True)
+        kf.rebuild()
+        self.assertFalse(kf.might_contain('new'))
+        kf.add('new')
+        self.assertTrue(kf.might_contain('new'))
+
+    def test_add_during_rebuild(self):
+        kf = KeyFilter(enabled=True)
+        kf.rebuild()
+        real_bloom = keyfilter.BloomFilter
+
+        def bloom_filter(*args):
+            # a key is saved while the new filter is being filled
+            kf.add('new')
+            return real_bloom(*args)
+
+        with mock.patch.object(keyfilter, 'BloomFilter', bloom_filter):
+            kf.rebuild()
+        self.assertTrue(kf.might_contain('new'))
+        kf.add('newer')
+        self.assertTrue(kf.might_contain('newer'))
+
+    def test_periodic_rebuild(self):
+        with freeze_time() as frozen_dt:
+            kf = KeyFilter(enabled=True, rebuild_interval=60)
+            self.assertTrue(kf.might_contain('active'))
+            Key.objects.filter(key='active').update(status='s')
+
+            # still in the filter until it is rebuilt
+            frozen_dt.tick(delta=datetime.timedelta(seconds=30))
+            self.assertTrue(kf.might_contain('active'))
+            frozen_dt.tick(delta=datetime.timedelta(seconds=31))
+            self.assertFalse(kf.might_contain('active'))
+
+    def test_activated_in_other_process(self):
+        with freeze_time() as frozen_dt:
+            kf = KeyFilter(enabled=True, check_interval=1)
+            other = KeyFilter(enabled=True, check_interval=1)
+            kf.rebuild()
+            other.rebuild()
+            Key.objects.filter(key='suspended').update(status='a')
+            other.add('suspended')
+            other.key_activated()
+            # the process that saved the key doesn't need to rebuild
+            self.assertFalse(other._needs_rebuild())
+
+            # seen once the generation is next checked
+            frozen_dt.tick(delta=datetime.timedelta(seconds=2))
+            with self.assertNumQueries(2):
+                self.assertTrue(kf.might_contain('suspended'))
+            self.assertFalse(kf.might_contain('garbage'))
+
+    def test_stale_negatives_not_trusted(self):
+        kf = KeyFilter(enabled=True, check_interval=0)
+        kf.rebuild()
+        KeyFilter(enabled=True).key_activated()
+        # another thread is rebuilding, this one uses the old filter
+        with kf._build_lock:
+            self.assertTrue(kf.might_contain('garbage'))
+        self.assertFalse(kf.might_contain('garbage'))
+
+    def test_saved_key_bumps_generation(self):
+        kf = KeyFilter(enabled=True)
+        with mock.patch.object(keyfilter, 'key_filter', kf):
+            kf.rebuild()
+            generation = kf._read_generation()
+            with self.captureOnCommitCallbacks(execute=True):
+                Key.objects.create(key='new', status='a', tier=self.tier,
+                                   email='new@example.com')
+        self.assertEquals(kf._read_generation(), generation + 1)
+        self.assertTrue(kf.might_contain('new'))
+        self.assertFalse(kf._needs_rebuild())
+
+    def test_only_activation_bumps_generation(self):
+        kf = KeyFilter(enabled=True)
+        key = Key.objects.create(key='new', status='s', tier=self.tier,
+                                 email='new@example.com')
+        with mock.patch.object(keyfilter, 'key_filter', kf):
+            generation = kf._read_generation()
+            with self.captureOnCommitCallbacks(execute=True):
+                key.status = 'a'
+                key.save()
+            self.assertEquals(kf._read_generation(), generation + 1)
+
+            # editing an active key, loaded or not, leaves filters alone
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                key.email = 'changed@example.com'
+                key.save()
+                key = Key.objects.get(key='new')
+                key.name = 'New'
+                key.save()
+            self.assertEquals(callbacks, [])
+            self.assertEquals(kf._read_generation(), generation + 1)
+
+            # renaming it is a new key for the filter
+            with self.captureOnCommitCallbacks(execute=True):
+                key.key = 'renamed'
+                key.save()
+            self.assertEquals(kf._read_generation(), generation + 2)
+
+
+class VerifierKeyFilterTestCase(TestCase):
+
+    def setUp(self):
+        verifier.backend.reset()
+        self.tier = Tier.objects.create(slug='bronze', name='Bronze')
+        zone = Zone.objects.create(slug='default', name='Default')
+        self.tier.limits.create(
+            zone=zone,
+            quota_requests=100,
+            quota_period='d',
+            requests_per_second=2,
+            burst_size=10,
+        )
+        kf = KeyFilter(enabled=True)
+        for module in (verifier, keyfilter):
+            patcher = mock.patch.object(module, 'key_filter', kf)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_unknown_key_rejected_without_query(self):
+        verifier.key_filter.rebuild()
+        with self.assertNumQueries(0):
+            self.assertRaises(verifier.VerificationError, verifier.verify,
+                              'garbage', 'default')
+
+    def test_new_key_accepted(self):
+        verifier.key_filter.rebuild()
+        Key.objects.create(key='new', status='a', tier=self.tier,
+                           email='new@example.com')
+        self.assertTrue(verifier.verify('new', 'default'))
@@ -0,0 +1,112 @@
+import datetime
+from unittest import mock
+from django.test import TestCase
+from freezegun import freeze_time
+
+from .. import verifier
+from ..leasing import LeaseTable, leases
+from ..models import Tier, Zone, Key
+from ..verifier import verify, RateLimitError, QuotaError
+
+
+class LeaseTableTestCase(TestCase):
+
+    def test_spend_without_lease(self):
+        lt = LeaseTable(timeout=1)
+        self.assertIsNone(lt.spend('key', 'zone', '20170411'))
+
+    def test_grant_and_spend(self):
+        lt = LeaseTable(timeout=1)
+        # backend had 10 tokens, quota was at 3 before the lease of 5
+        self.assertEquals(
+            lt.grant('key', 'zone', '20170411', 5, 5, 8), (9, 4)
+        )
+        self.assertEquals(lt.spend('key', 'zone', '20170411'), (3, 5))
+        self.assertEquals(lt.spend('key', 'zone', '20170411'), (2, 6))
+        self.assertEquals(lt.spend('key', 'zone', '20170411'), (1, 7))
+        self.assertEquals(lt.spend('key', 'zone', '20170411'), (0, 8))
+        self.assertIsNone(lt.spend('key', 'zone', '20170411'))
+
+    def test_expiry(self):
+        lt = LeaseTable(timeout=1)
+        with freeze_time() as frozen_dt:
+            lt.grant('key', 'zone', '20170411', 5, 5, 5)
+            frozen_dt.tick(delta=datetime.timedelta(seconds=2))
+            self.assertIsNone(lt.spend('key', 'zone', '20170411'))
+
+    def test_spend_cost(self):
+        lt = LeaseTable(timeout=1)
+        # a lease of 5, the first request costs 2
+        self.assertEquals(
+            lt.grant('key', 'zone', '20170411', 5, 5, 8, cost=2), (8, 5)
+        )
+        self.assertEquals(lt.spend('key', 'zone', '20170411', 2), (1, 7))
+        self.assertIsNone(lt.spend('key', 'zone', '20170411', 2))
+        self.assertEquals(lt.spend('key', 'zone', '20170411'), (0, 8))
+
+    def test_quota_range_change(self):
+        lt = LeaseTable(timeout=1)
+        lt.grant('key', 'zone', '20170411', 5, 5, 5)
+        self.assertIsNone(lt.spend('key', 'zone', '20170412'))
+
+
+class VerifierLeasingTestCase(TestCase):
+
+    def setUp(self):
+        verifier.backend.reset()
+        leases.clear()
+        tier = Tier.objects.create(slug='bronze', name='Bronze')
+        zone = Zone.objects.create(slug='default', name='Default')
+        self.limit = tier.limits.create(
+            zone=zone,
+            quota_requests=12,
+            quota_period='d',
+            requests_per_second=1,
+            burst_size=10,
+            lease_size=5,
+        )
+        Key.objects.create(key='bronze', status='a', tier=tier,
+                           email='bronze@example.com')
+
+    def test_backend_called_once_per_lease(self):
+        with mock.patch.object(verifier, 'backend',
+                               wraps=verifier.backend) as backend:
+            with freeze_time():
+                for _ in range(10):
+                    verify('bronze', 'default')
+                self.assertEquals(backend.check_and_consume.call_count, 2)
+
+                # bucket & leases are both exhausted
+                self.assertRaises(RateLimitError, verify, 'bronze', 'default')
+
+    def test_cost_spent_from_lease(self):
+        with mock.patch.object(verifier, 'backend',
+                               wraps=verifier.backend) as backend:
+            with freeze_time():
+                verify('bronze', 'default', cost=2)
+                verify('bronze', 'default', cost=3)
+                self.assertEquals(backend.check_and_consume.call_count, 1)
+                # costs of a whole lease or more skip leasing
+                verify('bronze', 'default', cost=5)
+                self.assertEquals(backend.check_and_consume.call_count, 2)
+                self.assertRaises(RateLimitError, verify, 'bronze', 'default')
+
+    def test_partial_lease_falls_back_to_single_token(self):
+        with freeze_time() as frozen_dt:
+            for _ in range(10):
+                verify('bronze', 'default')
+            # 2 tokens isn't enough for a lease, but enough for requests
+            frozen_dt.tick(delta=datetime.timedelta(seconds=2))
+            verify('bronze', 'default')
+            verify('bronze', 'default')
+            self.assertRaises(RateLimitError, verify, 'bronze', 'default')
+
+    def test_quota_enforced(self):
+        with freeze_time() as frozen_dt:
+            for _ in range(10):
+                verify('bronze', 'default')
+            frozen_dt.tick(delta=datetime.timedelta(seconds=5))
+            # a new lease of 5, but quota only has room for 2
+            verify('bronze', 'default')
+            verify('bronze', 'default')
+            self.assertRaises(QuotaError, verify, 'bronze', 'default')
@@ -0,0 +1,298 @@
+import datetime
+from unittest import mock
+from django.db import transaction
+from django.test import TestCase
+from freezegun import freeze_time
+
+from .. import limitcache, verifier
+from ..models import Tier, Zone, Key
+from ..limitcache import LimitCache, SharedLimitCache, limit_cache
+from ..verifier import (verify, averify, verify_many, VerificationError,
+                        backend)
+
+
+class LimitCacheTestCase(TestCase):
+
+    def test_get_and_set(self):
+        c = LimitCache(size=10, timeout=60)
+        self.assertIsNone(c.get('key', 'zone'))
+        c.set('key', 'zone', 1, 'limit')
+        self.assertEquals(c.get('key', 'zone'), 'limit')
+        self.assertIsNone(c.get('key', 'zone2'))
+        self.assertEquals(c.stats()['hits'], 1)
+        self.assertEquals(c.stats()['misses'], 2)
+
+    def test_timeout(self):
+        c = LimitCache(size=10, timeout=60)
+        with freeze_time() as frozen_dt:
+            c.set('key', 'zone', 1, 'limit')
+            frozen_dt.tick(delta=datetime.timedelta(seconds=59))
+            self.assertEquals(c.get('key', 'zone'), 'limit')
+            frozen_dt.tick(delta=datetime.timedelta(seconds=2))
+            self.assertIsNone(c.get('key', 'zone'))
+            self.assertEquals(c.stats()['size'], 0)
+
+    def test_lru_eviction(self):
+        c = LimitCache(size=2, timeout=60)
+        c.set('a', 'zone', 1, 'A')
+        c.set('b', 'zone', 2, 'B')
+        # touch a so b is least recently used
+        c.get('a', 'zone')
+        c.set('c', 'zone', 3, 'C')
+        self.assertEquals(c.get('a', 'zone'), 'A')
+        self.assertIsNone(c.get('b', 'zone'))
+        self.assertEquals(c.get('c', 'zone'), 'C')
+
+    def test_disabled(self):
+        c = LimitCache(size=0, timeout=60)
+        c.set('key', 'zone', 1, 'limit')
+        self.assertIsNone(c.get('key', 'zone'))
+
+    def test_default_size(self):
+        # off unless other processes' changes are seen through a shared cache
+        self.assertEquals(LimitCache().size, 0)
+        self.assertEquals(LimitCache(shared=SharedLimitCache()).size, 0)
+        shared = SharedLimitCache(alias='default')
+        self.assertEquals(LimitCache(shared=shared).size, 1000)
+        with self.settings(SIMPLEKEYS_LIMIT_CACHE_SIZE=10):
+            self.assertEquals(LimitCache().size, 10)
+
+    def test_evict_key(self):
+        c = LimitCache(size=10, timeout=60)
+        c.set('key', 'zone', 1, 'limit')
+        c.set('key', 'zone2', 1, 'limit')
+        c.set('other', 'zone', 2, 'limit')
+        c.evict_key(1)
+        self.assertIsNone(c.get('key', 'zone'))
+        self.assertIsNone(c.get('key', 'zone2'))
+        self.assertEquals(c.get('other', 'zone'), 'limit')
+
+
+class VerifierLimitCacheTestCase(TestCase):
+
+    def setUp(self):
+        backend.reset()
+        patcher = mock.patch.object(limit_cache, 'size', 1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tier = Tier.objects.create(slug='bronze', name='Bronze')
+        self.zone = Zone.objects.create(slug='default', name='Default')
+        self.limit = self.tier.limits.create(
+            zone=self.zone,
+            quota_requests=100,
+            quota_period='d',
+            requests_per_second=2,
+            burst_size=10,
+        )
+        self.key = Key.objects.create(
+            key='bronze',
+            status='a',
+            tier=self.tier,
+            email='bronze@example.com',
+        )
+
+    def test_cached_lookup_skips_queries(self):
+        verify('bronze', 'default')
+        with self.assertNumQueries(0):
+            verify('bronze', 'default')
+
+    def test_suspended_key_invalidated(self):
+        verify('bronze', 'default')
+        self.key.status = 's'
+        self.key.save()
+        self.assertRaises(VerificationError, verify, 'bronze', 'default')
+
+    def test_deleted_limit_invalidated(self):
+        verify('bronze', 'default')
+        self.limit.delete()
+        self.assertRaises(VerificationError, verify, 'bronze', 'default')
+
+    def test_limit_change_invalidated(self):
+        verify('bronze', 'default')
+        self.limit.burst_size = 20
+        self.limit.save()
+        self.assertIsNone(limit_cache.get('bronze', 'default'))
+
+
+class SharedLimitCacheTestCase(TestCase):
+
+    def setUp(self):
+        backend.reset()
+        self.shared = SharedLimitCache(alias='default', timeout=60)
+        self.shared.cache.clear()
+        for target in (limitcache, verifier):
+            patcher = mock.patch.object(target, 'shared_limit_cache',
+                                        self.shared)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for attr, value in (('shared', self.shared), ('size', 1000)):
+            patcher = mock.patch.object(limit_cache, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        limit_cache.clear()
+
+        self.tier = Tier.objects.create(slug='bronze', name='Bronze')
+        self.zone = Zone.objects.create(slug='default', name='Default')
+        self.limit = self.tier.limits.create(
+            zone=self.zone,
+            quota_requests=100,
+            quota_period='d',
+            requests_per_second=2,
+            burst_size=10,
+        )
+        self.key = Key.objects.create(
+            key='bronze',
+            status='a',
+            tier=self.tier,
+            email='bronze@example.com',
+        )
+
+    def test_shared_between_processes(self):
+        verify('bronze', 'default')
+        # another process starts with nothing cached locally
+        limit_cache.clear()
+        with self.assertNumQueries(0):
+            verify('bronze', 'default')
+            self.assertRaises(VerificationError, verify, 'bronze', 'premium')
+
+    def test_key_written_through(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Key.objects.create(key='bronze2', status='a', tier=self.tier,
+                               email='bronze2@example.com')
+        with self.assertNumQueries(0):
+            verify('bronze2', 'default')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.key.status = 's'
+            self.key.save()
+        self.assertIsNone(self.shared.get('bronze'))
+        self.assertRaises(VerificationError, verify, 'bronze', 'default')
+
+    def test_fill_before_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.key.status = 's'
+            self.key.save()
+            # before the suspension commits another process misses, reads
+            # the still active row & fills
+            versions = self.shared.lookup('bronze')[1]
+            stale = limitcache.make_record(
+                self.key.pk, limitcache.tier_limits(self.tier.pk)
+            )
+            self.shared.fill('bronze', stale, versions)
+            self.assertEquals(self.shared.get('bronze'), stale)
+        self.assertIsNone(self.shared.get('bronze'))
+        limit_cache.clear()
+        self.assertRaises(VerificationError, verify, 'bronze', 'default')
+
+    def test_rollback_leaves_record(self):
+        verify('bronze', 'default')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.key.status = 's'
+                    self.key.save()
+                    self.limit.burst_size = 20
+                    self.limit.save()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEquals(callbacks, [])
+        self.assertEquals(self.shared.get('bronze')[1]['default'].burst_size,
+                          10)
+
+    def test_limit_change_invalidates_records(self):
+        verify('bronze', 'default')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.limit.burst_size = 20
+            self.limit.save()
+        self.assertIsNone(self.shared.get('bronze'))
+        self.assertEquals(verify('bronze', 'default').limit.burst_size, 20)
+
+    def test_fill_racing_key_change(self):
+        self.shared.cache.clear()
+        # a process misses & reads the key from the database...
+        record, versions = self.shared.lookup('bronze')
+        self.assertIsNone(record)
+        stale = limitcache.make_record(
+            self.key.pk, limitcache.tier_limits(self.tier.pk)
+        )
+        # ...the key is suspended elsewhere before its record is filled
+        with self.captureOnCommitCallbacks(execute=True):
+            self.key.status = 's'
+            self.key.save()
+        self.shared.fill('bronze', stale, versions)
+        self.assertIsNone(self.shared.get('bronze'))
+        self.assertRaises(VerificationError, verify, 'bronze', 'default')
+
+    def test_fill_racing_limit_change(self):
+        versions = self.shared.lookup('bronze')[1]
+        stale = limitcache.make_record(
+            self.key.pk, limitcache.tier_limits(self.tier.pk)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.limit.burst_size = 20
+            self.limit.save()
+        self.shared.fill('bronze', stale, versions)
+        self.assertIsNone(self.shared.get('bronze'))
+        self.assertEquals(verify('bronze', 'default').limit.burst_size, 20)
+
+    def test_unknown_key_writes_nothing(self):
+        self.shared.cache.clear()
+        self.assertRaises(VerificationError, verify, 'nokey', 'default')
+        self.assertEquals(self.shared.cache.get_many([
+            self.shared._record_key('nokey'),
+            self.shared._version_key('nokey'),
+        ]), {})
+
+    def test_fill_racing_first_version(self):
+        self.shared.cache.clear()
+        record, versions = self.shared.lookup('bronze')
+        self.assertEquals(versions, (None, None))
+        stale = limitcache.make_record(
+            self.key.pk, limitcache.tier_limits(self.tier.pk)
+        )
+        # the key is deleted elsewhere, starting its version first
+        self.shared.key_changed(self.key, deleted=True)
+        self.shared.fill('bronze', stale, versions)
+        self.assertIsNone(self.shared.get('bronze'))
+
+        # without a change in between the first fill starts the versions
+        self.shared.cache.clear()
+        self.shared.fill('bronze', stale, (None, None))
+        self.assertEquals(self.shared.get('bronze'), stale)
+
+    async def test_afill_racing_key_change(self):
+        versions = (await self.shared.alookup('bronze'))[1]
+        self.shared.key_changed(self.key, deleted=True)
+        await self.shared.afill('bronze', 'stale', versions)
+        self.assertIsNone(await self.shared.aget('bronze'))
+
+    def test_generation_clears_other_processes(self):
+        other = LimitCache(size=10, timeout=60, shared=self.shared,
+                           check_interval=1)
+        with freeze_time() as frozen_dt:
+            other.get('bronze', 'default')
+            other.set('bronze', 'default', self.key.pk, self.limit)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.tier.save()
+            # the generation is only checked once a second
+            self.assertEquals(other.get('bronze', 'default'), self.limit)
+            frozen_dt.tick(delta=datetime.timedelta(seconds=2))
+            self.assertIsNone(other.get('bronze', 'default'))
+
+    def test_verify_many(self):
+        verify('bronze', 'default')
+        limit_cache.clear()
+        with self.assertNumQueries(0):
+            results = verify_many([('bronze', 'default'),
+                                   ('bronze', 'premium')])
+        self.assertTrue(results[0].ok)
+        self.assertEquals(str(results[1].error),
+                          'key does not have access to zone premium')
+
+    async def test_averify(self):
+        await averify('bronze', 'default')
+        self.assertIsNotNone(await self.shared.aget('bronze'))
+        limit_cache.clear()
+        result = await averify('bronze', 'default')
+        self.assertEquals(result.limit.burst_size, 10)
@@ -0,0 +1,129 @@
+import threading
+from unittest import mock
+from django.test import TestCase
+
+from .. import verifier
+from ..limitcache import limit_cache
+from ..metrics import Metrics, BUCKETS, verification_finished
+from ..models import Tier, Zone, Key
+from ..verifier import verify, averify, VerificationError, RateLimitError
+
+
+class MetricsTestCase(TestCase):
+
+    def test_record_and_snapshot(self):
+        m = Metrics(enabled=True)
+        m.record('default', 'bronze', 'ok', {'consume': 0.00002})
+        m.record('default', 'bronze', 'ok', {'consume': 2})
+        m.record('default', '', 'invalid', {})
+        outcomes, latency = m.snapshot()
+        self.assertEquals(outcomes, {('default', 'bronze', 'ok'): 2,
+                                     ('default', '', 'invalid'): 1})
+        cumulative, seconds = latency['consume']
+        self.assertEquals(len(cumulative), len(BUCKETS) + 1)
+        # 20us is in the 25us bucket, 2s only in +Inf
+        self.assertEquals(cumulative[0], 0)
+        self.assertEquals(cumulative[1], 1)
+        self.assertEquals(cumulative[-2], 1)
+        self.assertEquals(cumulative[-1], 2)
+        self.assertAlmostEqual(seconds, 2.00002)
+
+    def test_threads_summed(self):
+        m = Metrics(enabled=True)
+
+        def worker():
+            for _ in range(100):
+                m.record('default', 'bronze', 'ok', {'total': 0.001})
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        outcomes, latency = m.snapshot()
+        self.assertEquals(outcomes[('default', 'bronze', 'ok')], 400)
+        self.assertEquals(latency['total'][0][-1], 400)
+
+    def test_prometheus(self):
+        m = Metrics(enabled=True)
+        m.record('default', 'bronze', 'rate', {'consume': 0.001})
+        text = m.prometheus()
+        self.assertIn('simplekeys_verifications_total{zone="default",'
+                      'tier="bronze",outcome="rate"} 1\n', text)
+        self.assertIn('simplekeys_verify_stage_seconds_bucket{stage="consume",'
+                      'le="0.001"} 1\n', text)
+        self.assertIn('simplekeys_verify_stage_seconds_bucket{stage="consume",'
+                      'le="0.0005"} 0\n', text)
+        self.assertIn('simplekeys_verify_stage_seconds_count{stage="consume"} 1\n',
+                      text)
+
+    def test_signal(self):
+        m = Metrics(enabled=True)
+        receiver = mock.Mock()
+        verification_finished.connect(receiver)
+        self.addCleanup(verification_finished.disconnect, receiver)
+        m.record('default', 'bronze', 'ok', {'total': 0.001})
+        receiver.assert_called_once_with(
+            signal=verification_finished, sender=Metrics, zone='default',
+            tier='bronze', outcome='ok', timings={'total': 0.001}
+        )
+
+
+class VerifierMetricsTestCase(TestCase):
+
+    def setUp(self):
+        verifier.backend.reset()
+        limit_cache.clear()
+        patcher = mock.patch.object(limit_cache, 'size', 1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tier = Tier.objects.create(slug='bronze', name='Bronze')
+        zone = Zone.objects.create(slug='default', name='Default')
+        tier.limits.create(
+            zone=zone,
+            quota_requests=100,
+            quota_period='d',
+            requests_per_second=1,
+            burst_size=1,
+        )
+        Key.objects.create(key='bronze', status='a', tier=tier,
+                           email='bronze@example.com')
+        self.metrics = Metrics(enabled=True)
+        patcher = mock.patch.object(verifier, 'metrics', self.metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_outcomes_and_stages(self):
+        verify('bronze', 'default')
+        self.assertRaises(RateLimitError, verify, 'bronze', 'default')
+        self.assertRaises(VerificationError, verify, 'bad', 'default')
+        outcomes, latency = self.metrics.snapshot()
+        self.assertEquals(outcomes, {
+            ('default', 'bronze', 'ok'): 1,
+            ('default', 'bronze', 'rate'): 1,
+            ('default', '', 'invalid'): 1,
+        })
+        # database lookups only happened for the first request
+        self.assertEquals(latency['key_lookup'][0][-1], 1)
+        self.assertEquals(latency['limit_lookup'][0][-1], 1)
+        self.assertEquals(latency['consume'][0][-1], 2)
+        self.assertEquals(latency['total'][0][-1], 3)
+
+    def test_tier_without_extra_query(self):
+        verify('bronze', 'default')
+        with self.assertNumQueries(0):
+            self.assertRaises(RateLimitError, verify, 'bronze', 'default')
+
+    async def test_averify(self):
+        await averify('bronze', 'default')
+        outcomes, latency = self.metrics.snapshot()
+        self.assertEquals(outcomes, {('default', 'bronze', 'ok'): 1})
+        self.assertIn('consume', latency)
+
+    def test_view(self):
+        verify('bronze', 'default')
+        with mock.patch('simplekeys.views.metrics', self.metrics):
+            response = self.client.get('/metrics/')
+        self.assertEquals(response.status_code, 200)
+        self.assertIn(b'simplekeys_verifications_total{zone="default",'
+                      b'tier="bronze",outcome="ok"} 1', response.content)
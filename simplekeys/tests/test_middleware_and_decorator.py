@@ -1,4 +1,5 @@
-from django.test import TestCase
+from unittest import mock
+from django.test import TestCase, override_settings
 from ..models import Tier, Zone, Key
 from ..verifier import backend
 
@@ -68,6 +69,55 @@ class ViewTestCase(TestCase):
 
         # ... we won't test everything else, verifier tests take care of that
 
+    def test_view_cost(self):
+        # burst of 10 allows two requests costing 5
+        for x in range(2):
+            response = self.client.get('/expensive/?apikey=bronze')
+            self.assertEquals(response.status_code, 200)
+        response = self.client.get('/expensive/?apikey=bronze')
+        self.assertEquals(response.status_code, 429)
+
+    @override_settings(SIMPLEKEYS_ZONE_PATHS=[('/via.*/', 'default', 5)])
+    def test_middleware_cost(self):
+        for x in range(2):
+            response = self.client.get('/via_middleware/?apikey=bronze')
+            self.assertEquals(response.status_code, 200)
+        response = self.client.get('/via_middleware/?apikey=bronze')
+        self.assertEquals(response.status_code, 429)
+
+    def test_rate_limit_headers(self):
+        response = self.client.get('/example/?apikey=bronze')
+        self.assertEquals(response['X-RateLimit-Limit'], '10')
+        self.assertEquals(response['X-RateLimit-Remaining'], '9')
+        self.assertIn('X-RateLimit-Reset', response)
+        self.assertNotIn('Retry-After', response)
+
+        for x in range(9):
+            response = self.client.get('/example/?apikey=bronze')
+        self.assertEquals(response['X-RateLimit-Remaining'], '0')
+        response = self.client.get('/example/?apikey=bronze')
+        self.assertEquals(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # no limit to describe for an invalid key
+        response = self.client.get('/example/')
+        self.assertNotIn('X-RateLimit-Limit', response)
+
+    def test_rate_limit_headers_via_middleware(self):
+        response = self.client.get('/via_middleware/?apikey=bronze')
+        self.assertEquals(response['X-RateLimit-Remaining'], '9')
+
+    async def test_async_rate_limit_headers(self):
+        response = await self.async_client.get('/async/?apikey=bronze')
+        self.assertEquals(response['X-RateLimit-Remaining'], '9')
+        response = await self.async_client.get('/via_middleware/?apikey=bronze')
+        self.assertEquals(response['X-RateLimit-Remaining'], '8')
+
+    @override_settings(SIMPLEKEYS_RATE_LIMIT_HEADERS=False)
+    def test_rate_limit_headers_disabled(self):
+        response = self.client.get('/example/?apikey=bronze')
+        self.assertNotIn('X-RateLimit-Limit', response)
+
     def test_view_protected_via_middleware(self):
         # make sure middleware doesn't wind up protecting everything
         response = self.client.get('/via_middleware/')
@@ -81,3 +131,28 @@ class ViewTestCase(TestCase):
         # make sure middleware doesn't wind up protecting everything
         response = self.client.get('/unprotected/')
         self.assertEquals(response.status_code, 200)
+
+    @mock.patch('simplekeys.decorators.verify_request',
+                side_effect=AssertionError('sync path used'))
+    async def test_async_view_key_param(self, verify_request):
+        response = await self.async_client.get('/async/?apikey=bronze')
+        self.assertEquals(response.status_code, 200)
+        response = await self.async_client.get('/async/?apikey=gold')
+        self.assertEquals(response.status_code, 403)
+
+    async def test_async_view_key_429(self):
+        for x in range(10):
+            response = await self.async_client.get('/async/?apikey=bronze')
+            self.assertEquals(response.status_code, 200)
+        response = await self.async_client.get('/async/?apikey=bronze')
+        self.assertEquals(response.status_code, 429)
+
+    @mock.patch('simplekeys.middleware.verify_request',
+                side_effect=AssertionError('sync path used'))
+    async def test_async_protected_via_middleware(self, verify_request):
+        response = await self.async_client.get('/via_middleware/')
+        self.assertEquals(response.status_code, 403)
+        response = await self.async_client.get('/via_middleware/?apikey=bronze')
+        self.assertEquals(response.status_code, 200)
+        response = await self.async_client.get('/unprotected/')
+        self.assertEquals(response.status_code, 200)
@@ -0,0 +1,158 @@
+import datetime
+from unittest import mock
+from django.test import TestCase
+from freezegun import freeze_time
+
+from .. import verifier
+from ..backends import MemoryBackend, QuotaWindow
+from ..models import Tier, Zone, Key
+from ..quotabuffer import QuotaBuffer
+from ..verifier import verify, averify, QuotaError
+
+
+class QuotaBufferTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+
+    def test_first_count_written_through(self):
+        self.backend.get_and_inc_quota_value('key', 'zone', '20170411', 5)
+        qb = QuotaBuffer(enabled=True, flush_requests=100)
+        self.assertEquals(qb.add(self.backend, 'key', 'zone', '20170411'), 6)
+        self.assertEquals(qb.pending(), 0)
+
+    def test_counts_buffered(self):
+        qb = QuotaBuffer(enabled=True, flush_requests=100)
+        for i in range(1, 11):
+            self.assertEquals(
+                qb.add(self.backend, 'key', 'zone', '20170411'), i
+            )
+        self.assertEquals(qb.pending(), 9)
+        self.assertEquals(
+            self.backend.get_and_inc_quota_value('key', 'zone', '20170411',
+                                                 0), 1
+        )
+
+    def test_flush_after_requests(self):
+        qb = QuotaBuffer(enabled=True, flush_requests=5)
+        for _ in range(6):
+            qb.add(self.backend, 'key', 'zone', '20170411')
+        self.assertEquals(qb.pending(), 0)
+        self.assertEquals(
+            self.backend.get_and_inc_quota_value('key', 'zone', '20170411',
+                                                 0), 6
+        )
+
+    def test_flush_after_interval(self):
+        with freeze_time() as frozen_dt:
+            qb = QuotaBuffer(enabled=True, flush_interval=10,
+                             flush_requests=100)
+            qb.add(self.backend, 'key', 'zone', '20170411')
+            qb.add(self.backend, 'key', 'zone', '20170411')
+            self.assertEquals(qb.pending(), 1)
+            frozen_dt.tick(delta=datetime.timedelta(seconds=11))
+            qb.add(self.backend, 'key', 'zone', '20170411')
+            self.assertEquals(qb.pending(), 0)
+
+    def test_flush_sees_other_processes(self):
+        qb = QuotaBuffer(enabled=True, flush_requests=100)
+        qb.add(self.backend, 'key', 'zone', '20170411')
+        qb.add(self.backend, 'key', 'zone', '20170411')
+        # another process flushes its counts
+        self.backend.get_and_inc_quota_value('key', 'zone', '20170411', 10)
+        qb.flush(self.backend)
+        self.assertEquals(qb.add(self.backend, 'key', 'zone', '20170411'),
+                          13)
+
+    def test_flush_batched(self):
+        qb = QuotaBuffer(enabled=True, flush_requests=100)
+        for zone in ('zone', 'zone2'):
+            for _ in range(3):
+                qb.add(self.backend, 'key', zone, '20170411')
+        with mock.patch.object(self.backend, 'inc_quota_values',
+                               wraps=self.backend.inc_quota_values) as inc:
+            qb.flush(self.backend)
+        inc.assert_called_once_with([('key', 'zone', '20170411', 2),
+                                     ('key', 'zone2', '20170411', 2)])
+        self.assertEquals(qb.pending(), 0)
+
+    def test_requests_dont_wait_for_flush(self):
+        qb = QuotaBuffer(enabled=True, flush_requests=1)
+        qb.add(self.backend, 'key', 'zone', '20170411')
+        # another thread is flushing, the count waits for the next flush
+        with qb._flush_lock:
+            self.assertEquals(qb.add(self.backend, 'key', 'zone',
+                                     '20170411'), 2)
+        self.assertEquals(qb.pending(), 1)
+
+    def test_failed_flush_retried(self):
+        qb = QuotaBuffer(enabled=True, flush_requests=100)
+        qb.add(self.backend, 'key', 'zone', '20170411')
+        qb.add(self.backend, 'key', 'zone', '20170411')
+        with mock.patch.object(self.backend, 'get_and_inc_quota_value',
+                               side_effect=IOError):
+            self.assertRaises(IOError, qb.flush, self.backend)
+        self.assertEquals(qb.pending(), 1)
+        qb.flush(self.backend)
+        self.assertEquals(qb.pending(), 0)
+        self.assertEquals(
+            self.backend.get_and_inc_quota_value('key', 'zone', '20170411',
+                                                 0), 2
+        )
+
+    def test_idle_entries_dropped(self):
+        qb = QuotaBuffer(enabled=True, flush_requests=100)
+        qb.add(self.backend, 'key', 'zone', '20170411')
+        qb.flush(self.backend)
+        self.assertEquals(len(qb._counts), 1)
+        qb.flush(self.backend)
+        self.assertEquals(len(qb._counts), 0)
+
+    def test_sliding_limit(self):
+        qb = QuotaBuffer(enabled=True, flush_requests=100)
+        window = QuotaWindow('d', 1000, 2)
+        for value in (1, 2, 3, 3):
+            self.assertEquals(qb.add(self.backend, 'key', 'zone', window),
+                              value)
+        # rejected requests aren't counted, the allowed one is flushed
+        self.assertEquals(qb.pending(), 1)
+        qb.flush(self.backend)
+        self.assertEquals(
+            self.backend.get_and_inc_quota_value('key', 'zone', window, 0), 2
+        )
+
+
+class VerifierQuotaBufferTestCase(TestCase):
+
+    def setUp(self):
+        verifier.backend.reset()
+        tier = Tier.objects.create(slug='bronze', name='Bronze')
+        zone = Zone.objects.create(slug='default', name='Default')
+        tier.limits.create(
+            zone=zone,
+            quota_requests=10,
+            quota_period='d',
+            requests_per_second=100,
+            burst_size=100,
+        )
+        Key.objects.create(key='bronze', status='a', tier=tier,
+                           email='bronze@example.com')
+        self.qb = QuotaBuffer(enabled=True, flush_requests=100)
+        patcher = mock.patch.object(verifier, 'quota_buffer', self.qb)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_quota_enforced_from_estimate(self):
+        with mock.patch.object(verifier, 'backend',
+                               wraps=verifier.backend) as backend:
+            for _ in range(10):
+                verify('bronze', 'default')
+            self.assertRaises(QuotaError, verify, 'bronze', 'default')
+            # only the first request's quota was written
+            self.assertEquals(backend.get_and_inc_quota_value.call_count, 1)
+
+    async def test_averify(self):
+        for _ in range(10):
+            await averify('bronze', 'default')
+        with self.assertRaises(QuotaError):
+            await averify('bronze', 'default')
@@ -0,0 +1,113 @@
+import os
+import datetime
+import tempfile
+import unittest
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import captured_stdout
+
+from .. import clock
+from ..backends import MemoryBackend, CacheBackend, RedisBackend
+from ..limitcache import limit_cache
+from ..models import Tier, Zone, Key, Limit
+from ..replay import replay
+
+try:
+    import fakeredis
+except ImportError:     # pragma: no cover
+    fakeredis = None
+
+# 2017-04-17 23:59:00 UTC
+START = 1492473540.0
+
+
+class ClockTestCase(TestCase):
+
+    def test_use_clock(self):
+        virtual = clock.VirtualClock(START)
+        with clock.use_clock(virtual):
+            self.assertEquals(clock.time(), START)
+            virtual.advance(60)
+            self.assertEquals(clock.utcnow(),
+                              datetime.datetime(2017, 4, 18))
+            self.assertIs(clock.virtual, virtual)
+        self.assertIsNone(clock.virtual)
+        self.assertGreater(clock.time(), START)
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis not installed')
+    def test_redis_reads_virtual_clock(self):
+        b = RedisBackend(client=fakeredis.FakeRedis())
+        limit = Limit(requests_per_second=1, burst_size=2)
+        virtual = clock.VirtualClock(START)
+        with clock.use_clock(virtual):
+            b.check_and_consume('key', 'zone', limit, '20170417', cost=2)
+            virtual.advance(0.5)
+            tokens, quota = b.check_and_consume('key', 'zone', limit,
+                                                '20170417')
+            self.assertEquals((tokens, quota), (0.5, None))
+
+
+class ReplayTestCase(TestCase):
+
+    def setUp(self):
+        limit_cache.clear()
+        tier = Tier.objects.create(slug='bronze', name='Bronze')
+        zone = Zone.objects.create(slug='default', name='Default')
+        tier.limits.create(
+            zone=zone,
+            quota_requests=5,
+            quota_period='d',
+            requests_per_second=1,
+            burst_size=2,
+        )
+        Key.objects.create(key='bronze', status='a', tier=tier,
+                           email='bronze@example.com')
+        # a burst of 3, then one every 10 seconds across midnight
+        self.trace = [(START, 'bronze', 'default', 1)] * 3 + [
+            (START + 10 * i, 'bronze', 'default', 1) for i in range(1, 8)
+        ] + [(START + 80, 'nokey', 'default', 1)]
+
+    def test_replay(self):
+        report = replay(self.trace, MemoryBackend())
+        self.assertEquals(report.requests, 11)
+        # the quota resets at midnight on the virtual clock
+        self.assertEquals(dict(report.outcomes),
+                          {'ok': 7, 'rate': 1, 'quota': 2, 'invalid': 1})
+        self.assertEquals(report.reference, report.outcomes)
+        self.assertEquals(report.diverged, 0)
+        self.assertEquals(report.trace_seconds, 80)
+        self.assertIsNone(clock.virtual)
+
+    def test_limits_resolved_once(self):
+        # the key & limit queries for bronze, and one for nokey
+        with self.assertNumQueries(3):
+            replay(self.trace, MemoryBackend())
+        # the replay's limit cache doesn't outlive it
+        self.assertIsNone(limit_cache.get('bronze', 'default'))
+
+    def test_replay_cache_backend(self):
+        b = CacheBackend()
+        b.cache.clear()
+        report = replay(self.trace, b)
+        self.assertEquals(report.diverged, 0)
+
+    def test_command(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'trace.csv')
+        with open(path, 'w') as f:
+            f.write('timestamp,key,zone,cost\n')
+            f.write('2017-04-17T23:59:00,bronze,default,2\n')
+            f.write('{},bronze,default\n'.format(START + 0.5))
+            f.write('{},bronze,default\n'.format(START + 1))
+
+        with captured_stdout() as stdout:
+            call_command('replaytrace', path,
+                         backend='simplekeys.backends.MemoryBackend',
+                         stdout=stdout)
+        output = stdout.getvalue()
+        self.assertIn('replayed 3 requests against '
+                      'simplekeys.backends.MemoryBackend', output)
+        self.assertIn('ok                   2           2', output)
+        self.assertIn('rate                 1           1', output)
+        self.assertIn('diverged: 0 (0.000%)', output)
@@ -1,16 +1,22 @@
 import csv
+import datetime
+from unittest import mock
+from django.core.cache import caches
 from django.test import TestCase, override_settings
 from django.test.utils import captured_stdout
 from django.core.management import call_command
 from freezegun import freeze_time
-from ..models import Tier, Key, Zone
+from .. import usage as usage_module
+from ..models import Tier, Key, Zone, Usage
 from ..backends import CacheBackend
+from ..usage import flush_usage, get_usage
 
 
 class UsageReportTestCase(TestCase):
 
     def setUp(self):
         b = CacheBackend()
+        b.cache.clear()
         Zone.objects.create(slug='default', name='Default')
         Zone.objects.create(slug='special', name='Special')
         tier = Tier.objects.create(slug='default')
@@ -45,3 +51,139 @@ class UsageReportTestCase(TestCase):
                 data = tuple(tuple(row) for row in csv.reader(stdout))[1:]
                 self.assertEquals(len(data), 7)
                 self.assertEquals(set(data), set(self.usage))
+
+    @override_settings(SIMPLEKEYS_RATE_LIMIT_BACKEND='simplekeys.backends.CacheBackend')
+    def test_filtered_report(self):
+        with freeze_time('2017-05-05'):
+            with captured_stdout() as stdout:
+                call_command('usagereport', '--zone', 'special', '--key', 'key1',
+                             '--chunk-size', '1')
+
+                stdout.seek(0)
+
+                data = tuple(tuple(row) for row in csv.reader(stdout))[1:]
+                self.assertEquals(data, (('key1', 'special', '20170502', '5'),))
+
+    def test_db_report(self):
+        with freeze_time('2017-05-05'):
+            flush_usage(CacheBackend(), days=7)
+            # usage survives the cache being cleared
+            caches['default'].clear()
+            with captured_stdout() as stdout:
+                call_command('usagereport', '--source', 'db')
+
+                stdout.seek(0)
+
+                data = tuple(tuple(row) for row in csv.reader(stdout))[1:]
+                self.assertEquals(len(data), 7)
+                self.assertEquals(set(data), set(self.usage))
+
+
+class FlushUsageTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = CacheBackend()
+        self.backend.cache.clear()
+        Zone.objects.create(slug='default', name='Default')
+        tier = Tier.objects.create(slug='default')
+        Key.objects.create(key='key1', tier=tier, email='key1@example.com')
+
+    def test_flush(self):
+        with freeze_time('2017-05-02'):
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170501', 3)
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170502', 5)
+            self.assertEquals(flush_usage(self.backend), 2)
+            self.assertEquals(
+                Usage.objects.get(date=datetime.date(2017, 5, 2)).requests, 5
+            )
+
+            # only changed rows are written
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170502', 1)
+            self.assertEquals(flush_usage(self.backend), 1)
+            self.assertEquals(
+                Usage.objects.get(date=datetime.date(2017, 5, 2)).requests, 6
+            )
+
+    def test_lost_counters_dont_lower_usage(self):
+        with freeze_time('2017-05-02'):
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170502', 5)
+            flush_usage(self.backend)
+            self.backend.cache.clear()
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170502', 1)
+            self.assertEquals(flush_usage(self.backend), 0)
+            self.assertEquals(Usage.objects.get().requests, 5)
+
+    def test_concurrent_flush(self):
+        bulk_create = Usage.objects.bulk_create
+
+        def flushed_elsewhere(rows, **kwargs):
+            # another flusher creates the rows first, one behind our count
+            # and one ahead of it
+            Usage.objects.create(key='key1', zone='default',
+                                 date=datetime.date(2017, 5, 1), requests=2)
+            Usage.objects.create(key='key1', zone='default',
+                                 date=datetime.date(2017, 5, 2), requests=9)
+            return bulk_create(rows, **kwargs)
+
+        with freeze_time('2017-05-02'):
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170501', 3)
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170502', 5)
+            with mock.patch.object(Usage.objects, 'bulk_create',
+                                   flushed_elsewhere):
+                self.assertEquals(flush_usage(self.backend), 1)
+        self.assertEquals(
+            dict(Usage.objects.values_list('date', 'requests')),
+            {datetime.date(2017, 5, 1): 3, datetime.date(2017, 5, 2): 9}
+        )
+
+    def test_update_doesnt_lower_concurrent_count(self):
+        with freeze_time('2017-05-02'):
+            row = Usage.objects.create(key='key1', zone='default',
+                                       date=datetime.date(2017, 5, 2),
+                                       requests=1)
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170502', 5)
+            raise_requests = usage_module._raise_requests
+
+            def raised_elsewhere(rows):
+                Usage.objects.filter(pk=row.pk).update(requests=8)
+                raise_requests(rows)
+
+            with mock.patch.object(usage_module, '_raise_requests',
+                                   raised_elsewhere):
+                flush_usage(self.backend)
+        row.refresh_from_db()
+        self.assertEquals(row.requests, 8)
+
+    def test_get_usage(self):
+        Usage.objects.create(key='key1', zone='default',
+                             date=datetime.date(2017, 5, 1), requests=20)
+        Usage.objects.create(key='key1', zone='default',
+                             date=datetime.date(2017, 4, 1), requests=10)
+        with freeze_time('2017-05-02'):
+            usage = get_usage(days=2)
+        self.assertEquals(usage, {
+            'key1': {'20170502': {}, '20170501': {'default': 20}},
+        })
+
+    def test_get_usage_keys(self):
+        Usage.objects.create(key='key1', zone='default',
+                             date=datetime.date(2017, 5, 1), requests=20)
+        Usage.objects.create(key='key2', zone='default',
+                             date=datetime.date(2017, 5, 1), requests=30)
+        with freeze_time('2017-05-02'), mock.patch.object(
+                usage_module, 'iter_usage', wraps=usage_module.iter_usage
+        ) as iter_usage:
+            usage = get_usage(keys=['key1'], days=2)
+        # only the requested keys' rows are read
+        iter_usage.assert_called_once_with(keys=['key1'], days=2)
+        self.assertEquals(usage, {
+            'key1': {'20170502': {}, '20170501': {'default': 20}},
+        })
+
+    @override_settings(SIMPLEKEYS_RATE_LIMIT_BACKEND='simplekeys.backends.CacheBackend')
+    def test_command(self):
+        with freeze_time('2017-05-02'):
+            self.backend.get_and_inc_quota_value('key1', 'default', '20170502', 5)
+            with captured_stdout() as stdout:
+                call_command('flushusage', stdout=stdout)
+        self.assertEquals(Usage.objects.get().requests, 5)
@@ -1,10 +1,14 @@
 import datetime
-from django.test import TestCase
+from unittest import mock
+from django.test import TestCase, override_settings
 from freezegun import freeze_time
 
+from .. import verifier
+from ..backends import MemoryBackend, CacheBackend
 from ..models import Tier, Zone, Key
-from ..verifier import (verify, VerificationError, RateLimitError, QuotaError,
-                        backend)
+from ..limitcache import limit_cache
+from ..verifier import (verify, averify, verify_many, VerificationError,
+                        RateLimitError, QuotaError, backend)
 
 
 class UsageTestCase(TestCase):
@@ -193,6 +197,181 @@ class UsageTestCase(TestCase):
             for x in range(10):
                 verify('gold', 'secret')
 
+    def test_verifier_cost(self):
+        with freeze_time() as frozen_dt:
+            # burst of 10 covers two requests costing 4, not a third
+            verify('bronze1', 'default', cost=4)
+            verify('bronze1', 'default', cost=4)
+            self.assertRaises(RateLimitError, verify, 'bronze1', 'default',
+                              cost=4)
+            # a failed request doesn't take any tokens
+            verify('bronze1', 'default', cost=2)
+            self.assertRaises(RateLimitError, verify, 'bronze1', 'default')
+
+            # 1 second refills 2 tokens
+            frozen_dt.tick()
+            self.assertRaises(RateLimitError, verify, 'bronze1', 'default',
+                              cost=3)
+            verify('bronze1', 'default', cost=2)
+
+    def test_verifier_cost_quota(self):
+        with freeze_time('2017-04-17') as frozen_dt:
+            # gold can make 10 requests to secret a month
+            verify('gold', 'secret', cost=6)
+            frozen_dt.tick(delta=datetime.timedelta(seconds=2))
+            self.assertRaises(QuotaError, verify, 'gold', 'secret', cost=5)
+
+    async def test_averify_cost(self):
+        with freeze_time():
+            await averify('bronze1', 'default', cost=10)
+            with self.assertRaises(RateLimitError):
+                await averify('bronze1', 'default')
+
+    def test_invalid_cost(self):
+        with freeze_time():
+            verify('bronze1', 'default', cost=10)
+            for cost in (0, -5, 1.5):
+                self.assertRaises(ValueError, verify, 'bronze1', 'default',
+                                  cost=cost)
+            # nothing was given back, or taken by the rest of the batch
+            self.assertRaises(ValueError, verify_many,
+                              [('bronze1', 'default'),
+                               ('bronze1', 'default', -5)])
+            self.assertRaises(RateLimitError, verify, 'bronze1', 'default')
+
+    async def test_averify_invalid_cost(self):
+        with self.assertRaises(ValueError):
+            await averify('bronze1', 'default', cost=0)
+
+    @mock.patch.object(limit_cache, 'size', 1000)
+    def test_verify_many(self):
+        limit_cache.clear()
+        with freeze_time('2017-04-17 11:59:58') as frozen_dt:
+            verify('gold', 'secret', cost=9)
+            frozen_dt.tick(delta=datetime.timedelta(seconds=2))
+            with self.assertNumQueries(2):
+                results = verify_many([
+                    ('bronze1', 'default', 4),
+                    ('bronze1', 'default', 4),
+                    ('bronze1', 'default', 4),
+                    ('bronze2', 'premium'),
+                    ('gold', 'secret', 2),
+                    ('bronze1', 'secret'),
+                    ('badkey', 'default'),
+                ])
+
+            # resolved limits were cached
+            with self.assertNumQueries(0):
+                verify_many([('bronze1', 'default'), ('gold', 'secret')])
+
+        self.assertEquals([r.ok for r in results],
+                          [True, True, False, True, False, False, False])
+        self.assertEquals([r.cost for r in results], [4, 4, 4, 1, 2, 1, 1])
+        # 2 tokens left, 2 more come in a second at 2/sec
+        self.assertIsInstance(results[2].error, RateLimitError)
+        self.assertEquals(results[2].retry_after, 1)
+        # monthly quota resets in 13 days & 12 hours
+        self.assertIsInstance(results[4].error, QuotaError)
+        self.assertEquals(results[4].retry_after, 13.5 * 24 * 60 * 60)
+        self.assertEquals(str(results[5].error),
+                          'key does not have access to zone secret')
+        self.assertIsNone(results[5].retry_after)
+        self.assertEquals(str(results[6].error), 'no valid key')
+
+    def test_verify_result(self):
+        with freeze_time('2017-04-17 12:00:00'):
+            result = verify('bronze1', 'premium')
+            self.assertTrue(result.ok)
+            self.assertEquals(result.limit.burst_size, 2)
+            self.assertEquals(result.tokens, 1)
+            self.assertEquals(result.quota_value, 1)
+            self.assertEquals(result.headers(), {
+                'X-RateLimit-Limit': '10',
+                'X-RateLimit-Remaining': '9',
+                'X-RateLimit-Reset': str(12 * 60 * 60),
+            })
+
+            verify('bronze1', 'premium')
+            with self.assertRaises(RateLimitError) as cm:
+                verify('bronze1', 'premium')
+            result = cm.exception.result
+            self.assertFalse(result.ok)
+            # 1 token a second
+            self.assertEquals(result.retry_after, 1)
+            self.assertEquals(result.headers()['Retry-After'], '1')
+            self.assertNotIn('X-RateLimit-Remaining', result.headers())
+
+    def test_verifier_tier_limit(self):
+        limit_cache.clear()
+        # bronze keys may also make 5 requests a day across all zones, with
+        # a burst of 3
+        self.bronze.limits.create(
+            zone=None,
+            quota_requests=5,
+            quota_period='d',
+            requests_per_second=1,
+            burst_size=3,
+        )
+        with freeze_time('2017-04-17 12:00:00') as frozen_dt:
+            verify('bronze1', 'default')
+            verify('bronze1', 'premium')
+            result = verify('bronze1', 'default')
+            self.assertEquals(result.quota_value, 2)
+            self.assertEquals(result.tier_quota_value, 3)
+            with self.assertRaises(RateLimitError) as cm:
+                verify('bronze1', 'premium')
+            self.assertEquals(str(cm.exception),
+                              'exhausted tokens: 1 req/sec, burst 3 '
+                              'across all zones')
+            self.assertEquals(cm.exception.result.retry_after, 1)
+            # other keys in the tier have their own tier-wide bucket
+            verify('bronze2', 'default')
+
+            frozen_dt.tick(delta=datetime.timedelta(seconds=2))
+            result = verify('bronze1', 'default')
+            # the tier-wide quota has fewer requests remaining
+            self.assertEquals(result.headers()['X-RateLimit-Limit'], '5')
+            self.assertEquals(result.headers()['X-RateLimit-Remaining'], '1')
+            verify('bronze1', 'premium')
+            frozen_dt.tick()
+            with self.assertRaises(QuotaError) as cm:
+                verify('bronze1', 'default')
+            self.assertEquals(str(cm.exception),
+                              'quota exceeded: 5/daily across all zones')
+            self.assertEquals(cm.exception.result.retry_after,
+                              12 * 60 * 60 - 3)
+
+            frozen_dt.tick()
+            results = verify_many([('bronze1', 'premium'),
+                                   ('bronze2', 'premium')])
+            self.assertIsInstance(results[0].error, QuotaError)
+            self.assertTrue(results[1].ok)
+            self.assertEquals(results[1].tier_quota_value, 2)
+
+        # gold has no tier-wide limit
+        self.assertIsNone(verify('gold', 'default').tier_tokens)
+
+    def test_verify_many_matches_verify(self):
+        with freeze_time():
+            results = verify_many([('bronze1', 'premium')] * 3)
+            self.assertEquals([r.ok for r in results], [True, True, False])
+            self.assertRaises(RateLimitError, verify, 'bronze1', 'premium')
+
+    async def test_averify(self):
+        with freeze_time() as frozen_dt:
+            await averify('bronze1', 'premium')
+            await averify('bronze1', 'premium')
+            with self.assertRaises(RateLimitError):
+                await averify('bronze1', 'premium')
+            frozen_dt.tick()
+            self.assertTrue(await averify('bronze1', 'premium'))
+
+    async def test_averify_bad_key_and_zone(self):
+        with self.assertRaises(VerificationError):
+            await averify('badkey', 'default')
+        with self.assertRaises(VerificationError):
+            await averify('bronze1', 'secret')
+
     def test_verifier_quota_key_dependent(self):
         with freeze_time('2017-04-17') as frozen_dt:
             # 1 req/sec from bronze1 and bronze2
@@ -216,3 +395,91 @@ class UsageTestCase(TestCase):
             # 11th in either should be a problem
             self.assertRaises(QuotaError, verify, 'gold', 'premium')
             self.assertRaises(QuotaError, verify, 'gold', 'secret')
+
+
+class CacheBackendUsageTestCase(UsageTestCase):
+    """ same tests, using the get_many/set_many path of CacheBackend """
+
+    def setUp(self):
+        cache_backend = CacheBackend()
+        cache_backend.cache.clear()
+        patcher = mock.patch.object(verifier, 'backend', cache_backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super(CacheBackendUsageTestCase, self).setUp()
+
+
+@override_settings(SIMPLEKEYS_RATE_LIMIT_ALGORITHM='gcra')
+class GCRAUsageTestCase(UsageTestCase):
+    """ gcra should behave exactly like the token bucket """
+
+    def setUp(self):
+        patcher = mock.patch.object(verifier, 'backend', MemoryBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super(GCRAUsageTestCase, self).setUp()
+
+
+@override_settings(SIMPLEKEYS_RATE_LIMIT_ALGORITHM='gcra')
+class CacheBackendGCRAUsageTestCase(CacheBackendUsageTestCase):
+    pass
+
+
+@override_settings(SIMPLEKEYS_QUOTA_WINDOW='sliding')
+class SlidingQuotaTestCase(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(verifier, 'backend', MemoryBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        limit_cache.clear()
+        tier = Tier.objects.create(slug='bronze', name='Bronze')
+        zone = Zone.objects.create(slug='default', name='Default')
+        tier.limits.create(
+            zone=zone,
+            quota_requests=5,
+            quota_period='d',
+            requests_per_second=10,
+            burst_size=10,
+        )
+        Key.objects.create(key='bronze', status='a', tier=tier,
+                           email='bronze@example.com')
+
+    def test_quota_slides(self):
+        with freeze_time('2017-04-17 23:30:00') as frozen_dt:
+            for x in range(3):
+                verify('bronze', 'default')
+
+            # unlike a daily quota, nothing resets at midnight
+            frozen_dt.tick(delta=datetime.timedelta(hours=1))
+            verify('bronze', 'default')
+            result = verify('bronze', 'default')
+            self.assertEquals(result.headers()['X-RateLimit-Remaining'], '0')
+            # the first requests slide out at 23:00 tomorrow
+            self.assertEquals(result.headers()['X-RateLimit-Reset'],
+                              str(22 * 60 * 60 + 30 * 60))
+            with self.assertRaises(QuotaError) as cm:
+                verify('bronze', 'default')
+            self.assertEquals(cm.exception.result.retry_after,
+                              22 * 60 * 60 + 30 * 60)
+            self.assertEquals(cm.exception.result.headers()['Retry-After'],
+                              '81000')
+
+            # once the first hour's requests have slid out there's room
+            # again, the rejected request wasn't counted
+            frozen_dt.tick(delta=datetime.timedelta(seconds=81000))
+            for x in range(3):
+                verify('bronze', 'default')
+            self.assertRaises(QuotaError, verify, 'bronze', 'default')
+
+    def test_headers_use_returned_ring(self):
+        with freeze_time('2017-04-17 23:30:00'):
+            verify('bronze', 'default')
+            result = verify('bronze', 'default')
+            # the reset comes from the ring the check returned
+            backend = mock.Mock(quota_window='sliding')
+            with mock.patch.object(verifier, 'backend', backend):
+                headers = result.headers()
+            self.assertEquals(backend.mock_calls, [])
+            self.assertEquals(headers['X-RateLimit-Reset'],
+                              str(23 * 60 * 60 + 30 * 60))
@@ -0,0 +1,91 @@
+import re
+from django.test import TestCase
+
+from ..zones import ZoneRouter
+
+
+def linear_zone(rules, path):
+    for pattern, zone in rules:
+        if re.match(pattern, path):
+            return zone
+    return None
+
+
+class ZoneRouterTestCase(TestCase):
+
+    rules = [
+        ('/api/v1/legislators/geo/', 'geo'),
+        (r'/api/v1/bills/\d+/', 'bills'),
+        ('/api/v1/', 'v1'),
+        ('/api/v1/legislators/', 'never'),
+        (re.compile('/API/', re.I), 'upper'),
+        ('/api/(v2|v3)/', 'v2'),
+        ('/static', 'static'),
+        ('/via.*/', 'via'),
+    ]
+
+    paths = [
+        '/api/v1/legislators/geo/',
+        '/api/v1/legislators/geo/123/',
+        '/api/v1/legislators/',
+        '/api/v1/bills/123/',
+        '/api/v1/bills/abc/',
+        '/api/v2/bills/',
+        '/api/v3/',
+        '/Api/v4/',
+        '/api/v4/',
+        '/static/app.js',
+        '/staticfiles/',
+        '/via/x/',
+        '/',
+        '',
+    ]
+
+    def test_matches_linear_scan(self):
+        router = ZoneRouter(self.rules)
+        for path in self.paths:
+            self.assertEquals(router.get_zone(path),
+                              linear_zone(self.rules, path), path)
+
+    def test_earliest_rule_wins(self):
+        router = ZoneRouter([('/api/.*', 'regex'), ('/api/', 'literal')])
+        self.assertEquals(router.get_zone('/api/x'), 'regex')
+        router = ZoneRouter([('/api/', 'literal'), ('/api/.*', 'regex')])
+        self.assertEquals(router.get_zone('/api/x'), 'literal')
+
+    def test_uncombinable_patterns(self):
+        rules = [(r'/(a)\1/', 'backref'), ('/(?P<x>b)/', 'named'),
+                 ('(?i)/c.*', 'flags'), ('/d.*', 'd')]
+        router = ZoneRouter(rules)
+        for path in ('/aa/', '/ab/', '/b/', '/C/', '/d/', '/e/'):
+            self.assertEquals(router.get_zone(path),
+                              linear_zone(rules, path), path)
+
+    def test_no_rules(self):
+        self.assertIsNone(ZoneRouter([]).get_zone('/api/'))
+
+    def test_cache(self):
+        router = ZoneRouter(self.rules, cache_size=2)
+        for path in self.paths:
+            router.get_zone(path)
+        self.assertEquals(router.get_route.cache_info().currsize, 2)
+        router.get_zone(self.paths[-1])
+        self.assertEquals(router.get_route.cache_info().hits, 1)
+
+    def test_costs(self):
+        router = ZoneRouter([
+            ('/api/v1/search/', 'default', 50),
+            (r'/api/v1/export/\w+/', 'default', 10),
+            ('/api/v1/', 'default'),
+        ])
+        self.assertEquals(router.get_route('/api/v1/search/?q=x'),
+                          ('default', 50))
+        self.assertEquals(router.get_route('/api/v1/export/bills/'),
+                          ('default', 10))
+        self.assertEquals(router.get_route('/api/v1/bills/'), ('default', 1))
+        self.assertEquals(router.get_zone('/api/v1/search/'), 'default')
+        self.assertIsNone(router.get_route('/admin/'))
+
+    def test_cache_disabled(self):
+        router = ZoneRouter(self.rules, cache_size=0)
+        self.assertEquals(router.get_zone('/api/v1/bills/1/'), 'bills')
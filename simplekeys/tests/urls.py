@@ -1,24 +1,27 @@
 """
     URLs only for test purposes
 """
-from django.conf.urls import url
+from django.urls import re_path
 from django.contrib import admin
 
-from simplekeys.views import RegistrationView, ConfirmationView
+from simplekeys.views import RegistrationView, ConfirmationView, MetricsView
 from . import views
 
 
 urlpatterns = [
-    url(r'^admin/', admin.site.urls),
-    url(r'^example/$', views.example),
-    url(r'^special/$', views.special),
-    url(r'^unprotected/$', views.unprotected),
-    url(r'^via_middleware/$', views.via_middleware),
+    re_path(r'^admin/', admin.site.urls),
+    re_path(r'^example/$', views.example),
+    re_path(r'^special/$', views.special),
+    re_path(r'^expensive/$', views.expensive),
+    re_path(r'^async/$', views.async_example),
+    re_path(r'^unprotected/$', views.unprotected),
+    re_path(r'^via_middleware/$', views.via_middleware),
 
-    url(r'^register/$', RegistrationView.as_view()),
-    url(r'^register-special/$', RegistrationView.as_view(
+    re_path(r'^register/$', RegistrationView.as_view()),
+    re_path(r'^register-special/$', RegistrationView.as_view(
         tier='special',
         confirmation_url='https://confirm.example.com/special-confirm/',
     )),
-    url(r'^confirm/$', ConfirmationView.as_view()),
+    re_path(r'^confirm/$', ConfirmationView.as_view()),
+    re_path(r'^metrics/$', MetricsView.as_view()),
 ]
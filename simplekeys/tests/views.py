@@ -15,6 +15,16 @@ def special(request):
     return JsonResponse({'response': 'special'})
 
 
+@key_required(cost=5)
+def expensive(request):
+    return JsonResponse({'response': 'OK'})
+
+
+@key_required()
+async def async_example(request):
+    return JsonResponse({'response': 'OK'})
+
+
 def via_middleware(request):
     return JsonResponse({'response': 'OK'})
 
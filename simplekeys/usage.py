@@ -0,0 +1,116 @@
+import datetime
+from collections import Counter
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.db.models.functions import Greatest
+
+from .backends import chunked
+from .models import Key, Usage
+
+
+def _dates(days):
+    today = datetime.date.today()
+    return [today - datetime.timedelta(days=d) for d in range(days)]
+
+
+def flush_usage(backend, days=2, batch_size=1000):
+    """
+        copy the last days of usage counters from backend into the Usage
+        table, returns the number of rows written
+
+        rows are only ever increased, so a counter lost to cache eviction
+        or a restart can't erase usage that was already recorded
+    """
+    since = _dates(days)[-1]
+    written = 0
+    for batch in chunked(backend.iter_usage(days=days, chunk_size=batch_size),
+                         batch_size):
+        existing = {
+            (u.key, u.zone, u.date): u
+            for u in Usage.objects.filter(
+                date__gte=since, key__in={row[0] for row in batch}
+            ).only('id', 'key', 'zone', 'date', 'requests')
+        }
+
+        created = []
+        updated = []
+        for key, zone, date, requests in batch:
+            date = datetime.datetime.strptime(date, '%Y%m%d').date()
+            row = existing.get((key, zone, date))
+            if row is None:
+                created.append(Usage(key=key, zone=zone, date=date,
+                                     requests=requests))
+            elif requests > row.requests:
+                row.requests = requests
+                updated.append(row)
+
+        if created:
+            # another flusher may have created some of the same rows first,
+            # those are raised to our count like existing rows
+            Usage.objects.bulk_create(created, ignore_conflicts=True)
+            stored = {
+                (u.key, u.zone, u.date): u
+                for u in Usage.objects.filter(
+                    date__gte=since, key__in={u.key for u in created}
+                ).only('id', 'key', 'zone', 'date', 'requests')
+            }
+            for usage in created:
+                row = stored[(usage.key, usage.zone, usage.date)]
+                if usage.requests > row.requests:
+                    row.requests = usage.requests
+                    updated.append(row)
+                elif usage.requests == row.requests:
+                    written += 1
+        for rows in chunked(updated, 500):
+            _raise_requests(rows)
+        written += len(updated)
+    return written
+
+
+def _raise_requests(rows):
+    """
+        set each Usage row's requests to its new count in one UPDATE, unless
+        the stored count is already higher
+    """
+    Usage.objects.filter(pk__in=[row.pk for row in rows]).update(
+        requests=Greatest('requests', Case(
+            *[When(pk=row.pk, then=Value(row.requests)) for row in rows],
+            default=F('requests'), output_field=PositiveIntegerField()
+        ))
+    )
+
+
+def iter_usage(keys=None, zones=None, days=7, chunk_size=1000):
+    """
+        yields key, zone, date, requests for each row of the Usage table in
+        the last days, like AbstractBackend.iter_usage
+
+        rows are streamed from the database chunk_size at a time
+    """
+    dates = _dates(days)
+    rows = Usage.objects.filter(date__range=(dates[-1], dates[0]))
+    if keys:
+        rows = rows.filter(key__in=keys)
+    if zones:
+        rows = rows.filter(zone__in=zones)
+    rows = rows.values_list('key', 'zone', 'date', 'requests')
+    for key, zone, date, requests in rows.iterator(chunk_size=chunk_size):
+        yield key, zone, date.strftime('%Y%m%d'), requests
+
+
+def get_usage(keys=None, days=7):
+    """
+        get usage recorded in the Usage table, in the same nested
+        dictionary format as AbstractBackend.get_usage
+    """
+    dates = _dates(days)
+    rows = iter_usage(keys=keys, days=days)
+    if not keys:
+        keys = Key.objects.all().values_list('key', flat=True)
+
+    result = {k: {d.strftime('%Y%m%d'): Counter() for d in dates}
+              for k in keys}
+    for key, zone, date, requests in rows:
+        if key in result:
+            result[key][date][zone] = requests
+
+    return result
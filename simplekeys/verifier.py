@@ -1,11 +1,22 @@
 from __future__ import division
+import math
 import time
+import atexit
 import datetime
 from django.conf import settings
+from django.db.models import F, Q
 from django.utils.module_loading import import_string
 from django.http import JsonResponse
 
 from .models import Key, Limit
+from . import clock
+from .backends import TIER_ZONE, QuotaWindow, window_reset
+from .limitcache import (limit_cache, shared_limit_cache, make_record,
+                         tier_limits)
+from .keyfilter import key_filter
+from .leasing import leases
+from .quotabuffer import quota_buffer
+from .metrics import metrics
 
 
 class VerificationError(Exception):
@@ -20,18 +31,201 @@ class QuotaError(Exception):
     pass
 
 
+class VerificationResult(object):
+    """
+        outcome of one request, returned by verify & verify_many
+
+        error is None if the request was allowed, otherwise the
+        VerificationError, RateLimitError or QuotaError verify would have
+        raised.  retry_after is the number of seconds until a rate limited
+        request would have enough tokens, or until the quota period resets,
+        None if waiting won't help.
+
+        limit, tokens & quota_value are the Limit & the bucket and quota
+        state the backend reported, None if the key wasn't valid.
+        tier_tokens & tier_quota_value are the state of the tier-wide bucket,
+        None unless the tier has a tier-wide limit
+    """
+
+    def __init__(self, key, zone, cost, error=None, retry_after=None,
+                 limit=None, tokens=None, quota_value=None, tier_tokens=None,
+                 tier_quota_value=None):
+        self.key = key
+        self.zone = zone
+        self.cost = cost
+        self.error = error
+        self.retry_after = retry_after
+        self.limit = limit
+        self.tokens = tokens
+        self.quota_value = quota_value
+        self.tier_tokens = tier_tokens
+        self.tier_quota_value = tier_quota_value
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<VerificationResult {} {} {}>'.format(
+            self.key, self.zone, 'ok' if self.ok else repr(self.error)
+        )
+
+    def headers(self):
+        """
+            X-RateLimit-Limit, X-RateLimit-Remaining & X-RateLimit-Reset
+            describing the quota, plus Retry-After for a rejected request
+            that can be retried
+
+            with a tier-wide limit, whichever quota has fewer requests
+            remaining is described
+        """
+        if self.limit is None:
+            return {}
+        limit, quota_value = self.limit, self.quota_value
+        tier_limit = getattr(limit, 'tier_limit', None)
+        if tier_limit is not None and self.tier_quota_value is not None and (
+                tier_limit.quota_requests - self.tier_quota_value <
+                limit.quota_requests - quota_value):
+            limit, quota_value = tier_limit, self.tier_quota_value
+        reset = get_quota_reset(limit, quota_value)
+        headers = {
+            'X-RateLimit-Limit': str(limit.quota_requests),
+            'X-RateLimit-Reset': str(math.ceil(reset)),
+        }
+        # the quota isn't read when there weren't enough tokens
+        if quota_value is not None:
+            headers['X-RateLimit-Remaining'] = str(
+                max(limit.quota_requests - quota_value, 0)
+            )
+        if self.error is not None and self.retry_after is not None:
+            headers['Retry-After'] = str(math.ceil(self.retry_after))
+        return headers
+
+
 # load backend from setting
 backend = getattr(settings, 'SIMPLEKEYS_RATE_LIMIT_BACKEND',
                   'simplekeys.backends.CacheBackend')
 backend = import_string(backend)()
 
+if quota_buffer.enabled:
+    atexit.register(quota_buffer.flush, backend)
+
+
+def _with_tier_limit(limits):
+    """
+        returns the zone's Limit out of limits (a tier's limits for the zone
+        & all zones), with the tier-wide Limit or None as its tier_limit
+
+        raises Limit.DoesNotExist if the tier has no limit for the zone
+    """
+    limit = tier_limit = None
+    for row in limits:
+        if row.zone_id is None:
+            tier_limit = row
+        else:
+            limit = row
+    if limit is None:
+        raise Limit.DoesNotExist()
+    limit.tier_limit = tier_limit
+    return limit
+
+
+def _limit_from_record(key, zone, record):
+    """
+        returns the Limit for zone out of key's shared limit cache record,
+        caching it in this process
+    """
+    key_id, zone_limits, _ = record
+    limit = zone_limits.get(zone)
+    if limit is None:
+        raise VerificationError('key does not have access to zone {}'.format(
+            zone
+        ))
+    limit_cache.set(key, zone, key_id, limit)
+    return limit
+
+
+def _get_shared_limit(key, zone, timings):
+    """
+        get_limit through the shared limit cache, the database is only
+        queried if key has no current record
+    """
+    start = time.perf_counter()
+    record, versions = shared_limit_cache.lookup(key)
+    found = time.perf_counter()
+    if record is None:
+        try:
+            kobj = Key.objects.get(key=key, status='a')
+        except Key.DoesNotExist:
+            raise VerificationError('no valid key')
+        key_found = time.perf_counter()
+        record = make_record(kobj.pk, tier_limits(kobj.tier_id))
+        shared_limit_cache.fill(key, record, versions)
+        if timings is not None:
+            timings['key_lookup'] = key_found - found
+            timings['limit_lookup'] = time.perf_counter() - key_found
+    if timings is not None:
+        timings['shared_lookup'] = found - start
+    return _limit_from_record(key, zone, record)
+
+
+async def _aget_shared_limit(key, zone, timings):
+    """
+        async version of _get_shared_limit
+    """
+    start = time.perf_counter()
+    record, versions = await shared_limit_cache.alookup(key)
+    found = time.perf_counter()
+    if record is None:
+        try:
+            kobj = await Key.objects.aget(key=key, status='a')
+        except Key.DoesNotExist:
+            raise VerificationError('no valid key')
+        key_found = time.perf_counter()
+        record = make_record(kobj.pk, [
+            limit async for limit in tier_limits(kobj.tier_id)
+        ])
+        await shared_limit_cache.afill(key, record, versions)
+        if timings is not None:
+            timings['key_lookup'] = key_found - found
+            timings['limit_lookup'] = time.perf_counter() - key_found
+    if timings is not None:
+        timings['shared_lookup'] = found - start
+    return _limit_from_record(key, zone, record)
+
+
+def get_limit(key, zone, timings=None):
+    """
+        resolve the Limit that applies to key in zone
+
+        raises VerificationError if the key isn't active or its tier has no
+        access to the zone
+
+        if timings is a dict the time taken by database queries is recorded
+        in it
+    """
+    limit = limit_cache.get(key, zone)
+    if limit is not None:
+        return limit
+
+    if not key_filter.might_contain(key):
+        raise VerificationError('no valid key')
+
+    if shared_limit_cache.enabled:
+        return _get_shared_limit(key, zone, timings)
 
-def verify(key, zone):
     # ensure we have a verified key w/ access to the zone
     try:
         # could also do this w/ new subquery expressions in 1.11
+        start = time.perf_counter()
         kobj = Key.objects.get(key=key, status='a')
-        limit = Limit.objects.get(tier=kobj.tier, zone__slug=zone)
+        key_found = time.perf_counter()
+        limit = _with_tier_limit(Limit.objects.select_related('tier').filter(
+            Q(zone__slug=zone) | Q(zone__isnull=True), tier_id=kobj.tier_id
+        ))
+        if timings is not None:
+            timings['key_lookup'] = key_found - start
+            timings['limit_lookup'] = time.perf_counter() - key_found
     except Key.DoesNotExist:
         raise VerificationError('no valid key')
     except Limit.DoesNotExist:
@@ -39,64 +233,591 @@ def verify(key, zone):
             zone
         ))
 
-    # enforce rate limiting - will raise RateLimitError if exhausted
-    # replenish first
-    tokens, last_time = backend.get_tokens_and_timestamp(key, zone)
+    limit_cache.set(key, zone, kobj.pk, limit)
+    return limit
 
-    if last_time is None:
-        # if this is the first time, fill the bucket
-        tokens = limit.burst_size
-    else:
-        # increment bucket, careful not to overfill
-        tokens = min(
-            tokens + (limit.requests_per_second * (time.time() - last_time)),
-            limit.burst_size
-        )
 
-    # now try to decrement count
-    if tokens >= 1:
-        tokens -= 1
-        backend.set_token_count(key, zone, tokens)
-    else:
-        raise RateLimitError('exhausted tokens: {} req/sec, burst {}'.format(
-            limit.requests_per_second, limit.burst_size
+async def aget_limit(key, zone, timings=None):
+    """
+        async version of get_limit
+    """
+    limit = limit_cache.get(key, zone)
+    if limit is not None:
+        return limit
+
+    if not await key_filter.amight_contain(key):
+        raise VerificationError('no valid key')
+
+    if shared_limit_cache.enabled:
+        return await _aget_shared_limit(key, zone, timings)
+
+    try:
+        start = time.perf_counter()
+        kobj = await Key.objects.aget(key=key, status='a')
+        key_found = time.perf_counter()
+        limit = _with_tier_limit([
+            limit async for limit in Limit.objects.select_related(
+                'tier'
+            ).filter(Q(zone__slug=zone) | Q(zone__isnull=True),
+                     tier_id=kobj.tier_id)
+        ])
+        if timings is not None:
+            timings['key_lookup'] = key_found - start
+            timings['limit_lookup'] = time.perf_counter() - key_found
+    except Key.DoesNotExist:
+        raise VerificationError('no valid key')
+    except Limit.DoesNotExist:
+        raise VerificationError('key does not have access to zone {}'.format(
+            zone
         ))
 
-    # enforce daily/monthly quotas
+    limit_cache.set(key, zone, kobj.pk, limit)
+    return limit
+
+
+def get_limits(pairs):
+    """
+        resolve the Limits that apply to many (key, zone) pairs at once
+
+        returns {(key, zone): Limit or VerificationError}
+
+        pairs missing from the limit cache (and shared limit cache) are
+        resolved with a single query joining keys to their tier's limits,
+        plus one more only if some pairs have no limit, to tell invalid keys
+        from missing zone access
+    """
+    limits = {}
+    missing = set()
+    for key, zone in pairs:
+        if (key, zone) in limits or (key, zone) in missing:
+            continue
+        limit = limit_cache.get(key, zone)
+        if limit is not None:
+            limits[(key, zone)] = limit
+        elif not key_filter.might_contain(key):
+            limits[(key, zone)] = VerificationError('no valid key')
+        else:
+            missing.add((key, zone))
+    if missing and shared_limit_cache.enabled:
+        records = shared_limit_cache.get_many({key for key, zone in missing})
+        for key, zone in [kz for kz in missing if kz[0] in records]:
+            missing.remove((key, zone))
+            try:
+                limits[(key, zone)] = _limit_from_record(key, zone,
+                                                         records[key])
+            except VerificationError as e:
+                limits[(key, zone)] = e
+    if not missing:
+        return limits
+
+    rows = Limit.objects.select_related('tier').filter(
+        Q(zone__slug__in={zone for key, zone in missing}) |
+        Q(zone__isnull=True),
+        tier__keys__key__in={key for key, zone in missing},
+        tier__keys__status='a',
+    ).annotate(
+        key_string=F('tier__keys__key'),
+        key_id=F('tier__keys__id'),
+        zone_slug=F('zone__slug'),
+    )
+    found = []
+    tier_limits = {}
+    for limit in rows:
+        if limit.zone_slug is None:
+            tier_limits[limit.key_string] = limit
+        elif (limit.key_string, limit.zone_slug) in missing:
+            found.append(limit)
+    for limit in found:
+        kz = (limit.key_string, limit.zone_slug)
+        missing.remove(kz)
+        limit.tier_limit = tier_limits.get(limit.key_string)
+        limits[kz] = limit
+        limit_cache.set(kz[0], kz[1], limit.key_id, limit)
+
+    if missing:
+        valid = set(Key.objects.filter(
+            key__in={key for key, zone in missing}, status='a'
+        ).values_list('key', flat=True))
+        for key, zone in missing:
+            if key in valid:
+                limits[(key, zone)] = VerificationError(
+                    'key does not have access to zone {}'.format(zone)
+                )
+            else:
+                limits[(key, zone)] = VerificationError('no valid key')
+    return limits
+
+
+def get_quota_range(limit):
+    """
+        returns the daily/monthly quota period the current request falls in,
+        or the current sub-window of a sliding quota
+    """
+    if backend.quota_window == 'sliding':
+        return QuotaWindow.current(limit.quota_period, limit.quota_requests)
     if limit.quota_period == 'd':
-        quota_range = datetime.datetime.utcnow().strftime('%Y%m%d')
+        return clock.utcnow().strftime('%Y%m%d')
     elif limit.quota_period == 'm':
-        quota_range = datetime.datetime.utcnow().strftime('%Y%m')
+        return clock.utcnow().strftime('%Y%m')
+
+
+def get_quota_reset(limit, quota_value=None, cost=0):
+    """
+        returns the number of seconds until the current quota period ends
+
+        for a sliding quota this is when the oldest requests counted in the
+        ring quota_value came with (a WindowTotal) slide out of the window,
+        or once enough have for cost more to fit.  Without a ring, when the
+        quota wasn't read or its value is an estimate from a lease or the
+        quota buffer, it's the longest that could take.
+    """
+    if backend.quota_window == 'sliding':
+        return window_reset(getattr(quota_value, 'ring', None),
+                            get_quota_range(limit), cost)
+    now = clock.utcnow()
+    if limit.quota_period == 'd':
+        end = datetime.datetime.combine(now.date(), datetime.time()) + \
+            datetime.timedelta(days=1)
+    else:
+        end = datetime.datetime(now.year + now.month // 12,
+                                now.month % 12 + 1, 1)
+    return (end - now).total_seconds()
+
+
+def _enforce(buckets, cost, quota_value):
+    """
+        raise the error for the first of buckets, (limit, tokens,
+        quota_value, description) of the zone's bucket & the tier-wide one,
+        that rejected the request
+    """
+    if quota_value is None:
+        # neither bucket was consumed, blame one that was short of tokens
+        limit, _, _, across = next(
+            (bucket for bucket in buckets if bucket[1] < cost), buckets[0]
+        )
+        raise RateLimitError('exhausted tokens: {} req/sec, burst {}{}'.format(
+            limit.requests_per_second, limit.burst_size, across
+        ))
+
+    for limit, _, bucket_quota, across in buckets:
+        if bucket_quota > limit.quota_requests:
+            raise QuotaError('quota exceeded: {}/{}{}'.format(
+                limit.quota_requests, limit.get_quota_period_display(), across
+            ))
+
+
+def _retry_after(buckets, cost, quota_value):
+    if quota_value is None:
+        waits = [(cost - tokens) / limit.requests_per_second
+                 if cost <= limit.burst_size else None
+                 for limit, tokens, _, _ in buckets if tokens < cost]
+        if None in waits:
+            return None
+        return max(waits, default=0)
+    return max(get_quota_reset(limit, bucket_quota, cost)
+               for limit, _, bucket_quota, _ in buckets
+               if bucket_quota > limit.quota_requests)
+
+
+def _result(key, zone, cost, limit, tokens, quota_value, tier_tokens=None,
+            tier_quota_value=None):
+    """
+        returns the VerificationResult for a request given the bucket &
+        quota state check_and_consume reported, errors are given the result
+        as their result attribute
+    """
+    result = VerificationResult(key, zone, cost, limit=limit, tokens=tokens,
+                                quota_value=quota_value,
+                                tier_tokens=tier_tokens,
+                                tier_quota_value=tier_quota_value)
+    buckets = [(limit, tokens, quota_value, '')]
+    if tier_tokens is not None:
+        buckets.append((limit.tier_limit, tier_tokens, tier_quota_value,
+                        ' across all zones'))
+    try:
+        _enforce(buckets, cost, quota_value)
+    except (RateLimitError, QuotaError) as e:
+        result.error = e
+        result.retry_after = _retry_after(buckets, cost, quota_value)
+        e.result = result
+    return result
+
+
+def _check(key, zone, cost, limit, *state):
+    """
+        returns the VerificationResult for an allowed request, raises the
+        error for one that isn't
+    """
+    result = _result(key, zone, cost, limit, *state)
+    if result.error is not None:
+        raise result.error
+    return result
+
 
-    if (backend.get_and_inc_quota_value(key, zone, quota_range) >
-            limit.quota_requests):
-        raise QuotaError('quota exceeded: {}/{}'.format(
-            limit.quota_requests, limit.get_quota_period_display()
+def _lease_size(limit):
+    if getattr(limit, 'tier_limit', None) is not None:
+        # leases are only taken from the zone's bucket
+        return 1
+    # a lease larger than the bucket could never be granted
+    return min(limit.lease_size, limit.burst_size)
+
+
+def _tier_args(limit):
+    tier_limit = getattr(limit, 'tier_limit', None)
+    if tier_limit is None:
+        return {}
+    return {'tier_limit': tier_limit,
+            'tier_quota_range': get_quota_range(tier_limit)}
+
+
+def _consume_tokens(key, zone, limit, quota_range, cost, quota_cost):
+    """
+        take cost tokens for key & zone, from this process's lease if the
+        limit allows leasing, otherwise from the backend
+    """
+    lease_size = _lease_size(limit)
+    # requests costing a whole lease or more go straight to the backend
+    if lease_size > cost:
+        result = leases.spend(key, zone, quota_range, cost)
+        if result is not None:
+            return result
+        tokens, quota_value = backend.check_and_consume(
+            key, zone, limit, quota_range, cost=lease_size,
+            quota_cost=quota_cost
+        )
+        if quota_value is not None:
+            return leases.grant(key, zone, quota_range, lease_size, tokens,
+                                quota_value, cost)
+        # not enough tokens for a whole lease, try for just this request
+
+    return backend.check_and_consume(key, zone, limit, quota_range,
+                                     cost=cost, quota_cost=quota_cost,
+                                     **_tier_args(limit))
+
+
+async def _aconsume_tokens(key, zone, limit, quota_range, cost, quota_cost):
+    """
+        async version of _consume_tokens
+    """
+    lease_size = _lease_size(limit)
+    if lease_size > cost:
+        result = leases.spend(key, zone, quota_range, cost)
+        if result is not None:
+            return result
+        tokens, quota_value = await backend.acheck_and_consume(
+            key, zone, limit, quota_range, cost=lease_size,
+            quota_cost=quota_cost
+        )
+        if quota_value is not None:
+            return leases.grant(key, zone, quota_range, lease_size, tokens,
+                                quota_value, cost)
+
+    return await backend.acheck_and_consume(key, zone, limit, quota_range,
+                                            cost=cost, quota_cost=quota_cost,
+                                            **_tier_args(limit))
+
+
+def _buffer_quota(key, zone, limit, quota_range, cost, state):
+    """
+        count a request whose tokens were taken with a quota_cost of 0 in
+        the quota buffer, returns state with the buffer's quota estimates
+    """
+    if state[1] is None:
+        return state
+    buffered = (state[0], quota_buffer.add(backend, key, zone, quota_range,
+                                           cost))
+    if len(state) > 2:
+        buffered += (state[2], quota_buffer.add(
+            backend, key, TIER_ZONE, get_quota_range(limit.tier_limit), cost
         ))
+    return buffered
+
+
+async def _abuffer_quota(key, zone, limit, quota_range, cost, state):
+    """
+        async version of _buffer_quota
+    """
+    if state[1] is None:
+        return state
+    buffered = (state[0], await quota_buffer.aadd(backend, key, zone,
+                                                  quota_range, cost))
+    if len(state) > 2:
+        buffered += (state[2], await quota_buffer.aadd(
+            backend, key, TIER_ZONE, get_quota_range(limit.tier_limit), cost
+        ))
+    return buffered
+
+
+def check_and_consume(key, zone, limit, quota_range, cost=1, timings=None):
+    """
+        take cost tokens & quota units for key & zone, and from the tier-wide
+        bucket & quota if the limit has a tier_limit
+
+        returns tokens, quota_value (followed by tier_tokens,
+        tier_quota_value if there's a tier_limit) like
+        backend.check_and_consume
 
-    return True
+        if timings is a dict the time taken by the backend is recorded in it
+    """
+    if not quota_buffer.enabled:
+        if timings is None:
+            return _consume_tokens(key, zone, limit, quota_range, cost, None)
+        start = time.perf_counter()
+        result = _consume_tokens(key, zone, limit, quota_range, cost, None)
+        timings['consume'] = time.perf_counter() - start
+        return result
 
+    # the backend only handles tokens, quota is counted in the buffer
+    start = time.perf_counter()
+    state = _consume_tokens(key, zone, limit, quota_range, cost, 0)
+    consumed = time.perf_counter()
+    state = _buffer_quota(key, zone, limit, quota_range, cost, state)
+    if timings is not None:
+        timings['consume'] = consumed - start
+        timings['quota'] = time.perf_counter() - consumed
+    return state
 
-def verify_request(request, zone):
+
+async def acheck_and_consume(key, zone, limit, quota_range, cost=1,
+                             timings=None):
+    """
+        async version of check_and_consume
+    """
+    if not quota_buffer.enabled:
+        if timings is None:
+            return await _aconsume_tokens(key, zone, limit, quota_range,
+                                          cost, None)
+        start = time.perf_counter()
+        result = await _aconsume_tokens(key, zone, limit, quota_range, cost,
+                                        None)
+        timings['consume'] = time.perf_counter() - start
+        return result
+
+    start = time.perf_counter()
+    state = await _aconsume_tokens(key, zone, limit, quota_range, cost, 0)
+    consumed = time.perf_counter()
+    state = await _abuffer_quota(key, zone, limit, quota_range, cost, state)
+    if timings is not None:
+        timings['consume'] = consumed - start
+        timings['quota'] = time.perf_counter() - consumed
+    return state
+
+
+_OUTCOMES = {
+    VerificationError: 'invalid',
+    RateLimitError: 'rate',
+    QuotaError: 'quota',
+}
+
+
+def _record(zone, limit, error, timings, start):
+    timings['total'] = time.perf_counter() - start
+    outcome = 'ok' if error is None else _OUTCOMES.get(type(error), 'error')
+    metrics.record(zone, limit.tier.slug if limit else '', outcome, timings)
+
+
+def _check_cost(cost):
+    # a cost below 1 would refill the bucket & take back quota
+    if not isinstance(cost, int) or cost < 1:
+        raise ValueError('cost must be a positive integer, not {!r}'.format(
+            cost))
+
+
+def verify(key, zone, cost=1):
+    """
+        check that key may make a request to zone, taking cost tokens &
+        quota units so expensive requests can count as several
+
+        raises ValueError if cost isn't a positive integer
+    """
+    _check_cost(cost)
+    if metrics.enabled:
+        return _measured_verify(key, zone, cost)
+
+    limit = get_limit(key, zone)
+
+    # enforce rate limiting - the backend replenishes the bucket first and
+    # only counts the request against the quota if tokens were available
+    state = check_and_consume(key, zone, limit, get_quota_range(limit), cost)
+    return _check(key, zone, cost, limit, *state)
+
+
+def _measured_verify(key, zone, cost):
+    """
+        verify, recording metrics
+    """
+    start = time.perf_counter()
+    timings = {}
+    limit = None
+    try:
+        limit = get_limit(key, zone, timings)
+        state = check_and_consume(
+            key, zone, limit, get_quota_range(limit), cost, timings
+        )
+        result = _check(key, zone, cost, limit, *state)
+    except Exception as e:
+        _record(zone, limit, e, timings, start)
+        raise
+    _record(zone, limit, None, timings, start)
+
+    return result
+
+
+async def averify(key, zone, cost=1):
+    """
+        async version of verify, for use on the event loop
+    """
+    _check_cost(cost)
+    if metrics.enabled:
+        return await _ameasured_verify(key, zone, cost)
+
+    limit = await aget_limit(key, zone)
+    state = await acheck_and_consume(
+        key, zone, limit, get_quota_range(limit), cost
+    )
+    return _check(key, zone, cost, limit, *state)
+
+
+async def _ameasured_verify(key, zone, cost):
+    """
+        async version of _measured_verify
+    """
+    start = time.perf_counter()
+    timings = {}
+    limit = None
+    try:
+        limit = await aget_limit(key, zone, timings)
+        state = await acheck_and_consume(
+            key, zone, limit, get_quota_range(limit), cost, timings
+        )
+        result = _check(key, zone, cost, limit, *state)
+    except Exception as e:
+        _record(zone, limit, e, timings, start)
+        raise
+    _record(zone, limit, None, timings, start)
+
+    return result
+
+
+def verify_many(requests):
+    """
+        check many (key, zone) or (key, zone, cost) requests at once
+
+        returns a VerificationResult for each request, in order, rather
+        than raising.  Limits are resolved for the whole batch with
+        get_limits & the backend checks them all with one
+        check_and_consume_many, requests are consumed in order so a key may
+        appear more than once.
+
+        raises ValueError, before checking any request, if a cost isn't a
+        positive integer
+    """
+    requests = [(key, zone, cost[0] if cost else 1)
+                for key, zone, *cost in requests]
+    for key, zone, cost in requests:
+        _check_cost(cost)
+    limits = get_limits((key, zone) for key, zone, cost in requests)
+    quota_cost = 0 if quota_buffer.enabled else None
+
+    results = [None] * len(requests)
+    batch = []
+    for index, (key, zone, cost) in enumerate(requests):
+        limit = limits[(key, zone)]
+        if isinstance(limit, VerificationError):
+            results[index] = VerificationResult(key, zone, cost, limit)
+            continue
+        quota_range = get_quota_range(limit)
+        # tokens already leased are spent, but batches don't take new leases
+        if _lease_size(limit) > cost:
+            spent = leases.spend(key, zone, quota_range, cost)
+            if spent is not None:
+                results[index] = _result(key, zone, cost, limit, *spent)
+                continue
+        item = (key, zone, limit, quota_range, cost, quota_cost)
+        tier_args = _tier_args(limit)
+        if tier_args:
+            item += (tier_args['tier_limit'], tier_args['tier_quota_range'])
+        batch.append((index, item))
+
+    consumed = backend.check_and_consume_many([item for _, item in batch])
+    for (index, item), state in zip(batch, consumed):
+        key, zone, limit, quota_range, cost = item[:5]
+        if quota_cost == 0:
+            state = _buffer_quota(key, zone, limit, quota_range, cost, state)
+        results[index] = _result(key, zone, cost, limit, *state)
+
+    if metrics.enabled:
+        # outcomes only, stages aren't timed per request in a batch
+        for result in results:
+            limit = limits[(result.key, result.zone)]
+            metrics.record(
+                result.zone,
+                '' if isinstance(limit, VerificationError) else
+                limit.tier.slug,
+                'ok' if result.ok else _OUTCOMES[type(result.error)], {}
+            )
+    return results
+
+
+def _get_request_key(request):
     key = request.META.get(getattr(settings, 'SIMPLEKEYS_HEADER',
                                    'HTTP_X_API_KEY'))
-    note = getattr(settings, 'SIMPLEKEYS_ERROR_NOTE', None)
-
     if not key:
         key = request.GET.get(getattr(settings, 'SIMPLEKEYS_QUERY_PARAM',
                                       'apikey'))
+    return key
+
+
+def add_rate_limit_headers(response, result):
+    """
+        add result's rate limit headers to response, unless disabled by
+        SIMPLEKEYS_RATE_LIMIT_HEADERS or already set
+
+        returns response
+    """
+    if result is not None and getattr(
+            settings, 'SIMPLEKEYS_RATE_LIMIT_HEADERS', True):
+        for name, value in result.headers().items():
+            response.setdefault(name, value)
+    return response
+
+
+def _error_response(error):
+    note = getattr(settings, 'SIMPLEKEYS_ERROR_NOTE', None)
+    # RateLimitError & QuotaError are both 429s
+    status = 403 if isinstance(error, VerificationError) else 429
+    response = JsonResponse({'error': str(error), 'note': note},
+                            status=status)
+    return add_rate_limit_headers(response, getattr(error, 'result', None))
+
+
+def verify_request(request, zone, cost=1):
+    """
+        verify the request's key, returning an error response if it isn't
+        allowed, otherwise None
+
+        the VerificationResult of an allowed request is kept as
+        request.simplekeys_result, see add_rate_limit_headers
+    """
+    try:
+        request.simplekeys_result = verify(_get_request_key(request), zone,
+                                           cost)
+    except (VerificationError, RateLimitError, QuotaError) as e:
+        return _error_response(e)
+
+    # pass through
+    return None
+
 
+async def averify_request(request, zone, cost=1):
+    """
+        async version of verify_request
+    """
     try:
-        verify(key, zone)
-    except VerificationError as e:
-        return JsonResponse({'error': str(e), 'note': note},
-                            status=403)
-    except RateLimitError as e:
-        return JsonResponse({'error': str(e), 'note': note},
-                            status=429)
-    except QuotaError as e:
-        return JsonResponse({'error': str(e), 'note': note},
-                            status=429)
+        request.simplekeys_result = await averify(_get_request_key(request),
+                                                  zone, cost)
+    except (VerificationError, RateLimitError, QuotaError) as e:
+        return _error_response(e)
 
     # pass through
     return None
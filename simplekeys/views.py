@@ -5,10 +5,11 @@ from django.core.mail import send_mail
 from django.shortcuts import render, redirect
 from django.template import loader
 from django.views.generic import View
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest
 
 from .forms import KeyRegistrationForm, KeyConfirmationForm
 from .models import Tier, Key
+from .metrics import metrics
 
 
 def _get_confirm_hash(key, email):
@@ -120,3 +121,16 @@ class ConfirmationView(View):
             return render(request, self.confirmed_template_name, {'key': key})
         else:
             return HttpResponseBadRequest('invalid request - invalid form')
+
+
+class MetricsView(View):
+    """
+        this process's verification metrics in the Prometheus text format
+
+        requires SIMPLEKEYS_METRICS, protect it as you would any other
+        internal endpoint
+    """
+
+    def get(self, request):
+        return HttpResponse(metrics.prometheus(),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,115 @@
+import re
+import functools
+
+
+# characters that make a pattern more than a literal prefix
+REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+# patterns that refer to their own groups by number or name can't be
+# combined with others
+GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?P<')
+
+
+class ZoneRouter(object):
+    """
+        maps request paths to zones according to a list of (pattern, zone)
+        or (pattern, zone, cost) rules, the first rule whose pattern
+        re.match()es the path wins
+
+        literal patterns (plain prefixes like '/api/v1/') are stored in a
+        trie, the rest are combined into a single regex of named
+        alternatives (alternatives are tried in order, so the first that
+        matches is the earliest rule).  Lookups are then a walk down the
+        path plus one regex match, however many rules there are, and the
+        most recent cache_size paths are remembered outright.
+    """
+
+    def __init__(self, rules, cache_size=1024):
+        self.zones = []
+        # cost of a request to each rule's paths, 1 unless given
+        self.costs = []
+        # char -> subtrie, None -> index of the earliest rule ending here
+        self._trie = {}
+        regexes = []
+        # compiled patterns & ones that can't be combined are tried alone
+        self._separate = []
+
+        for index, (pattern, zone, *cost) in enumerate(rules):
+            self.zones.append(zone)
+            self.costs.append(cost[0] if cost else 1)
+            if not isinstance(pattern, str):
+                self._separate.append((index, pattern))
+            elif not REGEX_CHARS.intersection(pattern):
+                self._add_literal(pattern, index)
+            elif GROUP_REFERENCE.search(pattern):
+                self._separate.append((index, re.compile(pattern)))
+            else:
+                regexes.append((index, pattern))
+
+        self._regex = None
+        if regexes:
+            try:
+                self._regex = re.compile('|'.join(
+                    '(?P<r{}>{})'.format(index, pattern)
+                    for index, pattern in regexes
+                ))
+            except re.error:
+                # e.g. inline flags, which must start the whole pattern
+                self._separate = sorted(self._separate + [
+                    (index, re.compile(pattern)) for index, pattern in regexes
+                ], key=lambda item: item[0])
+        if cache_size:
+            self.get_route = functools.lru_cache(maxsize=cache_size)(
+                self.get_route
+            )
+
+    def _add_literal(self, prefix, index):
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, index)
+
+    def _match_index(self, path):
+        best = None
+
+        node = self._trie
+        if None in node:
+            best = node[None]
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node and (best is None or node[None] < best):
+                best = node[None]
+
+        if self._regex is not None:
+            match = self._regex.match(path)
+            if match:
+                index = int(match.lastgroup[1:])
+                if best is None or index < best:
+                    best = index
+
+        for index, pattern in self._separate:
+            if best is not None and index > best:
+                break
+            if pattern.match(path):
+                best = index
+                break
+
+        return best
+
+    def get_route(self, path):
+        """
+            returns (zone, cost) for path, or None if no rule matches
+        """
+        index = self._match_index(path)
+        if index is None:
+            return None
+        return self.zones[index], self.costs[index]
+
+    def get_zone(self, path):
+        """
+            returns the zone for path, or None if no rule matches
+        """
+        route = self.get_route(path)
+        return None if route is None else route[0]